@@ -0,0 +1,292 @@
+"""
+Архивация холодных данных.
+
+Опубликованные посты старше ARCHIVE_AFTER_DAYS и завершенные платежи
+переносятся из рабочих таблиц в архив:
+- PostgreSQL: таблицы <имя>_archive, секционированные по месяцам;
+- SQLite: сжатые NDJSON файлы ARCHIVE_DIR/<имя>/<ГГГГ-ММ>.ndjson.gz.
+
+Вместе с удалением строк пополняются итоги в stats_rollups, поэтому
+статистика в админ панели остается полной, а рабочие таблицы и их индексы
+- маленькими. После переноса удаляются тела постов (post_contents) и медиа
+(media_files), на которые больше не ссылается ни рабочий пост, ни архивный;
+в файловый архив тело поста копируется прямо в строку.
+"""
+
+import gzip
+import json
+import logging
+import os
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, bindparam, column, exists, inspect, select, table, text
+from sqlalchemy.orm import sessionmaker
+
+from config import Config
+from database import ScheduledPost, Payment, PostContent, MediaFile, add_to_rollup
+
+logger = logging.getLogger(__name__)
+
+
+class ArchiveSpec:
+    def __init__(self, model, time_column, condition, rollups, inline=None):
+        self.model = model
+        self.table = model.__table__
+        self.time_column = time_column
+        self.condition = condition  # cutoff -> условие отбора строк
+        self.rollups = rollups      # строки -> {имя итога: прирост}
+        self.inline = inline        # (session, строки) -> None, для файлового архива
+
+    @property
+    def name(self):
+        return self.table.name
+
+    @property
+    def archive_name(self):
+        return f"{self.table.name}_archive"
+
+
+def _inline_post_content(session, rows):
+    """
+    Файловый архив не может ссылаться на post_contents (тела без ссылок
+    удаляются): текст и медиа записываются в устаревшие колонки поста
+    """
+    content_ids = {row['content_id'] for row in rows if row['content_id']}
+    if not content_ids:
+        return
+    bodies = {
+        body.id: body for body in session.execute(
+            select(PostContent.id, PostContent.content, PostContent.media_type, MediaFile.file_id)
+            .outerjoin(MediaFile, MediaFile.id == PostContent.media_id)
+            .where(PostContent.id.in_(content_ids))
+        )
+    }
+    for row in rows:
+        body = bodies.get(row['content_id'])
+        if body:
+            row['content'] = body.content
+            row['media_type'] = body.media_type
+            row['media_file_id'] = body.file_id
+
+
+ARCHIVE_SPECS = [
+    ArchiveSpec(
+        ScheduledPost,
+        'schedule_time',
+        lambda cutoff: and_(ScheduledPost.is_published == True, ScheduledPost.schedule_time < cutoff),
+        lambda rows: {'published_posts': len(rows)},
+        inline=_inline_post_content
+    ),
+    ArchiveSpec(
+        Payment,
+        'created_at',
+        lambda cutoff: and_(Payment.is_completed == True, Payment.created_at < cutoff),
+        lambda rows: {
+            'completed_payments': len(rows),
+            'revenue': sum(row['amount'] or 0 for row in rows)
+        }
+    ),
+]
+
+
+def _month_start(value):
+    return datetime(value.year, value.month, 1)
+
+
+def _next_month(value):
+    return datetime(value.year + value.month // 12, value.month % 12 + 1, 1)
+
+
+class PostgresArchive:
+    """Архивные таблицы с помесячным секционированием"""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self._partitions = set()
+
+    def setup(self, spec):
+        inspector = inspect(self.engine)
+        with self.engine.begin() as conn:
+            conn.execute(text(
+                f'CREATE TABLE IF NOT EXISTS "{spec.archive_name}" (LIKE "{spec.name}") '
+                f'PARTITION BY RANGE ("{spec.time_column}")'
+            ))
+
+            # Новые колонки рабочей таблицы добавляем и в архив
+            archived = {c['name'] for c in inspector.get_columns(spec.archive_name)}
+            for column in spec.table.columns:
+                if column.name not in archived:
+                    column_type = column.type.compile(dialect=self.engine.dialect)
+                    conn.execute(text(
+                        f'ALTER TABLE "{spec.archive_name}" ADD COLUMN "{column.name}" {column_type}'
+                    ))
+
+    def _ensure_partition(self, session, spec, month):
+        name = f"{spec.archive_name}_y{month.year}m{month.month:02d}"
+        if name in self._partitions:
+            return
+        session.execute(text(
+            f'CREATE TABLE IF NOT EXISTS "{name}" PARTITION OF "{spec.archive_name}" '
+            f"FOR VALUES FROM ('{month:%Y-%m-%d}') TO ('{_next_month(month):%Y-%m-%d}')"
+        ))
+        self._partitions.add(name)
+
+    def content_references(self):
+        """Таблицы, чьи строки ссылаются на post_contents"""
+        return [
+            ScheduledPost.__table__,
+            table(f"{ScheduledPost.__tablename__}_archive", column('content_id'))
+        ]
+
+    def store(self, session, spec, rows):
+        """Копирует строки в архив в той же транзакции, что и удаление"""
+        for month in {_month_start(row[spec.time_column]) for row in rows}:
+            self._ensure_partition(session, spec, month)
+
+        columns = ', '.join(f'"{c.name}"' for c in spec.table.columns)
+        session.execute(
+            text(
+                f'INSERT INTO "{spec.archive_name}" ({columns}) '
+                f'SELECT {columns} FROM "{spec.name}" WHERE id IN :ids'
+            ).bindparams(bindparam('ids', expanding=True)),
+            {'ids': [row['id'] for row in rows]}
+        )
+
+
+class FileArchive:
+    """Сжатые NDJSON файлы для SQLite"""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def setup(self, spec):
+        os.makedirs(os.path.join(self.directory, spec.name), exist_ok=True)
+
+    def content_references(self):
+        # Архивные строки хранят тело поста в себе
+        return [ScheduledPost.__table__]
+
+    def store(self, session, spec, rows):
+        """
+        Дописывает строки в файлы до удаления из БД. При сбое между записью
+        и коммитом строка может попасть в архив дважды - читатели
+        дедуплицируют по id.
+        """
+        if spec.inline:
+            spec.inline(session, rows)
+
+        by_month = {}
+        for row in rows:
+            by_month.setdefault(f"{row[spec.time_column]:%Y-%m}", []).append(row)
+
+        for month, month_rows in by_month.items():
+            path = os.path.join(self.directory, spec.name, f"{month}.ndjson.gz")
+            with open(path, 'ab') as raw:
+                with gzip.GzipFile(fileobj=raw, mode='ab') as gz:
+                    for row in month_rows:
+                        gz.write(json.dumps(row, ensure_ascii=False, default=str).encode() + b'\n')
+                raw.flush()
+                os.fsync(raw.fileno())
+
+
+class Archiver:
+    def __init__(self, engine):
+        self.engine = engine
+        self.Session = sessionmaker(bind=engine)
+
+        if engine.dialect.name == 'postgresql':
+            self.backend = PostgresArchive(engine)
+        else:
+            self.backend = FileArchive(Config.ARCHIVE_DIR)
+
+        self._ready = False
+
+    def _setup(self):
+        if self._ready:
+            return
+        for spec in ARCHIVE_SPECS:
+            self.backend.setup(spec)
+        self._ready = True
+
+    def _archive_batch(self, session, spec, cutoff):
+        rows = [
+            dict(row._mapping) for row in session.execute(
+                select(spec.table)
+                .where(spec.condition(cutoff))
+                .order_by(spec.table.c.id)
+                .limit(Config.ARCHIVE_BATCH_SIZE)
+            )
+        ]
+        if not rows:
+            return 0
+
+        try:
+            self.backend.store(session, spec, rows)
+            session.execute(
+                spec.table.delete().where(spec.table.c.id.in_([row['id'] for row in rows]))
+            )
+            # Итоги ведутся отдельно по каждому арендатору
+            by_tenant = {}
+            for row in rows:
+                by_tenant.setdefault(row['tenant_id'], []).append(row)
+            for tenant_id, tenant_rows in by_tenant.items():
+                for name, delta in spec.rollups(tenant_rows).items():
+                    add_to_rollup(session, tenant_id, name, delta)
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+
+        return len(rows)
+
+    def _sweep_orphans(self, session, cutoff):
+        """
+        Удаляет тела постов и медиа без ссылок. Учитываются только строки
+        старше cutoff: свежие могут быть еще не привязаны к посту
+        """
+        contents = PostContent.__table__
+        media = MediaFile.__table__
+        try:
+            removed_contents = session.execute(
+                contents.delete().where(
+                    contents.c.created_at < cutoff,
+                    *[
+                        ~exists().where(references.c.content_id == contents.c.id)
+                        for references in self.backend.content_references()
+                    ]
+                )
+            ).rowcount
+            removed_media = session.execute(
+                media.delete().where(
+                    media.c.created_at < cutoff,
+                    ~exists().where(contents.c.media_id == media.c.id)
+                )
+            ).rowcount
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        return {contents.name: removed_contents, media.name: removed_media}
+
+    def run(self):
+        """Переносит в архив всё, что старше ARCHIVE_AFTER_DAYS"""
+        self._setup()
+        cutoff = datetime.utcnow() - timedelta(days=Config.ARCHIVE_AFTER_DAYS)
+        moved = {}
+
+        session = self.Session()
+        try:
+            for spec in ARCHIVE_SPECS:
+                total = 0
+                while True:
+                    count = self._archive_batch(session, spec, cutoff)
+                    total += count
+                    if count < Config.ARCHIVE_BATCH_SIZE:
+                        break
+                moved[spec.name] = total
+            swept = self._sweep_orphans(session, cutoff)
+        finally:
+            session.close()
+
+        logger.info(f"Архивация завершена: {moved}, удалено без ссылок: {swept}")
+        return moved
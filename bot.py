@@ -1,5 +1,7 @@
 import logging
 import asyncio
+import html
+import signal
 import sys
 from datetime import datetime, timedelta
 from typing import Optional
@@ -20,13 +22,37 @@ from telegram.ext import (
     ContextTypes,
     filters
 )
-from telegram.constants import ParseMode
-from telegram.error import Conflict
+from telegram.constants import MessageAttachmentType, ParseMode
+from telegram.error import BadRequest, Conflict
 
 from config import Config
-from database import init_db, get_or_create_user, get_user_subscription_info, User, UserChannel, ScheduledPost, Payment
+from database import (
+    init_db, get_or_create_user, get_user_subscription_info, get_rollups, claim_post, mark_post_failed, keyset_page,
+    mark_post_published, sqlite_maintenance,
+    User, UserChannel, ScheduledPost, Payment, PostContent, Broadcast
+)
+from archive import Archiver
+from content_store import get_or_create_content, remember_sent_media, sent_file_id
+from write_queue import WriteQueue
+from validation import validate_post
+from tenancy import (
+    install_tenant_filter, seed_default_tenant, active_tenants, tenant_scope, unscoped,
+    registry, TenantConfig
+)
+from broadcast import (
+    BroadcastEngine, create_broadcast, count_audience,
+    ALL, ACTIVE, EXPIRED, TARIFF_PREFIX, RUNNING, PAUSED, DONE, CANCELLED
+)
+from publisher import Publisher, StagedPost
+from channels import channel_rights, check_user_rights, parse_channel_reference
+from expiry import ExpiryTimeline, REMIND, KICK
+from lifecycle import Lifecycle
+from profiling import Profiler, CPROFILE, SAMPLE, MODES, as_document
+from tariffs import tariff_cache, EDITABLE_FIELDS, KEY_RE, parse_field_value
+from payments import CURRENCY, make_invoice_payload, check_pre_checkout, apply_successful_payment
+from sqlalchemy import func
+from sqlalchemy.orm import Session
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from apscheduler.triggers.date import DateTrigger
 import pytz
 
 # Настройка логирования
@@ -39,18 +65,105 @@ logger = logging.getLogger(__name__)
 # Инициализация базы данных
 session = init_db()
 
+# Данные ботов-арендаторов разделяются по tenant_id
+install_tenant_filter()
+default_tenant = seed_default_tenant(session)
+
+# Загрузка каталога тарифов в память
+tariff_cache.seed(session)
+tariff_cache.load(session)
+
 # Инициализация планировщика
 scheduler = AsyncIOScheduler(timezone="UTC")
 
+# Очередь коротких записей с групповым коммитом
+write_queue = WriteQueue(
+    session.get_bind(),
+    batch_size=Config.WRITE_BATCH_SIZE,
+    window_ms=Config.WRITE_BATCH_WINDOW_MS
+)
+
+# Диспетчер публикаций
+publisher = Publisher(
+    session,
+    lookahead=Config.PUBLISH_LOOKAHEAD_SECONDS,
+    concurrency=Config.PUBLISH_CONCURRENCY
+)
+
+# Учет работ в процессе для корректной остановки
+lifecycle = Lifecycle()
+
+# Сколько раз пытаться снять захват публикации после неудачной отправки
+RELEASE_ATTEMPTS = 3
+
+# События окончания подписок (напоминания и кики)
+expiry_timeline = ExpiryTimeline(scheduler)
+
+# Рассылки администратора
+broadcasts = BroadcastEngine(
+    session,
+    write_queue,
+    lifecycle,
+    rate=Config.BROADCAST_RATE,
+    concurrency=Config.BROADCAST_CONCURRENCY,
+    page_size=Config.BROADCAST_PAGE_SIZE,
+    report_interval=Config.BROADCAST_REPORT_SECONDS
+)
+
+# Перенос старых постов и платежей в архив
+archiver = Archiver(session.get_bind())
+
+# Профилирование по запросу администратора
+profiler = Profiler(session.get_bind())
+
+# Курсор страницы в callback_data (лимит 64 байта)
+CURSOR_TIME_FORMAT = "%Y%m%dT%H%M%S%f"
+
+def encode_cursor(schedule_time, post_id):
+    return f"{schedule_time.strftime(CURSOR_TIME_FORMAT)}_{post_id}"
+
+def decode_cursor(value):
+    time_str, post_id = value.split('_')
+    return datetime.strptime(time_str, CURSOR_TIME_FORMAT), int(post_id)
+
+BROADCAST_AUDIENCE_LABELS = {
+    ALL: "все пользователи",
+    ACTIVE: "с активной подпиской",
+    EXPIRED: "с истекшей подпиской",
+}
+
+BROADCAST_STATUS_LABELS = {
+    RUNNING: "🚀",
+    PAUSED: "⏸",
+    DONE: "✅",
+    CANCELLED: "⛔️",
+}
+
 class TelegramBot:
-    def __init__(self):
-        self.config = Config
+    def __init__(self, tenant):
+        self.config = TenantConfig(tenant)
+        self.tenant_id = tenant.id
+        self.maintenance_runs = 0
+    
+    def leave_input_steps(self, context):
+        """
+        Переход в другое меню прерывает ввод канала и ввод в админ панели,
+        иначе следующий пост был бы принят за ссылку на канал или значение тарифа
+        """
+        for key in ('channel_step', 'admin_step', 'admin_tariff'):
+            context.user_data.pop(key, None)
         
     async def start(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработчик команды /start"""
         user = update.effective_user
+        self.leave_input_steps(context)
         db_user = get_or_create_user(session, user.id, user.username, user.first_name, user.last_name)
         
+        # Пользователь снова написал боту - значит, разблокировал его
+        if db_user.is_blocked:
+            db_user.is_blocked = False
+            session.commit()
+        
         welcome_text = (
             f"👋 Привет, {user.first_name}!\n\n"
             "🤖 Я бот для автоматической публикации контента в Telegram каналах.\n\n"
@@ -62,7 +175,7 @@ class TelegramBot:
             "📊 <b>Тарифы:</b>\n"
         )
         
-        for key, tariff in self.config.TARIFFS.items():
+        for key, tariff in tariff_cache.active():
             welcome_text += (
                 f"• <b>{tariff['name']}</b> - {tariff['stars']} звёзд\n"
                 f"  └ {tariff['channels_limit']} канала, {tariff['posts_per_day']} постов/день\n"
@@ -91,6 +204,7 @@ class TelegramBot:
         """Меню планирования поста"""
         query = update.callback_query
         await query.answer()
+        self.leave_input_steps(context)
         
         user_info = get_user_subscription_info(session, query.from_user.id)
         
@@ -105,10 +219,12 @@ class TelegramBot:
             return
         
         # Проверка лимита постов на сегодня
-        if user_info['posts_today'] >= self.config.TARIFFS[user_info['tariff']]['posts_per_day']:
+        tariff = tariff_cache.get(user_info['tariff'])
+        posts_limit = tariff['posts_per_day'] if tariff else 0
+        if user_info['posts_today'] >= posts_limit:
             await query.edit_message_text(
                 f"❌ Вы исчерпали лимит постов на сегодня ({user_info['posts_today']}/"
-                f"{self.config.TARIFFS[user_info['tariff']]['posts_per_day']}).\n"
+                f"{posts_limit}).\n"
                 "Лимит обновится в 00:00 по UTC.",
                 reply_markup=InlineKeyboardMarkup([
                     [InlineKeyboardButton("📊 Профиль", callback_data="profile")]
@@ -212,6 +328,10 @@ class TelegramBot:
                 )
                 return
             
+            if 'reschedule_post_id' in context.user_data:
+                await self.apply_reschedule(update, context, schedule_time)
+                return
+            
             context.user_data['schedule_time'] = schedule_time
             await self.request_post_content(update, context)
             
@@ -227,6 +347,14 @@ class TelegramBot:
         """Обработка контента поста"""
         user_id = update.effective_user.id
         
+        if context.user_data.get('admin_step') and user_id == self.config.ADMIN_ID:
+            await self.handle_admin_input(update, context)
+            return
+        
+        if context.user_data.get('channel_step') == 'waiting_channel':
+            await self.handle_channel_input(update, context)
+            return
+        
         if 'post_step' not in context.user_data:
             return
         
@@ -241,7 +369,10 @@ class TelegramBot:
         if not channels:
             await update.message.reply_text(
                 "❌ У вас нет подключенных каналов!\n"
-                "Добавьте каналы в настройках."
+                "Добавьте каналы в настройках.",
+                reply_markup=InlineKeyboardMarkup([
+                    [InlineKeyboardButton("➕ Добавить канал", callback_data="channel_add")]
+                ])
             )
             return
         
@@ -255,48 +386,101 @@ class TelegramBot:
         
         keyboard.append([InlineKeyboardButton("❌ Отмена", callback_data="main_menu")])
         
-        # Сохраняем контент
         message = update.message
-        context.user_data['post_content'] = message.text or message.caption
+        media, media_type = self.message_media(message)
+        
+        # Разметка и длина проверяются сейчас, а не в момент публикации
+        try:
+            content, fixes = validate_post(message.text or message.caption, media_type)
+        except ValueError as e:
+            await message.reply_text(
+                f"❌ <b>Пост не может быть опубликован:</b> {html.escape(str(e))}\n\n"
+                f"Отправьте исправленный пост.",
+                parse_mode=ParseMode.HTML
+            )
+            return
+        
+        # Сохраняем контент
+        context.user_data['post_content'] = content
         context.user_data['post_media'] = None
+        context.user_data['media_type'] = media_type
         
-        if message.photo:
-            context.user_data['post_media'] = message.photo[-1].file_id
-            context.user_data['media_type'] = 'photo'
-        elif message.video:
-            context.user_data['post_media'] = message.video.file_id
-            context.user_data['media_type'] = 'video'
-        elif message.document:
-            context.user_data['post_media'] = message.document.file_id
-            context.user_data['media_type'] = 'document'
+        if media:
+            context.user_data['post_media'] = media.file_id
+            context.user_data['post_media_unique'] = media.file_unique_id
+        
+        fixes_text = ""
+        if fixes:
+            fixes_text = "⚠️ <b>Разметка исправлена:</b> " + ", ".join(fixes) + "\n\n"
         
         await message.reply_text(
-            "📢 <b>Выберите канал для публикации:</b>",
+            f"{fixes_text}📢 <b>Выберите канал для публикации:</b>",
             reply_markup=InlineKeyboardMarkup(keyboard),
             parse_mode=ParseMode.HTML
         )
         context.user_data['post_step'] = 'select_channel'
     
+    def message_media(self, message):
+        """
+        (медиа, тип) из сообщения или (None, None). Вложения других видов
+        (голосовые, стикеры, GIF и т.п.) возвращаются со своим типом, чтобы
+        validate_post их отклонил, а не принял пост как текстовый.
+        """
+        if message.effective_attachment is None:
+            return None, None
+        if message.photo:
+            return message.photo[-1], 'photo'
+        if message.video:
+            return message.video, 'video'
+        # У GIF заполнен и document, поэтому animation проверяется раньше
+        if message.document and not message.animation:
+            return message.document, 'document'
+        attachment_type = next(t for t in MessageAttachmentType if message[t])
+        return message.effective_attachment, attachment_type.value
+    
     async def confirm_and_schedule(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Подтверждение и сохранение запланированного поста"""
         query = update.callback_query
         await query.answer()
         
         channel_id = int(query.data.split('_')[-1])
-        channel = session.query(UserChannel).get(channel_id)
+        channel = self.own_channel(channel_id, query.from_user.id)
         
         if not channel:
             await query.edit_message_text("❌ Канал не найден!")
             return
         
+        # Повторная проверка: данные в user_data могли остаться от старой версии
+        try:
+            content, _ = validate_post(
+                context.user_data.get('post_content', ''),
+                context.user_data.get('media_type')
+            )
+        except ValueError as e:
+            await query.edit_message_text(
+                f"❌ <b>Пост не может быть опубликован:</b> {html.escape(str(e))}",
+                parse_mode=ParseMode.HTML,
+                reply_markup=InlineKeyboardMarkup([
+                    [InlineKeyboardButton("📅 Новый пост", callback_data="schedule_post")]
+                ])
+            )
+            return
+        
+        # Тело поста хранится один раз на одинаковый текст и медиа
+        body = get_or_create_content(
+            session,
+            content,
+            media_type=context.user_data.get('media_type'),
+            file_unique_id=context.user_data.get('post_media_unique'),
+            file_id=context.user_data.get('post_media')
+        )
+        
         # Сохраняем пост в БД
         new_post = ScheduledPost(
             user_id=channel.user_id,
             channel_id=channel_id,
-            content=context.user_data.get('post_content', ''),
-            media_type=context.user_data.get('media_type'),
-            media_file_id=context.user_data.get('post_media'),
-            schedule_time=context.user_data['schedule_time'],
+            content_id=body.id,
+            schedule_time=context.user_data['schedule_time'].replace(tzinfo=None),
             is_published=False
         )
         
@@ -304,7 +488,7 @@ class TelegramBot:
         session.commit()
         
         # Планируем публикацию
-        await self.schedule_publication(new_post.id, context.application)
+        publisher.schedule(new_post.id)
         
         time_str = context.user_data['schedule_time'].strftime("%Y.%m.%d %H:%M")
         
@@ -321,89 +505,193 @@ class TelegramBot:
         )
         
         # Очищаем временные данные
-        for key in ['post_step', 'schedule_time', 'post_content', 'post_media', 'media_type']:
+        for key in ['post_step', 'schedule_time', 'post_content', 'post_media', 'post_media_unique', 'media_type']:
             if key in context.user_data:
                 del context.user_data[key]
     
-    async def schedule_publication(self, post_id: int, application):
-        """Планирование публикации поста"""
-        post = session.query(ScheduledPost).get(post_id)
-        
-        if not post:
-            return
-        
-        trigger = DateTrigger(run_date=post.schedule_time)
-        
-        scheduler.add_job(
-            self.publish_scheduled_post,
-            trigger,
-            args=[post_id, application],
-            id=f"post_{post_id}",
-            replace_existing=True
-        )
-    
-    async def publish_scheduled_post(self, post_id: int, application):
-        """Публикация запланированного поста"""
-        post = session.query(ScheduledPost).get(post_id)
-        
-        if not post or post.is_published:
+    async def deliver_post(self, post: StagedPost, application):
+        """Отправка подготовленного поста в канал с захватом публикации"""
+        if not lifecycle.accepting:
+            # Идет остановка: пост останется в БД и будет выбран после запуска
             return
         
-        channel = post.channel
-        
-        try:
-            if post.media_type == 'photo':
-                await application.bot.send_photo(
-                    chat_id=channel.channel_id,
-                    photo=post.media_file_id,
-                    caption=post.content or None,
-                    parse_mode=ParseMode.HTML
-                )
-            elif post.media_type == 'video':
-                await application.bot.send_video(
-                    chat_id=channel.channel_id,
-                    video=post.media_file_id,
-                    caption=post.content or None,
-                    parse_mode=ParseMode.HTML
+        async with lifecycle.track('publish'):
+            post_id = post.post_id
+            
+            # Не тратим запросы на каналы, где у бота нет прав
+            rights = await channel_rights.check(application.bot, post.chat_id)
+            if not rights['ok']:
+                logger.warning(f"Пост {post_id} пропущен: {rights['reason']} ({post.chat_id})")
+                await write_queue.run(mark_post_failed, post_id, rights['reason'])
+                await application.bot.send_message(
+                    chat_id=post.user_telegram_id,
+                    text=f"❌ Пост не опубликован в '{post.channel_name}': {rights['reason']}.\n"
+                         f"Выдайте боту права администратора и перенесите пост в разделе «Мои посты»."
                 )
-            elif post.media_type == 'document':
-                await application.bot.send_document(
-                    chat_id=channel.channel_id,
-                    document=post.media_file_id,
-                    caption=post.content or None,
-                    parse_mode=ParseMode.HTML
+                return
+            
+            # Захват публикации: пост отправит только тот процесс, который первым
+            # отметил publish_started_at (важно, когда старый и новый инстансы
+            # работают одновременно во время деплоя)
+            if not await write_queue.run(claim_post, post_id):
+                logger.info(f"Пост {post_id} уже публикуется другим процессом")
+                return
+            
+            try:
+                message = await self.send_post_content(
+                    application.bot, post.chat_id, post.content, post.media_type, post.file_id
                 )
-            else:
+            except Exception as e:
+                logger.error(f"Ошибка публикации поста {post_id}: {e}")
+                await self.release_post(post_id, str(e))
                 await application.bot.send_message(
-                    chat_id=channel.channel_id,
-                    text=post.content or " ",
-                    parse_mode=ParseMode.HTML
+                    chat_id=post.user_telegram_id,
+                    text=f"❌ Ошибка публикации поста в '{post.channel_name}': {str(e)}"
                 )
+                return
             
-            post.is_published = True
-            session.commit()
+            # Отметки о публикации в пиковые минуты уходят одним коммитом на пачку
+            sent_media_file_id = sent_file_id(message, post.media_type)
+            
+            def finish(write_session):
+                mark_post_published(write_session, post_id, message.message_id)
+                if post.media_id:
+                    remember_sent_media(write_session, post.media_id, sent_media_file_id)
+            
+            await write_queue.run(finish)
             
             # Уведомляем пользователя
-            await application.bot.send_message(
-                chat_id=post.user.telegram_id,
-                text=f"✅ Пост опубликован в канале '{channel.channel_name}'!"
+            try:
+                await application.bot.send_message(
+                    chat_id=post.user_telegram_id,
+                    text=f"✅ Пост опубликован в канале '{post.channel_name}'!"
+                )
+            except Exception as e:
+                logger.error(f"Не удалось уведомить пользователя {post.user_telegram_id}: {e}")
+    
+    async def send_post_content(self, bot, chat_id, content, media_type, file_id):
+        """Отправка тела поста в канал"""
+        if media_type == 'photo':
+            return await bot.send_photo(
+                chat_id=chat_id,
+                photo=file_id,
+                caption=content or None,
+                parse_mode=ParseMode.HTML
             )
-            
-        except Exception as e:
-            logger.error(f"Ошибка публикации поста {post_id}: {e}")
-            await application.bot.send_message(
-                chat_id=post.user.telegram_id,
-                text=f"❌ Ошибка публикации поста в '{channel.channel_name}': {str(e)}"
+        elif media_type == 'video':
+            return await bot.send_video(
+                chat_id=chat_id,
+                video=file_id,
+                caption=content or None,
+                parse_mode=ParseMode.HTML
+            )
+        elif media_type == 'document':
+            return await bot.send_document(
+                chat_id=chat_id,
+                document=file_id,
+                caption=content or None,
+                parse_mode=ParseMode.HTML
+            )
+        else:
+            return await bot.send_message(
+                chat_id=chat_id,
+                text=content or " ",
+                parse_mode=ParseMode.HTML
             )
     
+    async def dispatch_post(self, post: StagedPost):
+        """Пост публикуется ботом своего арендатора"""
+        hosted = registry.get(post.tenant_id)
+        if not hosted:
+            return
+        bot, application = hosted
+        await bot.deliver_post(post, application)
+    
+    @property
+    def claim_timeout(self):
+        """Дольше захват публикации не держит ни один живой процесс (с учетом остановки)"""
+        return timedelta(seconds=self.config.SHUTDOWN_TIMEOUT * 2)
+    
+    async def release_post(self, post_id, error):
+        """Снимает захват после неудачной отправки, повторяя запись при сбое"""
+        for attempt in range(RELEASE_ATTEMPTS):
+            try:
+                await write_queue.run(mark_post_failed, post_id, error)
+                return
+            except Exception as e:
+                logger.error(f"Не удалось снять захват поста {post_id} (попытка {attempt + 1}): {e}")
+                if attempt < RELEASE_ATTEMPTS - 1:
+                    await asyncio.sleep(2 ** attempt)
+        
+        # Захват остался: пост разберет проверка прерванных публикаций
+        self.schedule_recovery(datetime.utcnow() + self.claim_timeout)
+    
+    def schedule_recovery(self, run_date):
+        """Отложенная проверка прерванных публикаций (не позже уже запланированной)"""
+        run_date = pytz.utc.localize(run_date + timedelta(seconds=1))
+        job = scheduler.get_job("recover_interrupted_posts")
+        if job and job.next_run_time and job.next_run_time <= run_date:
+            return
+        scheduler.add_job(
+            unscoped(self.recover_interrupted_posts),
+            'date',
+            run_date=run_date,
+            id="recover_interrupted_posts",
+            replace_existing=True
+        )
+    
+    async def recover_interrupted_posts(self, tenant_ids=None):
+        """
+        Посты, публикация которых оборвалась при падении процесса. Только
+        арендаторов, чьи боты запущены (по умолчанию - всех запущенных):
+        остальных некому уведомить, их посты разберет запуск их бота
+        """
+        tenant_ids = registry.tenant_ids() if tenant_ids is None else tenant_ids
+        interrupted_before = datetime.utcnow() - self.claim_timeout
+        interrupted = session.query(ScheduledPost).filter(
+            ScheduledPost.tenant_id.in_(tenant_ids),
+            ScheduledPost.is_published == False,
+            ScheduledPost.publish_started_at < interrupted_before
+        ).all()
+        
+        for post in interrupted:
+            # Неизвестно, вышел ли пост. Повторная отправка может дать дубль,
+            # поэтому просим пользователя проверить канал
+            post.is_published = True
+            session.commit()
+            logger.warning(f"Публикация поста {post.id} была прервана")
+            hosted = registry.get(post.tenant_id)
+            if not hosted:
+                continue
+            try:
+                await hosted[1].bot.send_message(
+                    chat_id=post.user.telegram_id,
+                    text=f"⚠️ Публикация поста в '{post.channel.channel_name}' была прервана "
+                         f"перезапуском бота. Проверьте канал и при необходимости запланируйте пост снова."
+                )
+            except Exception as e:
+                logger.error(f"Не удалось уведомить пользователя {post.user.telegram_id}: {e}")
+        
+        # Недавно захваченные посты может еще публиковать другой процесс
+        # (старый инстанс во время деплоя) - проверяем их, когда окно истечет
+        claimed_since = session.query(func.min(ScheduledPost.publish_started_at)).filter(
+            ScheduledPost.tenant_id.in_(tenant_ids),
+            ScheduledPost.is_published == False,
+            ScheduledPost.publish_started_at >= interrupted_before
+        ).scalar()
+        if claimed_since:
+            self.schedule_recovery(claimed_since + self.claim_timeout)
+    
     async def show_tariffs(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Показ тарифов"""
         query = update.callback_query
         await query.answer()
+        self.leave_input_steps(context)
         
         text = "💎 <b>Доступные тарифы:</b>\n\n"
+        tariffs = tariff_cache.active()
         
-        for key, tariff in self.config.TARIFFS.items():
+        for key, tariff in tariffs:
             text += (
                 f"✨ <b>{tariff['name']}</b>\n"
                 f"   Стоимость: {tariff['stars']} звёзд\n"
@@ -413,7 +701,7 @@ class TelegramBot:
             )
         
         keyboard = []
-        for key, tariff in self.config.TARIFFS.items():
+        for key, tariff in tariffs:
             keyboard.append([InlineKeyboardButton(
                 f"Купить {tariff['name']} - {tariff['stars']} звёзд",
                 callback_data=f"buy_{key}"
@@ -433,39 +721,63 @@ class TelegramBot:
         await query.answer()
         
         tariff_key = query.data.split('_')[1]
-        tariff = self.config.TARIFFS.get(tariff_key)
+        tariff = tariff_cache.get(tariff_key)
         
-        if not tariff:
+        if not tariff or not tariff['is_active']:
             await query.edit_message_text("❌ Тариф не найден!")
             return
         
-        # Здесь должен быть код для создания платежа через Telegram Stars
-        # Вместо этого сделаем симуляцию платежа для демонстрации
-        
         user_id = query.from_user.id
-        user = session.query(User).filter_by(telegram_id=user_id).first()
         
-        # Создаем запись о платеже
-        payment = Payment(
-            user_id=user.id,
-            amount=tariff['stars'],
-            tariff=tariff_key,
-            is_completed=True  # В реальности проверять через API
+        await context.bot.send_invoice(
+            chat_id=user_id,
+            title=f"Тариф {tariff['name']}",
+            description=(
+                f"{tariff['channels_limit']} каналов, {tariff['posts_per_day']} постов/день "
+                f"на {tariff['duration_days']} дней"
+            ),
+            payload=make_invoice_payload(tariff_key, user_id, tariff['stars']),
+            provider_token="",
+            currency=CURRENCY,
+            prices=[LabeledPrice(tariff['name'], tariff['stars'])]
         )
-        session.add(payment)
         
-        # Активируем подписку
-        from datetime import datetime, timedelta
-        user.tariff = tariff_key
-        user.subscription_end = datetime.utcnow() + timedelta(days=tariff['duration_days'])
-        session.commit()
+        await query.edit_message_text(
+            f"💳 Счет на тариф <b>{tariff['name']}</b> ({tariff['stars']} звёзд) отправлен ниже.\n"
+            f"Подписка активируется сразу после оплаты.",
+            parse_mode=ParseMode.HTML,
+            reply_markup=InlineKeyboardMarkup([
+                [InlineKeyboardButton("🔙 К тарифам", callback_data="tariffs")]
+            ])
+        )
+    
+    async def pre_checkout(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Подтверждение платежа (Telegram ждет ответ не дольше 10 секунд)"""
+        query = update.pre_checkout_query
+        ok, error = check_pre_checkout(query)
+        
+        if ok:
+            await query.answer(ok=True)
+        else:
+            await query.answer(ok=False, error_message=error)
+    
+    async def successful_payment(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Зачисление оплаты и активация подписки"""
+        user = update.effective_user
+        get_or_create_user(session, user.id, user.username, user.first_name, user.last_name)
+        
+        db_user, tariff = apply_successful_payment(session, user.id, update.message.successful_payment)
+        if not db_user:
+            return
+        
+        expiry_timeline.push(db_user.id, db_user.subscription_end)
         
         # Отправляем приглашение в приватный канал
         if self.config.PRIVATE_CHANNEL_LINK:
-            await query.edit_message_text(
+            await update.message.reply_text(
                 f"✅ <b>Подписка активирована!</b>\n\n"
                 f"Тариф: {tariff['name']}\n"
-                f"Действует до: {user.subscription_end.strftime('%Y.%m.%d %H:%M')} UTC\n\n"
+                f"Действует до: {db_user.subscription_end.strftime('%Y.%m.%d %H:%M')} UTC\n\n"
                 f"Приглашение в приватный канал: {self.config.PRIVATE_CHANNEL_LINK}\n\n"
                 f"⚠️ Подписка автоматически отменится через {tariff['duration_days']} дней.",
                 parse_mode=ParseMode.HTML,
@@ -475,10 +787,10 @@ class TelegramBot:
                 ])
             )
         else:
-            await query.edit_message_text(
+            await update.message.reply_text(
                 f"✅ <b>Подписка активирована!</b>\n\n"
                 f"Тариф: {tariff['name']}\n"
-                f"Действует до: {user.subscription_end.strftime('%Y.%m.%d %H:%M')} UTC\n\n"
+                f"Действует до: {db_user.subscription_end.strftime('%Y.%m.%d %H:%M')} UTC\n\n"
                 f"⚠️ Свяжитесь с администратором для получения доступа к приватному каналу.",
                 parse_mode=ParseMode.HTML
             )
@@ -497,18 +809,26 @@ class TelegramBot:
         active_users = session.query(User).filter(
             User.subscription_end > datetime.utcnow()
         ).count()
+        blocked_users = session.query(User).filter_by(is_blocked=True).count()
         
-        total_payments = session.query(Payment).filter_by(is_completed=True).count()
-        total_revenue = sum(p.amount for p in session.query(Payment).filter_by(is_completed=True).all())
+        # Рабочие таблицы + итоги по строкам, перенесенным в архив
+        rollups = get_rollups(session)
+        
+        total_payments = session.query(Payment).filter_by(is_completed=True).count() \
+            + rollups.get('completed_payments', 0)
+        total_revenue = (session.query(func.sum(Payment.amount)).filter_by(is_completed=True).scalar() or 0) \
+            + rollups.get('revenue', 0)
         
         scheduled_posts = session.query(ScheduledPost).filter_by(is_published=False).count()
-        published_posts = session.query(ScheduledPost).filter_by(is_published=True).count()
+        published_posts = session.query(ScheduledPost).filter_by(is_published=True).count() \
+            + rollups.get('published_posts', 0)
         
         text = (
             f"⚙️ <b>Админ панель</b>\n\n"
             f"👥 <b>Пользователи:</b>\n"
             f"• Всего: {total_users}\n"
-            f"• Активных: {active_users}\n\n"
+            f"• Активных: {active_users}\n"
+            f"• Заблокировали бота: {blocked_users}\n\n"
             f"💰 <b>Финансы:</b>\n"
             f"• Всего платежей: {total_payments}\n"
             f"• Общий доход: {total_revenue} звёзд\n\n"
@@ -522,6 +842,8 @@ class TelegramBot:
             [InlineKeyboardButton("📥 Экспорт БД", callback_data="export_db")],
             [InlineKeyboardButton("⚙️ Настройка тарифов", callback_data="admin_tariffs")],
             [InlineKeyboardButton("📢 Управление каналами", callback_data="admin_channels")],
+            [InlineKeyboardButton("📣 Рассылка", callback_data="admin_broadcast")],
+            [InlineKeyboardButton("🔬 Профилирование", callback_data="admin_profiling")],
             [InlineKeyboardButton("🔙 Назад", callback_data="main_menu")]
         ]
         
@@ -580,66 +902,84 @@ class TelegramBot:
             ])
         )
     
-    async def main_menu(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Возврат в главное меню"""
+    async def admin_tariffs(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Список тарифов в админ панели"""
         query = update.callback_query
         await query.answer()
         
-        user = update.effective_user
+        if query.from_user.id != self.config.ADMIN_ID:
+            await query.edit_message_text("❌ Доступ запрещен!")
+            return
         
-        keyboard = [
-            [InlineKeyboardButton("📅 Запланировать пост", callback_data="schedule_post")],
-            [InlineKeyboardButton("💎 Тарифы и подписка", callback_data="tariffs")],
-            [InlineKeyboardButton("📊 Мои каналы", callback_data="my_channels"),
-             InlineKeyboardButton("📝 Мои посты", callback_data="my_posts")],
-            [InlineKeyboardButton("👤 Профиль", callback_data="profile")]
-        ]
+        context.user_data.pop('admin_step', None)
         
-        if user.id == self.config.ADMIN_ID:
-            keyboard.append([InlineKeyboardButton("⚙️ Админ панель", callback_data="admin_panel")])
+        text = f"⚙️ <b>Настройка тарифов</b> (версия {tariff_cache.version})\n\n"
+        keyboard = []
+        
+        for key, tariff in tariff_cache.all():
+            status = "✅" if tariff['is_active'] else "⛔️"
+            text += (
+                f"{status} <b>{tariff['name']}</b> (<code>{key}</code>)\n"
+                f"   {tariff['stars']} звёзд, {tariff['channels_limit']} каналов, "
+                f"{tariff['posts_per_day']} постов/день, {tariff['duration_days']} дней\n\n"
+            )
+            keyboard.append([InlineKeyboardButton(
+                f"{status} {tariff['name']}",
+                callback_data=f"admin_tariff_{key}"
+            )])
+        
+        keyboard.append([InlineKeyboardButton("➕ Новый тариф", callback_data="tariff_add")])
+        keyboard.append([InlineKeyboardButton("🔙 В админку", callback_data="admin_panel")])
         
         await query.edit_message_text(
-            f"🏠 <b>Главное меню</b>\n\n"
-            f"Привет, {user.first_name}!\n"
-            f"Выберите действие:",
+            text,
             reply_markup=InlineKeyboardMarkup(keyboard),
             parse_mode=ParseMode.HTML
         )
     
-    async def show_profile(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Показ профиля пользователя"""
+    async def admin_tariff_detail(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Карточка тарифа с кнопками редактирования"""
         query = update.callback_query
         await query.answer()
         
-        user_info = get_user_subscription_info(session, query.from_user.id)
+        if query.from_user.id != self.config.ADMIN_ID:
+            await query.edit_message_text("❌ Доступ запрещен!")
+            return
         
-        if user_info and user_info['is_active']:
-            tariff_name = self.config.TARIFFS[user_info['tariff']]['name']
-            status = "✅ Активна"
-            end_date = user_info['subscription_end'].strftime("%Y.%m.%d %H:%M")
-        else:
-            tariff_name = "Нет"
-            status = "❌ Не активна"
-            end_date = "—"
+        context.user_data.pop('admin_step', None)
+        await self.render_tariff_detail(query, query.data[len("admin_tariff_"):])
+    
+    async def render_tariff_detail(self, query, key: str):
+        """Отрисовка карточки тарифа"""
+        tariff = tariff_cache.get(key)
         
-        text = (
-            f"👤 <b>Ваш профиль</b>\n\n"
-            f"🆔 ID: {query.from_user.id}\n"
-            f"📛 Имя: {query.from_user.first_name}\n"
-            f"📧 Юзернейм: @{query.from_user.username or 'не указан'}\n\n"
-            f"💎 <b>Подписка:</b>\n"
-            f"• Тариф: {tariff_name}\n"
-            f"• Статус: {status}\n"
-            f"• До: {end_date} UTC\n"
-            f"• Каналов: {user_info['channels_count'] if user_info else 0}\n"
-            f"• Постов сегодня: {user_info['posts_today'] if user_info else 0}"
-        )
+        if not tariff:
+            await query.edit_message_text("❌ Тариф не найден!")
+            return
         
-        keyboard = [
-            [InlineKeyboardButton("💎 Тарифы", callback_data="tariffs")],
-            [InlineKeyboardButton("📊 Мои каналы", callback_data="my_channels")],
-            [InlineKeyboardButton("🔙 Назад", callback_data="main_menu")]
-        ]
+        field_titles = {
+            'name': "Название",
+            'stars': "Стоимость (звёзды)",
+            'channels_limit': "Лимит каналов",
+            'posts_per_day': "Постов в день",
+            'duration_days': "Длительность (дни)",
+            'sort_order': "Порядок",
+        }
+        
+        text = f"⚙️ <b>Тариф {tariff['name']}</b> (<code>{key}</code>)\n\n"
+        keyboard = []
+        for field in EDITABLE_FIELDS:
+            text += f"• {field_titles[field]}: {tariff[field]}\n"
+            keyboard.append([InlineKeyboardButton(
+                f"✏️ {field_titles[field]}",
+                callback_data=f"tariff_edit_{key}_{field}"
+            )])
+        
+        keyboard.append([InlineKeyboardButton(
+            "⛔️ Отключить" if tariff['is_active'] else "✅ Включить",
+            callback_data=f"tariff_toggle_{key}"
+        )])
+        keyboard.append([InlineKeyboardButton("🔙 К тарифам", callback_data="admin_tariffs")])
         
         await query.edit_message_text(
             text,
@@ -647,71 +987,1169 @@ class TelegramBot:
             parse_mode=ParseMode.HTML
         )
     
-    async def check_subscriptions(self, application):
-        """Проверка подписок и кик просроченных пользователей"""
-        now = datetime.utcnow()
+    async def admin_tariff_action(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Редактирование поля, включение/отключение и создание тарифа"""
+        query = update.callback_query
+        await query.answer()
         
-        expired_users = session.query(User).filter(
-            User.subscription_end < now - timedelta(hours=self.config.KICK_AFTER_EXPIRY),
-            User.joined_channel == True
-        ).all()
+        if query.from_user.id != self.config.ADMIN_ID:
+            await query.edit_message_text("❌ Доступ запрещен!")
+            return
         
-        for user in expired_users:
-            try:
-                # Пытаемся кикнуть из канала
-                await application.bot.ban_chat_member(
-                    chat_id=self.config.PRIVATE_CHANNEL_ID,
-                    user_id=user.telegram_id
-                )
-                
-                # Разбаниваем, чтобы пользователь мог вступить снова
-                await application.bot.unban_chat_member(
-                    chat_id=self.config.PRIVATE_CHANNEL_ID,
-                    user_id=user.telegram_id
-                )
-                
-                user.joined_channel = False
-                session.commit()
-                
-                # Уведомляем пользователя
-                await application.bot.send_message(
-                    chat_id=user.telegram_id,
-                    text="❌ Ваша подписка истекла. Доступ к приватному каналу закрыт."
-                )
-                
-            except Exception as e:
-                logger.error(f"Ошибка при кике пользователя {user.telegram_id}: {e}")
-    
-    def setup_handlers(self, application):
-        """Настройка обработчиков"""
+        back = InlineKeyboardMarkup([[InlineKeyboardButton("❌ Отмена", callback_data="admin_tariffs")]])
         
-        # Команды
-        application.add_handler(CommandHandler("start", self.start))
-        application.add_handler(CommandHandler("admin", self.admin_panel))
+        if query.data == "tariff_add":
+            context.user_data['admin_step'] = 'tariff_add'
+            await query.edit_message_text(
+                "➕ <b>Новый тариф</b>\n\n"
+                "Отправьте строку в формате:\n"
+                "<code>ключ звёзды каналы посты дни Название</code>\n\n"
+                "Пример: <code>pro 2000 10 30 30 Профи</code>",
+                reply_markup=back,
+                parse_mode=ParseMode.HTML
+            )
+            return
         
-        # Обработчики callback-запросов
-        application.add_handler(CallbackQueryHandler(self.schedule_post, pattern="^schedule_post$"))
-        application.add_handler(CallbackQueryHandler(self.handle_time_selection, pattern="^post_"))
-        application.add_handler(CallbackQueryHandler(self.show_tariffs, pattern="^tariffs$"))
-        application.add_handler(CallbackQueryHandler(self.process_payment, pattern="^buy_"))
-        application.add_handler(CallbackQueryHandler(self.admin_panel, pattern="^admin_panel$"))
-        application.add_handler(CallbackQueryHandler(self.export_database, pattern="^export_db$"))
-        application.add_handler(CallbackQueryHandler(self.main_menu, pattern="^main_menu$"))
-        application.add_handler(CallbackQueryHandler(self.show_profile, pattern="^profile$"))
-        application.add_handler(CallbackQueryHandler(self.confirm_and_schedule, pattern="^select_channel_"))
-        application.add_handler(CallbackQueryHandler(self.request_post_content, pattern="^custom_date$"))
+        if query.data.startswith("tariff_toggle_"):
+            key = query.data[len("tariff_toggle_"):]
+            tariff = tariff_cache.get(key)
+            if tariff:
+                tariff_cache.update(session, key, is_active=not tariff['is_active'])
+            await self.render_tariff_detail(query, key)
+            return
         
-        # Обработчики сообщений
-        application.add_handler(MessageHandler(
-            filters.TEXT & ~filters.COMMAND & filters.Regex(r'^\d{4}\.\d{2}\.\d{2} \d{2}:\d{2}$'),
-            self.handle_custom_date
-        ))
+        # tariff_edit_<key>_<field>
+        key, field = query.data[len("tariff_edit_"):].split('_', 1)
+        if field not in EDITABLE_FIELDS or not tariff_cache.get(key):
+            await query.edit_message_text("❌ Тариф не найден!")
+            return
+        
+        context.user_data['admin_step'] = 'tariff_edit'
+        context.user_data['admin_tariff'] = (key, field)
+        
+        await query.edit_message_text(
+            f"✏️ Введите новое значение поля <code>{field}</code> "
+            f"(сейчас: {tariff_cache.get(key)[field]}):",
+            reply_markup=back,
+            parse_mode=ParseMode.HTML
+        )
+    
+    async def handle_admin_input(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Обработка текстового ввода в админ панели"""
+        step = context.user_data.pop('admin_step', None)
+        if step == 'broadcast_content':
+            await self.handle_broadcast_content(update, context)
+            return
+        
+        text = (update.message.text or "").strip()
+        back = InlineKeyboardMarkup([[InlineKeyboardButton("🔙 К тарифам", callback_data="admin_tariffs")]])
+        
+        if step == 'tariff_edit':
+            key, field = context.user_data.pop('admin_tariff')
+            try:
+                value = parse_field_value(field, text)
+            except ValueError:
+                context.user_data['admin_step'] = step
+                context.user_data['admin_tariff'] = (key, field)
+                await update.message.reply_text("❌ Неверное значение! Попробуйте снова:")
+                return
+            
+            tariff_cache.update(session, key, **{field: value})
+            await update.message.reply_text(
+                f"✅ Тариф <code>{key}</code> обновлен: {field} = {value}",
+                reply_markup=back,
+                parse_mode=ParseMode.HTML
+            )
+        
+        elif step == 'tariff_add':
+            parts = text.split(maxsplit=5)
+            try:
+                key, stars, channels, posts, days, name = parts
+                numbers = [
+                    parse_field_value(field, raw) for field, raw in zip(
+                        ('stars', 'channels_limit', 'posts_per_day', 'duration_days'),
+                        (stars, channels, posts, days)
+                    )
+                ]
+                if not KEY_RE.match(key) or tariff_cache.get(key):
+                    raise ValueError("Неверный ключ")
+            except ValueError:
+                context.user_data['admin_step'] = step
+                await update.message.reply_text(
+                    "❌ Неверный формат или ключ уже занят!\n"
+                    "Ключ: латиница в нижнем регистре и цифры. "
+                    "Цена, лимит каналов и срок - не меньше 1. Попробуйте снова:"
+                )
+                return
+            
+            tariff_cache.create(session, key, name, *numbers)
+            await update.message.reply_text(
+                f"✅ Тариф <b>{name}</b> создан",
+                reply_markup=back,
+                parse_mode=ParseMode.HTML
+            )
+    
+    async def refresh_tariffs(self):
+        """Сверка версии каталога тарифов с БД"""
+        tariff_cache.refresh_if_stale(session)
+    
+    async def admin_profiling(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Меню профилирования"""
+        query = update.callback_query
+        await query.answer()
+        
+        if query.from_user.id != self.config.ADMIN_ID:
+            await query.edit_message_text("❌ Доступ запрещен!")
+            return
+        
+        if profiler.running:
+            text = f"🔬 <b>Профилирование</b>\n\nИдет захват ({profiler.mode})."
+            keyboard = [[InlineKeyboardButton("⏹ Остановить и получить отчет", callback_data="prof_stop")]]
+        else:
+            text = (
+                "🔬 <b>Профилирование</b>\n\n"
+                "• cProfile - точное время по функциям (.pstats)\n"
+                "• Сэмплинг - стеки для flamegraph, почти без накладных расходов\n\n"
+                f"Медленные SQL запросы (от {self.config.PROFILE_SLOW_SQL_MS} мс) записываются в обоих режимах.\n"
+                "Команда: <code>/profile 60 sample</code>"
+            )
+            keyboard = [
+                [InlineKeyboardButton("cProfile 30 с", callback_data=f"prof_start_{CPROFILE}_30"),
+                 InlineKeyboardButton("cProfile 120 с", callback_data=f"prof_start_{CPROFILE}_120")],
+                [InlineKeyboardButton("Сэмплинг 30 с", callback_data=f"prof_start_{SAMPLE}_30"),
+                 InlineKeyboardButton("Сэмплинг 120 с", callback_data=f"prof_start_{SAMPLE}_120")],
+            ]
+        keyboard.append([InlineKeyboardButton("🔙 В админку", callback_data="admin_panel")])
+        
+        await query.edit_message_text(
+            text,
+            reply_markup=InlineKeyboardMarkup(keyboard),
+            parse_mode=ParseMode.HTML
+        )
+    
+    async def profiling_action(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Запуск и остановка профилирования из меню"""
+        query = update.callback_query
+        await query.answer()
+        
+        if query.from_user.id != self.config.ADMIN_ID:
+            await query.edit_message_text("❌ Доступ запрещен!")
+            return
+        
+        back = InlineKeyboardMarkup([[InlineKeyboardButton("🔬 Профилирование", callback_data="admin_profiling")]])
+        
+        if query.data == "prof_stop":
+            await self.finish_profiling(context.bot)
+            await query.edit_message_text("✅ Профилирование остановлено, отчет отправлен.", reply_markup=back)
+            return
+        
+        _, _, mode, seconds = query.data.split('_')
+        message = self.start_profiling(context.bot, mode, int(seconds))
+        await query.edit_message_text(message, reply_markup=back)
+    
+    async def profile_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """/profile [секунды] [cprofile|sample] или /profile stop"""
+        if update.effective_user.id != self.config.ADMIN_ID:
+            return
+        
+        args = context.args or []
+        if args and args[0] == 'stop':
+            await self.finish_profiling(context.bot)
+            return
+        
+        try:
+            seconds = int(args[0]) if args else 30
+            mode = args[1] if len(args) > 1 else CPROFILE
+        except ValueError:
+            seconds, mode = 0, None
+        
+        if mode not in MODES or seconds <= 0:
+            await update.message.reply_text(
+                "Использование: <code>/profile 60 cprofile</code>, <code>/profile 60 sample</code> "
+                "или <code>/profile stop</code>",
+                parse_mode=ParseMode.HTML
+            )
+            return
+        
+        await update.message.reply_text(self.start_profiling(context.bot, mode, seconds))
+    
+    def start_profiling(self, bot, mode: str, seconds: int) -> str:
+        if profiler.running:
+            return f"⚠️ Профилирование уже идет ({profiler.mode})."
+        
+        seconds = min(seconds, self.config.PROFILE_MAX_SECONDS)
+        profiler.start(mode)
+        # Завершение по таймеру; ручная остановка просто опередит его
+        started_at = profiler.started_at
+        asyncio.get_running_loop().call_later(
+            seconds,
+            lambda: asyncio.ensure_future(self.finish_profiling(bot, started_at))
+        )
+        return f"🔬 Профилирование ({mode}) запущено на {seconds} с. Отчет придет в личные сообщения."
+    
+    async def finish_profiling(self, bot, started_at=None):
+        """Останавливает захват и отправляет отчет администратору"""
+        # Таймер от прошлого захвата не должен останавливать новый
+        if not profiler.running or (started_at is not None and started_at != profiler.started_at):
+            return
+        
+        mode = profiler.mode
+        for name, data in profiler.stop():
+            await bot.send_document(
+                chat_id=self.config.ADMIN_ID,
+                document=as_document(name, data),
+                caption=f"🔬 Профилирование ({mode})"
+            )
+    
+    def broadcast_audience_label(self, audience: str) -> str:
+        if audience.startswith(TARIFF_PREFIX):
+            tariff = tariff_cache.get(audience[len(TARIFF_PREFIX):])
+            name = tariff['name'] if tariff else audience[len(TARIFF_PREFIX):]
+            return f"тариф {name}"
+        return BROADCAST_AUDIENCE_LABELS.get(audience, audience)
+    
+    def format_broadcast(self, broadcast) -> str:
+        """Строка прогресса рассылки (Broadcast или выполняющийся BroadcastRun)"""
+        broadcast_id = broadcast.id if isinstance(broadcast, Broadcast) else broadcast.broadcast_id
+        run = broadcasts.get_run(broadcast_id)
+        source = run or broadcast
+        status = (run.requested_status or run.status) if run else broadcast.status
+        processed = source.sent + source.failed + source.blocked
+        percent = processed * 100 // source.total if source.total else 100
+        
+        text = (
+            f"{BROADCAST_STATUS_LABELS.get(status, status)} <b>Рассылка #{broadcast_id}</b> "
+            f"({self.broadcast_audience_label(source.audience)})\n"
+            f"Обработано: {processed} из {source.total} ({percent}%)\n"
+            f"✅ {source.sent}  ❌ {source.failed}  🚫 {source.blocked}"
+        )
+        if run and status == RUNNING:
+            eta = run.eta
+            text += f"\n⚡️ {run.throughput:.1f} сообщ./с"
+            if eta is not None:
+                text += f", осталось ~{timedelta(seconds=int(eta))}"
+        return text
+    
+    def broadcast_controls(self, broadcast_id: int, status: str):
+        keyboard = []
+        if status == RUNNING:
+            keyboard.append([
+                InlineKeyboardButton("⏸ Пауза", callback_data=f"bcast_pause_{broadcast_id}"),
+                InlineKeyboardButton("⛔️ Отменить", callback_data=f"bcast_cancel_{broadcast_id}")
+            ])
+        elif status == PAUSED:
+            keyboard.append([
+                InlineKeyboardButton("▶️ Продолжить", callback_data=f"bcast_resume_{broadcast_id}"),
+                InlineKeyboardButton("⛔️ Отменить", callback_data=f"bcast_cancel_{broadcast_id}")
+            ])
+        keyboard.append([InlineKeyboardButton("🔙 К рассылкам", callback_data="admin_broadcast")])
+        return InlineKeyboardMarkup(keyboard)
+    
+    async def admin_broadcast(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Рассылки: выбор аудитории новой рассылки и последние рассылки"""
+        query = update.callback_query
+        await query.answer()
+        
+        if query.from_user.id != self.config.ADMIN_ID:
+            await query.edit_message_text("❌ Доступ запрещен!")
+            return
+        
+        context.user_data.pop('admin_step', None)
+        
+        recent = session.query(Broadcast).populate_existing().order_by(Broadcast.id.desc()).limit(5).all()
+        
+        text = "📣 <b>Рассылка</b>\n\nВыберите получателей новой рассылки."
+        if recent:
+            text += "\n\n<b>Последние рассылки:</b>\n\n" + "\n\n".join(self.format_broadcast(b) for b in recent)
+        
+        keyboard = [
+            [InlineKeyboardButton(f"👥 {BROADCAST_AUDIENCE_LABELS[ALL].capitalize()}", callback_data=f"bcast_new_{ALL}")],
+            [InlineKeyboardButton(f"✅ {BROADCAST_AUDIENCE_LABELS[ACTIVE].capitalize()}", callback_data=f"bcast_new_{ACTIVE}")],
+            [InlineKeyboardButton(f"⌛️ {BROADCAST_AUDIENCE_LABELS[EXPIRED].capitalize()}", callback_data=f"bcast_new_{EXPIRED}")],
+        ]
+        for key, tariff in tariff_cache.active():
+            keyboard.append([InlineKeyboardButton(
+                f"💎 Тариф {tariff['name']}",
+                callback_data=f"bcast_new_{TARIFF_PREFIX}{key}"
+            )])
+        for broadcast in recent:
+            if broadcast.status in (RUNNING, PAUSED):
+                keyboard.append([InlineKeyboardButton(
+                    f"📊 Рассылка #{broadcast.id}",
+                    callback_data=f"bcast_show_{broadcast.id}"
+                )])
+        keyboard.append([InlineKeyboardButton("🔙 В админку", callback_data="admin_panel")])
+        
+        await query.edit_message_text(
+            text,
+            reply_markup=InlineKeyboardMarkup(keyboard),
+            parse_mode=ParseMode.HTML
+        )
+    
+    async def broadcast_action(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Создание, запуск, пауза, продолжение и отмена рассылки"""
+        query = update.callback_query
+        
+        if query.from_user.id != self.config.ADMIN_ID:
+            await query.answer("❌ Доступ запрещен!", show_alert=True)
+            return
+        
+        action, _, arg = query.data[len("bcast_"):].partition('_')
+        back = InlineKeyboardMarkup([[InlineKeyboardButton("🔙 К рассылкам", callback_data="admin_broadcast")]])
+        
+        if action == 'new':
+            await query.answer()
+            context.user_data['admin_step'] = 'broadcast_content'
+            context.user_data['broadcast_audience'] = arg
+            await query.edit_message_text(
+                f"📣 Получатели: {self.broadcast_audience_label(arg)} ({count_audience(session, arg)})\n\n"
+                f"Отправьте сообщение для рассылки: текст или фото, видео, документ с подписью. "
+                f"Поддерживается HTML разметка.",
+                reply_markup=back
+            )
+            return
+        
+        if action == 'start':
+            draft = context.user_data.pop('broadcast_draft', None)
+            if not draft:
+                await query.answer("Черновик рассылки не найден", show_alert=True)
+                return
+            await query.answer()
+            
+            broadcast = create_broadcast(session, **draft)
+            broadcast.progress_chat_id = query.message.chat_id
+            broadcast.progress_message_id = query.message.message_id
+            session.commit()
+            
+            self.start_broadcast(broadcast, context.application)
+            await query.edit_message_text(
+                self.format_broadcast(broadcast),
+                reply_markup=self.broadcast_controls(broadcast.id, RUNNING),
+                parse_mode=ParseMode.HTML
+            )
+            return
+        
+        broadcast = session.query(Broadcast).populate_existing().filter_by(
+            id=int(arg), tenant_id=self.tenant_id
+        ).first() if arg.isdigit() else None
+        if not broadcast:
+            await query.answer("Рассылка не найдена", show_alert=True)
+            return
+        
+        if action in ('pause', 'cancel'):
+            status = PAUSED if action == 'pause' else CANCELLED
+            # Выполняющаяся рассылка сохранит статус после текущей страницы
+            if not broadcasts.request(broadcast.id, status) and broadcast.status in (RUNNING, PAUSED):
+                broadcast.status = status
+                if status == CANCELLED:
+                    broadcast.finished_at = datetime.utcnow()
+                session.commit()
+            await query.answer("⏸ Рассылка приостанавливается" if status == PAUSED else "⛔️ Рассылка отменяется")
+        
+        elif action == 'resume' and broadcast.status == PAUSED:
+            broadcast.status = RUNNING
+            broadcast.progress_chat_id = query.message.chat_id
+            broadcast.progress_message_id = query.message.message_id
+            session.commit()
+            self.start_broadcast(broadcast, context.application)
+            await query.answer("▶️ Рассылка продолжается")
+        
+        else:
+            await query.answer()
+        
+        run = broadcasts.get_run(broadcast.id)
+        status = (run.requested_status or run.status) if run else broadcast.status
+        try:
+            await query.edit_message_text(
+                self.format_broadcast(broadcast),
+                reply_markup=self.broadcast_controls(broadcast.id, status),
+                parse_mode=ParseMode.HTML
+            )
+        except BadRequest:
+            # Текст не изменился
+            pass
+    
+    async def handle_broadcast_content(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Сообщение рассылки от администратора: проверка и предпросмотр"""
+        message = update.message
+        audience = context.user_data.get('broadcast_audience', ALL)
+        media, media_type = self.message_media(message)
+        
+        try:
+            content, fixes = validate_post(message.text or message.caption, media_type)
+        except ValueError as e:
+            context.user_data['admin_step'] = 'broadcast_content'
+            await message.reply_text(
+                f"❌ {html.escape(str(e))}\n\nОтправьте исправленное сообщение:",
+                parse_mode=ParseMode.HTML
+            )
+            return
+        
+        context.user_data['broadcast_draft'] = {
+            'audience': audience,
+            'content': content,
+            'media_type': media_type,
+            'media_file_id': media.file_id if media else None
+        }
+        
+        # Предпросмотр ровно в том виде, в котором сообщение получат пользователи
+        await self.send_post_content(context.bot, message.chat_id, content, media_type, media.file_id if media else None)
+        
+        fixes_text = ""
+        if fixes:
+            fixes_text = "⚠️ <b>Разметка исправлена:</b> " + ", ".join(fixes) + "\n\n"
+        
+        await message.reply_text(
+            f"{fixes_text}📣 Это сообщение получат: {self.broadcast_audience_label(audience)} "
+            f"({count_audience(session, audience)}).",
+            reply_markup=InlineKeyboardMarkup([
+                [InlineKeyboardButton("🚀 Начать рассылку", callback_data="bcast_start")],
+                [InlineKeyboardButton("❌ Отмена", callback_data="admin_broadcast")]
+            ]),
+            parse_mode=ParseMode.HTML
+        )
+    
+    def broadcast_callbacks(self, application):
+        """(send, report) для движка рассылок"""
+        return (
+            lambda chat_id, run: self.send_post_content(
+                application.bot, chat_id, run.content, run.media_type, run.media_file_id
+            ),
+            lambda run: self.report_broadcast(application.bot, run)
+        )
+    
+    def start_broadcast(self, broadcast, application):
+        return broadcasts.start(broadcast, *self.broadcast_callbacks(application))
+    
+    async def report_broadcast(self, bot, run):
+        """Обновляет сообщение с прогрессом рассылки у администратора"""
+        if not run.progress_message_id:
+            return
+        try:
+            await bot.edit_message_text(
+                chat_id=run.progress_chat_id,
+                message_id=run.progress_message_id,
+                text=self.format_broadcast(run),
+                reply_markup=self.broadcast_controls(run.broadcast_id, run.requested_status or run.status),
+                parse_mode=ParseMode.HTML
+            )
+        except Exception as e:
+            logger.debug(f"Прогресс рассылки {run.broadcast_id} не обновлен: {e}")
+    
+    async def main_menu(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Возврат в главное меню"""
+        query = update.callback_query
+        await query.answer()
+        self.leave_input_steps(context)
+        
+        user = update.effective_user
+        
+        keyboard = [
+            [InlineKeyboardButton("📅 Запланировать пост", callback_data="schedule_post")],
+            [InlineKeyboardButton("💎 Тарифы и подписка", callback_data="tariffs")],
+            [InlineKeyboardButton("📊 Мои каналы", callback_data="my_channels"),
+             InlineKeyboardButton("📝 Мои посты", callback_data="my_posts")],
+            [InlineKeyboardButton("👤 Профиль", callback_data="profile")]
+        ]
+        
+        if user.id == self.config.ADMIN_ID:
+            keyboard.append([InlineKeyboardButton("⚙️ Админ панель", callback_data="admin_panel")])
+        
+        await query.edit_message_text(
+            f"🏠 <b>Главное меню</b>\n\n"
+            f"Привет, {user.first_name}!\n"
+            f"Выберите действие:",
+            reply_markup=InlineKeyboardMarkup(keyboard),
+            parse_mode=ParseMode.HTML
+        )
+    
+    async def show_profile(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Показ профиля пользователя"""
+        query = update.callback_query
+        await query.answer()
+        self.leave_input_steps(context)
+        
+        user_info = get_user_subscription_info(session, query.from_user.id)
+        
+        if user_info and user_info['is_active']:
+            tariff = tariff_cache.get(user_info['tariff'])
+            tariff_name = tariff['name'] if tariff else user_info['tariff']
+            status = "✅ Активна"
+            end_date = user_info['subscription_end'].strftime("%Y.%m.%d %H:%M")
+        else:
+            tariff_name = "Нет"
+            status = "❌ Не активна"
+            end_date = "—"
+        
+        text = (
+            f"👤 <b>Ваш профиль</b>\n\n"
+            f"🆔 ID: {query.from_user.id}\n"
+            f"📛 Имя: {query.from_user.first_name}\n"
+            f"📧 Юзернейм: @{query.from_user.username or 'не указан'}\n\n"
+            f"💎 <b>Подписка:</b>\n"
+            f"• Тариф: {tariff_name}\n"
+            f"• Статус: {status}\n"
+            f"• До: {end_date} UTC\n"
+            f"• Каналов: {user_info['channels_count'] if user_info else 0}\n"
+            f"• Постов сегодня: {user_info['posts_today'] if user_info else 0}"
+        )
+        
+        keyboard = [
+            [InlineKeyboardButton("💎 Тарифы", callback_data="tariffs")],
+            [InlineKeyboardButton("📊 Мои каналы", callback_data="my_channels")],
+            [InlineKeyboardButton("🔙 Назад", callback_data="main_menu")]
+        ]
+        
+        await query.edit_message_text(
+            text,
+            reply_markup=InlineKeyboardMarkup(keyboard),
+            parse_mode=ParseMode.HTML
+        )
+    
+    def channel_limit_state(self, user):
+        """(активных каналов, лимит тарифа) с учетом срока подписки"""
+        active_count = session.query(UserChannel).filter_by(user_id=user.id, is_active=True).count()
+        tariff = tariff_cache.get(user.tariff)
+        is_active = user.subscription_end and user.subscription_end > datetime.utcnow()
+        limit = tariff['channels_limit'] if tariff and is_active else 0
+        return active_count, limit
+    
+    async def my_channels(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Список каналов пользователя (постранично)"""
+        query = update.callback_query
+        await query.answer()
+        
+        self.leave_input_steps(context)
+        
+        user = session.query(User).filter_by(telegram_id=query.from_user.id).first()
+        if not user:
+            await query.edit_message_text("❌ Пользователь не найден!")
+            return
+        
+        # mychannels_<n|p>_<id>
+        after = before = None
+        if query.data.startswith("mychannels_"):
+            _, direction, channel_id = query.data.split('_')
+            if direction == 'n':
+                after = (int(channel_id),)
+            else:
+                before = (int(channel_id),)
+        
+        channels, has_prev, has_next = keyset_page(
+            session.query(UserChannel.id, UserChannel.channel_id, UserChannel.channel_name)
+            .filter(UserChannel.user_id == user.id, UserChannel.is_active == True),
+            [UserChannel.id],
+            self.config.PAGE_SIZE,
+            after=after,
+            before=before
+        )
+        active_count, limit = self.channel_limit_state(user)
+        
+        text = f"📊 <b>Мои каналы</b> ({active_count}/{limit})\n\n"
+        keyboard = []
+        
+        for channel in channels:
+            rights = channel_rights.get(context.bot, channel.channel_id)
+            status = "❔" if rights is None else ("✅" if rights['ok'] else "⚠️")
+            text += f"{status} {html.escape(channel.channel_name or channel.channel_id)}\n"
+            if rights and not rights['ok']:
+                text += f"   └ {rights['reason']}\n"
+            keyboard.append([InlineKeyboardButton(
+                f"🗑 Отключить {channel.channel_name}",
+                callback_data=f"channel_remove_{channel.id}"
+            )])
+        
+        if not channels:
+            text += "Каналы не подключены.\n"
+        
+        navigation = []
+        if has_prev:
+            navigation.append(InlineKeyboardButton("⬅️", callback_data=f"mychannels_p_{channels[0].id}"))
+        if has_next:
+            navigation.append(InlineKeyboardButton("➡️", callback_data=f"mychannels_n_{channels[-1].id}"))
+        if navigation:
+            keyboard.append(navigation)
+        
+        if active_count < limit:
+            keyboard.append([InlineKeyboardButton("➕ Добавить канал", callback_data="channel_add")])
+        keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data="main_menu")])
+        
+        await query.edit_message_text(
+            text,
+            reply_markup=InlineKeyboardMarkup(keyboard),
+            parse_mode=ParseMode.HTML
+        )
+    
+    async def my_posts(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Посты пользователя: запланированные или опубликованные (постранично)"""
+        query = update.callback_query
+        await query.answer()
+        
+        context.user_data.pop('reschedule_post_id', None)
+        self.leave_input_steps(context)
+        
+        user_id = session.query(User.id).filter_by(telegram_id=query.from_user.id).scalar()
+        if not user_id:
+            await query.edit_message_text("❌ Пользователь не найден!")
+            return
+        
+        # my_posts | myposts_<s|d> | myposts_<s|d>_<n|p>_<курсор>
+        kind, after, before = 's', None, None
+        if query.data.startswith("myposts_"):
+            parts = query.data.split('_', 3)
+            kind = parts[1]
+            if len(parts) == 4:
+                direction, cursor = parts[2], decode_cursor(parts[3])
+                if direction == 'n':
+                    after = cursor
+                else:
+                    before = cursor
+        published = kind == 'd'
+        
+        # Только колонки, которые выводятся на странице
+        page_query = session.query(
+            ScheduledPost.id,
+            ScheduledPost.schedule_time,
+            UserChannel.channel_name,
+            func.substr(func.coalesce(PostContent.content, ScheduledPost.content), 1, 60).label('preview'),
+            func.coalesce(PostContent.media_type, ScheduledPost.media_type).label('media_type'),
+            ScheduledPost.publish_error
+        ).outerjoin(
+            UserChannel, UserChannel.id == ScheduledPost.channel_id
+        ).outerjoin(
+            PostContent, PostContent.id == ScheduledPost.content_id
+        ).filter(
+            ScheduledPost.user_id == user_id,
+            ScheduledPost.is_published == published
+        )
+        
+        # Запланированные - ближайшие первыми, опубликованные - последние первыми
+        posts, has_prev, has_next = keyset_page(
+            page_query,
+            [ScheduledPost.schedule_time, ScheduledPost.id],
+            self.config.PAGE_SIZE,
+            after=after,
+            before=before,
+            descending=published
+        )
+        
+        title = "✅ Опубликованные посты" if published else "📝 Запланированные посты"
+        text = f"<b>{title}</b>\n\n"
+        keyboard = []
+        
+        for post in posts:
+            preview = post.preview or (f"[{post.media_type}]" if post.media_type else "")
+            text += (
+                f"<b>#{post.id}</b> • {post.schedule_time.strftime('%Y.%m.%d %H:%M')} UTC • "
+                f"{html.escape(post.channel_name or '—')}\n"
+                f"   {html.escape(preview)}\n"
+            )
+            if post.publish_error:
+                text += f"   ⚠️ Не опубликован: {html.escape(post.publish_error)}\n"
+            text += "\n"
+            if not published:
+                keyboard.append([
+                    InlineKeyboardButton(f"🕐 Перенести #{post.id}", callback_data=f"presched_{post.id}"),
+                    InlineKeyboardButton(f"❌ Отменить #{post.id}", callback_data=f"pcancel_{post.id}")
+                ])
+        
+        if not posts:
+            text += "Постов нет.\n"
+        
+        navigation = []
+        if has_prev:
+            first = posts[0]
+            navigation.append(InlineKeyboardButton(
+                "⬅️", callback_data=f"myposts_{kind}_p_{encode_cursor(first.schedule_time, first.id)}"
+            ))
+        if has_next:
+            last = posts[-1]
+            navigation.append(InlineKeyboardButton(
+                "➡️", callback_data=f"myposts_{kind}_n_{encode_cursor(last.schedule_time, last.id)}"
+            ))
+        if navigation:
+            keyboard.append(navigation)
+        
+        keyboard.append([InlineKeyboardButton(
+            "📝 Запланированные" if published else "✅ Опубликованные",
+            callback_data="myposts_s" if published else "myposts_d"
+        )])
+        keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data="main_menu")])
+        
+        await query.edit_message_text(
+            text,
+            reply_markup=InlineKeyboardMarkup(keyboard),
+            parse_mode=ParseMode.HTML
+        )
+    
+    def own_channel(self, channel_id: int, telegram_id: int):
+        """
+        Активный канал пользователя этого бота по id из callback_data.
+        Не query.get(): сессия общая для всех ботов, а объект из identity map
+        возвращается без запроса и без фильтра арендатора. telegram_id - один
+        и тот же человек во всех ботах, поэтому владелец проверяется вместе
+        с tenant_id
+        """
+        return session.query(UserChannel).join(User, User.id == UserChannel.user_id).filter(
+            UserChannel.id == channel_id,
+            UserChannel.tenant_id == self.tenant_id,
+            UserChannel.is_active == True,
+            User.telegram_id == telegram_id
+        ).first()
+    
+    def pending_post_of(self, post_id: int, telegram_id: int):
+        """Неопубликованный пост пользователя этого бота, который еще можно менять"""
+        return session.query(ScheduledPost).join(User, User.id == ScheduledPost.user_id).filter(
+            ScheduledPost.id == post_id,
+            ScheduledPost.tenant_id == self.tenant_id,
+            ScheduledPost.is_published == False,
+            ScheduledPost.publish_started_at.is_(None),
+            User.telegram_id == telegram_id
+        ).first()
+    
+    async def cancel_post(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Отмена запланированного поста"""
+        query = update.callback_query
+        post_id = int(query.data.split('_')[-1])
+        
+        post = self.pending_post_of(post_id, query.from_user.id)
+        if not post:
+            await query.answer("Пост уже публикуется или опубликован", show_alert=True)
+            return
+        
+        session.delete(post)
+        session.commit()
+        publisher.unstage(post_id)
+        
+        await self.my_posts(update, context)
+    
+    async def reschedule_post(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Запрос нового времени для поста"""
+        query = update.callback_query
+        await query.answer()
+        post_id = int(query.data.split('_')[-1])
+        
+        post = self.pending_post_of(post_id, query.from_user.id)
+        if not post:
+            await query.edit_message_text(
+                "❌ Пост уже публикуется или опубликован.",
+                reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("📝 Мои посты", callback_data="my_posts")]])
+            )
+            return
+        
+        context.user_data['reschedule_post_id'] = post_id
+        
+        await query.edit_message_text(
+            f"🕐 <b>Перенос поста #{post_id}</b>\n\n"
+            f"Сейчас: {post.schedule_time.strftime('%Y.%m.%d %H:%M')} UTC\n"
+            "Введите новое время в формате <code>2025.12.31 14:30</code> (UTC):",
+            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("❌ Отмена", callback_data="my_posts")]]),
+            parse_mode=ParseMode.HTML
+        )
+    
+    async def apply_reschedule(self, update: Update, context: ContextTypes.DEFAULT_TYPE, schedule_time):
+        """Сохранение нового времени поста и перепланирование публикации"""
+        post_id = context.user_data.pop('reschedule_post_id')
+        
+        post = self.pending_post_of(post_id, update.effective_user.id)
+        if not post:
+            await update.message.reply_text("❌ Пост уже публикуется или опубликован.")
+            return
+        
+        post.schedule_time = schedule_time.replace(tzinfo=None)
+        post.publish_error = None
+        session.commit()
+        publisher.schedule(post_id)
+        
+        await update.message.reply_text(
+            f"✅ Пост #{post_id} перенесен на {post.schedule_time.strftime('%Y.%m.%d %H:%M')} UTC",
+            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("📝 Мои посты", callback_data="my_posts")]])
+        )
+    
+    async def add_channel(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Начало подключения канала"""
+        query = update.callback_query
+        await query.answer()
+        
+        user = session.query(User).filter_by(telegram_id=query.from_user.id).first()
+        if not user:
+            await query.edit_message_text("❌ Пользователь не найден!")
+            return
+        
+        active_count, limit = self.channel_limit_state(user)
+        if active_count >= limit:
+            await query.edit_message_text(
+                f"❌ Достигнут лимит каналов для вашего тарифа ({active_count}/{limit}).",
+                reply_markup=InlineKeyboardMarkup([
+                    [InlineKeyboardButton("💎 Тарифы", callback_data="tariffs")],
+                    [InlineKeyboardButton("🔙 Назад", callback_data="my_channels")]
+                ])
+            )
+            return
+        
+        context.user_data['channel_step'] = 'waiting_channel'
+        
+        await query.edit_message_text(
+            "➕ <b>Подключение канала</b>\n\n"
+            "1. Добавьте бота в администраторы канала с правом публикации сообщений.\n"
+            "2. Отправьте сюда @username канала, его ID или перешлите любой пост из канала.",
+            reply_markup=InlineKeyboardMarkup([
+                [InlineKeyboardButton("❌ Отмена", callback_data="my_channels")]
+            ]),
+            parse_mode=ParseMode.HTML
+        )
+    
+    async def handle_channel_input(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Проверка прав бота и сохранение канала"""
+        message = update.message
+        back = InlineKeyboardMarkup([[InlineKeyboardButton("❌ Отмена", callback_data="my_channels")]])
+        
+        reference = parse_channel_reference(message)
+        if reference is None:
+            await message.reply_text(
+                "❌ Не удалось распознать канал. Отправьте @username, ID или перешлите пост из канала.",
+                reply_markup=back
+            )
+            return
+        
+        rights = await channel_rights.check(context.bot, reference, force=True)
+        if not rights['ok'] or not rights['chat']:
+            await message.reply_text(
+                f"❌ Бот не может публиковать в этом канале: {rights['reason'] or 'проверка не удалась'}.\n"
+                "Исправьте права и отправьте канал снова.",
+                reply_markup=back
+            )
+            return
+        
+        chat = rights['chat']
+        allowed, reason = await check_user_rights(context.bot, chat, update.effective_user.id)
+        if not allowed:
+            await message.reply_text(
+                f"❌ Канал не подключен: {reason}.\n"
+                "Подключить канал может только его владелец или администратор с правом публикации.",
+                reply_markup=back
+            )
+            return
+        
+        user = session.query(User).filter_by(telegram_id=update.effective_user.id).first()
+        
+        active_count, limit = self.channel_limit_state(user)
+        channel = session.query(UserChannel).filter_by(user_id=user.id, channel_id=str(chat.id)).first()
+        
+        if not (channel and channel.is_active) and active_count >= limit:
+            context.user_data.pop('channel_step', None)
+            await message.reply_text(f"❌ Достигнут лимит каналов для вашего тарифа ({active_count}/{limit}).")
+            return
+        
+        if not channel:
+            channel = UserChannel(user_id=user.id, channel_id=str(chat.id))
+            session.add(channel)
+        channel.channel_name = chat.title
+        channel.channel_link = f"https://t.me/{chat.username}" if chat.username else None
+        channel.is_active = True
+        session.commit()
+        
+        context.user_data.pop('channel_step', None)
+        
+        await message.reply_text(
+            f"✅ Канал <b>{chat.title}</b> подключен!",
+            reply_markup=InlineKeyboardMarkup([
+                [InlineKeyboardButton("📊 Мои каналы", callback_data="my_channels")],
+                [InlineKeyboardButton("📅 Запланировать пост", callback_data="schedule_post")]
+            ]),
+            parse_mode=ParseMode.HTML
+        )
+    
+    async def remove_channel(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Отключение канала"""
+        query = update.callback_query
+        
+        channel_id = int(query.data.split('_')[-1])
+        channel = self.own_channel(channel_id, query.from_user.id)
+        
+        if channel:
+            channel.is_active = False
+            session.commit()
+        
+        await self.my_channels(update, context)
+    
+    @unscoped
+    async def refresh_channel_rights(self):
+        """Фоновое обновление кэша прав ботов в активных каналах их арендаторов"""
+        async with lifecycle.track('channel_rights'):
+            for tenant_id, (bot, application) in registry.items():
+                chat_ids = [
+                    row.channel_id for row in
+                    session.query(UserChannel.channel_id).filter_by(tenant_id=tenant_id, is_active=True).distinct()
+                ]
+                await channel_rights.refresh(application.bot, chat_ids)
+    
+    async def run_sqlite_maintenance(self):
+        """Периодический чекпоинт WAL, раз в сутки - PRAGMA optimize"""
+        self.maintenance_runs += 1
+        # Чекпоинт реже раза в сутки - optimize при каждом
+        runs_per_day = max(1, 24 * 60 // self.config.SQLITE_CHECKPOINT_MINUTES)
+        optimize = self.maintenance_runs % runs_per_day == 0
+        
+        def run(engine):
+            # Вне очереди записи: чекпоинт нельзя выполнять внутри транзакции
+            with Session(bind=engine) as maintenance_session:
+                return sqlite_maintenance(maintenance_session, optimize)
+        
+        busy, log_pages, checkpointed = await asyncio.get_running_loop().run_in_executor(
+            None, run, session.get_bind()
+        )
+        logger.info(f"WAL checkpoint: {checkpointed}/{log_pages} страниц, busy={busy}")
+    
+    async def run_archive(self):
+        """Архивация в отдельном потоке, чтобы не блокировать обработчики"""
+        async with lifecycle.track('archive'):
+            await asyncio.get_running_loop().run_in_executor(None, archiver.run)
+    
+    async def on_expiry_event(self, action, user):
+        """Событие таймлайна подписок выполняет бот арендатора пользователя"""
+        hosted = registry.get(user.tenant_id)
+        if not hosted:
+            return
+        bot, application = hosted
+        if action == REMIND:
+            await bot.remind_expiring_user(application, user)
+        else:
+            await bot.kick_expired_user(application, user)
+    
+    async def remind_expiring_user(self, application, user):
+        """Напоминание о скором окончании подписки"""
+        async with lifecycle.track('expiry'):
+            await application.bot.send_message(
+                chat_id=user.telegram_id,
+                text=(
+                    f"⏳ Ваша подписка заканчивается "
+                    f"{user.subscription_end.strftime('%Y.%m.%d %H:%M')} UTC.\n"
+                    f"Продлите тариф, чтобы запланированные посты продолжали выходить."
+                ),
+                reply_markup=InlineKeyboardMarkup([
+                    [InlineKeyboardButton("💎 Продлить", callback_data="tariffs")]
+                ])
+            )
+    
+    async def kick_expired_user(self, application, user):
+        """Кик пользователя с истекшей подпиской из приватного канала"""
+        if not user.joined_channel or not self.config.PRIVATE_CHANNEL_ID:
+            return
+        
+        async with lifecycle.track('expiry'):
+            await self.kick_from_private_channel(application, user)
+    
+    async def kick_from_private_channel(self, application, user):
+        try:
+            # Пытаемся кикнуть из канала
+            await application.bot.ban_chat_member(
+                chat_id=self.config.PRIVATE_CHANNEL_ID,
+                user_id=user.telegram_id
+            )
+            
+            # Разбаниваем, чтобы пользователь мог вступить снова
+            await application.bot.unban_chat_member(
+                chat_id=self.config.PRIVATE_CHANNEL_ID,
+                user_id=user.telegram_id
+            )
+            
+            user.joined_channel = False
+            session.commit()
+            
+            # Уведомляем пользователя
+            await application.bot.send_message(
+                chat_id=user.telegram_id,
+                text="❌ Ваша подписка истекла. Доступ к приватному каналу закрыт."
+            )
+            
+        except Exception as e:
+            logger.error(f"Ошибка при кике пользователя {user.telegram_id}: {e}")
+    
+    def setup_handlers(self, application):
+        """Настройка обработчиков"""
+        
+        # Команды
+        application.add_handler(CommandHandler("start", self.start))
+        application.add_handler(CommandHandler("admin", self.admin_panel))
+        application.add_handler(CommandHandler("profile", self.profile_command))
+        
+        # Обработчики callback-запросов
+        application.add_handler(CallbackQueryHandler(self.schedule_post, pattern="^schedule_post$"))
+        application.add_handler(CallbackQueryHandler(self.handle_time_selection, pattern="^post_"))
+        application.add_handler(CallbackQueryHandler(self.show_tariffs, pattern="^tariffs$"))
+        application.add_handler(CallbackQueryHandler(self.process_payment, pattern="^buy_"))
+        application.add_handler(CallbackQueryHandler(self.admin_panel, pattern="^admin_panel$"))
+        application.add_handler(CallbackQueryHandler(self.export_database, pattern="^export_db$"))
+        application.add_handler(CallbackQueryHandler(self.admin_tariffs, pattern="^admin_tariffs$"))
+        application.add_handler(CallbackQueryHandler(self.admin_tariff_detail, pattern="^admin_tariff_"))
+        application.add_handler(CallbackQueryHandler(self.admin_tariff_action, pattern="^tariff_"))
+        application.add_handler(CallbackQueryHandler(self.admin_profiling, pattern="^admin_profiling$"))
+        application.add_handler(CallbackQueryHandler(self.profiling_action, pattern="^prof_"))
+        application.add_handler(CallbackQueryHandler(self.admin_broadcast, pattern="^admin_broadcast$"))
+        application.add_handler(CallbackQueryHandler(self.broadcast_action, pattern="^bcast_"))
+        application.add_handler(CallbackQueryHandler(self.main_menu, pattern="^main_menu$"))
+        application.add_handler(CallbackQueryHandler(self.show_profile, pattern="^profile$"))
+        application.add_handler(CallbackQueryHandler(self.confirm_and_schedule, pattern="^select_channel_"))
+        application.add_handler(CallbackQueryHandler(self.my_channels, pattern="^(my_channels$|mychannels_)"))
+        application.add_handler(CallbackQueryHandler(self.my_posts, pattern="^(my_posts$|myposts_)"))
+        application.add_handler(CallbackQueryHandler(self.cancel_post, pattern="^pcancel_"))
+        application.add_handler(CallbackQueryHandler(self.reschedule_post, pattern="^presched_"))
+        application.add_handler(CallbackQueryHandler(self.add_channel, pattern="^channel_add$"))
+        application.add_handler(CallbackQueryHandler(self.remove_channel, pattern="^channel_remove_"))
+        application.add_handler(CallbackQueryHandler(self.request_post_content, pattern="^custom_date$"))
+        
+        # Оплата через Telegram Stars
+        application.add_handler(PreCheckoutQueryHandler(self.pre_checkout))
+        application.add_handler(MessageHandler(filters.SUCCESSFUL_PAYMENT, self.successful_payment))
+        
+        # Обработчики сообщений
+        application.add_handler(MessageHandler(
+            filters.TEXT & ~filters.COMMAND & filters.Regex(r'^\d{4}\.\d{2}\.\d{2} \d{2}:\d{2}$'),
+            self.handle_custom_date
+        ))
         
         application.add_handler(MessageHandler(
             filters.TEXT | filters.PHOTO | filters.VIDEO | filters.ATTACHMENT,
             self.handle_post_content
         ))
     
+    async def on_startup(self, application):
+        """post_init: бот подключается к общим службам процесса, первый - запускает их"""
+        self.attach(application)
+        
+        # Арендатор мог появиться после запуска процесса - без тарифов он не продает подписки
+        tariff_cache.seed(session)
+        tariff_cache.refresh_if_stale(session)
+        
+        if len(registry) == 1:
+            await self.start_services()
+        else:
+            # Службы уже работают, но до этого бота их задачи его не касались
+            await self.recover_interrupted_posts({self.tenant_id})
+            expiry_timeline.resume(self.tenant_id)
+            publisher.serve(registry.tenant_ids())
+        self.resume_broadcasts(application)
+    
+    def attach(self, application):
+        registry.register(self.tenant_id, self, application)
+    
+    def resume_broadcasts(self, application):
+        """Рассылки арендатора, прерванные перезапуском, продолжаются с сохраненного курсора"""
+        with tenant_scope(self.tenant_id):
+            broadcasts.resume_all(*self.broadcast_callbacks(application))
+    
+    @unscoped
+    async def start_services(self):
+        """Общие для всех ботов процесса службы: планировщик, публикация, таймлайн"""
+        lifecycle.accepting = True
+        
+        # Запускаем планировщик
+        if not scheduler.running:
+            scheduler.start()
+        
+        # Напоминания и кики по таймлайну окончания подписок
+        expiry_timeline.start(session, {
+            REMIND: lambda user: self.on_expiry_event(REMIND, user),
+            KICK: lambda user: self.on_expiry_event(KICK, user),
+        }, hosted=registry.tenant_ids)
+        
+        # Сверяем версию каталога тарифов, чтобы правки из других процессов
+        # применялись без перезапуска
+        scheduler.add_job(
+            self.refresh_tariffs,
+            'interval',
+            seconds=self.config.TARIFF_CACHE_REFRESH_SECONDS,
+            id="refresh_tariffs",
+            replace_existing=True
+        )
+        
+        # Держим кэш прав бота в каналах теплым
+        scheduler.add_job(
+            self.refresh_channel_rights,
+            'interval',
+            seconds=self.config.CHANNEL_RIGHTS_TTL // 2,
+            id="refresh_channel_rights",
+            replace_existing=True
+        )
+        
+        # Раз в сутки переносим холодные данные в архив
+        scheduler.add_job(
+            self.run_archive,
+            'cron',
+            hour=self.config.ARCHIVE_HOUR,
+            id="archive",
+            replace_existing=True
+        )
+        
+        # Обслуживание SQLite: чекпоинт WAL и обновление статистики планировщика
+        if session.get_bind().dialect.name == 'sqlite':
+            scheduler.add_job(
+                self.run_sqlite_maintenance,
+                'interval',
+                minutes=self.config.SQLITE_CHECKPOINT_MINUTES,
+                id="sqlite_maintenance",
+                replace_existing=True
+            )
+        
+        # Публикации: упреждающая выборка из БД, отдельных задач на посты нет
+        await self.recover_interrupted_posts()
+        publisher.start(self.dispatch_post, tenant_ids=registry.tenant_ids())
+        scheduler.add_job(
+            unscoped(publisher.run_tick),
+            'interval',
+            seconds=self.config.PUBLISH_TICK_SECONDS,
+            id="publisher_tick",
+            replace_existing=True
+        )
+    
+    async def on_stop(self, application):
+        """post_stop: бот отключается от общих служб, последний - останавливает их"""
+        if registry.unregister(self.tenant_id):
+            # Остальные боты работают: дописываем только свои рассылки, посты
+            # арендатора остаются в БД до его следующего запуска
+            await broadcasts.detach(self.tenant_id, self.config.SHUTDOWN_TIMEOUT)
+            publisher.serve(registry.tenant_ids())
+            return
+        await self.stop_services()
+    
+    async def on_shutdown(self, application):
+        """post_shutdown: последний завершенный бот закрывает очередь записи и пул"""
+        if not registry.release(self.tenant_id):
+            await self.shutdown_services()
+    
+    async def stop_services(self):
+        """Остановка: новые обновления уже не принимаются, дожидаемся начатых работ"""
+        logger.info("Stopping: draining in-flight work...")
+        lifecycle.stop_intake()
+        publisher.stop()
+        broadcasts.stop()
+        if scheduler.running:
+            scheduler.pause()
+        
+        await lifecycle.drain(self.config.SHUTDOWN_TIMEOUT)
+        
+        if scheduler.running:
+            scheduler.shutdown(wait=False)
+    
+    async def shutdown_services(self):
+        """Сброс незакоммиченных изменений и закрытие пула соединений"""
+        # Дописываем очередь записи до закрытия пула
+        await asyncio.get_running_loop().run_in_executor(
+            None, write_queue.stop, self.config.SHUTDOWN_TIMEOUT
+        )
+        
+        try:
+            if session.new or session.dirty or session.deleted:
+                session.commit()
+        except Exception as e:
+            logger.error(f"Ошибка сохранения изменений при остановке: {e}")
+            session.rollback()
+        finally:
+            session.close()
+            session.get_bind().dispose()
+        logger.info("Bot stopped gracefully")
+    
     def run_with_retry(self):
         """Запуск бота с повторными попытками при конфликте"""
         max_retries = 3
@@ -721,26 +2159,25 @@ class TelegramBot:
             try:
                 logger.info(f"Starting bot (attempt {attempt + 1}/{max_retries})...")
                 
-                application = Application.builder().token(self.config.BOT_TOKEN).build()
+                application = (
+                    Application.builder()
+                    .token(self.config.BOT_TOKEN)
+                    .post_init(self.on_startup)
+                    .post_stop(self.on_stop)
+                    .post_shutdown(self.on_shutdown)
+                    .build()
+                )
                 
                 self.setup_handlers(application)
                 
-                # Запускаем планировщик
-                scheduler.start()
-                
-                # Запускаем проверку подписок каждые 30 минут
-                scheduler.add_job(
-                    self.check_subscriptions,
-                    'interval',
-                    minutes=30,
-                    args=[application]
-                )
-                
                 logger.info("Bot started successfully!")
-                application.run_polling(
-                    allowed_updates=Update.ALL_TYPES,
-                    close_loop=False
-                )
+                # Задачи приложения наследуют контекст: запросы идут от имени арендатора
+                with tenant_scope(self.tenant_id):
+                    application.run_polling(
+                        allowed_updates=Update.ALL_TYPES,
+                        close_loop=False,
+                        stop_signals=(signal.SIGINT, signal.SIGTERM, signal.SIGABRT)
+                    )
                 break
                 
             except Conflict as e:
@@ -758,9 +2195,102 @@ class TelegramBot:
                 logger.error(f"Unexpected error: {e}")
                 raise
 
+async def stop_tenant(bot, application):
+    """
+    Остановка одного бота в порядке run_polling. Хуки post_stop и
+    post_shutdown вызываются и после неудачного запуска, чтобы бот
+    отключился от общих служб
+    """
+    with tenant_scope(bot.tenant_id):
+        try:
+            if application.updater.running:
+                await application.updater.stop()
+            if application.running:
+                await application.stop()
+            await application.post_stop(application)
+        finally:
+            await application.shutdown()
+            await application.post_shutdown(application)
+
+async def run_tenants():
+    """
+    Все активные арендаторы в одном event loop. У каждого свой Application
+    (polling и обработчики) с теми же хуками, что в режиме одного бота, а пул
+    соединений, планировщик, публикация, очередь записи и ограничитель
+    скорости рассылок - общие. Ошибка запуска одного бота не мешает остальным.
+    """
+    initialized = []
+    for tenant in active_tenants(session):
+        bot = TelegramBot(tenant)
+        application = (
+            Application.builder()
+            .token(tenant.bot_token)
+            .post_init(bot.on_startup)
+            .post_stop(bot.on_stop)
+            .post_shutdown(bot.on_shutdown)
+            .build()
+        )
+        bot.setup_handlers(application)
+        try:
+            await application.initialize()
+        except Exception as e:
+            logger.error(f"Бот арендатора {tenant.key} не запущен: {e}")
+            continue
+        initialized.append((tenant, bot, application))
+    
+    # Сначала все боты подключаются к общим службам, затем запускают polling:
+    # сбой одного бота не останавливает службы, уже нужные остальным
+    attached = []
+    for tenant, bot, application in initialized:
+        try:
+            with tenant_scope(bot.tenant_id):
+                await application.post_init(application)
+            attached.append((tenant, bot, application))
+        except Exception as e:
+            logger.error(f"Бот арендатора {tenant.key} не запущен: {e}")
+            await stop_tenant(bot, application)
+    
+    hosted = []
+    for tenant, bot, application in attached:
+        try:
+            # Задачи приложения наследуют контекст: запросы идут от имени арендатора
+            with tenant_scope(bot.tenant_id):
+                await application.updater.start_polling(allowed_updates=Update.ALL_TYPES)
+                await application.start()
+            hosted.append((tenant, bot, application))
+        except Exception as e:
+            logger.error(f"Бот арендатора {tenant.key} не запущен: {e}")
+            await stop_tenant(bot, application)
+    
+    if not hosted:
+        logger.error("Нет ни одного активного бота")
+        return
+    logger.info(f"Bots started: {len(hosted)}")
+    
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    await stop.wait()
+    
+    # Последний остановленный бот дожидается начатых работ и закрывает службы
+    for tenant, bot, application in hosted:
+        try:
+            await stop_tenant(bot, application)
+        except Exception as e:
+            logger.error(f"Ошибка остановки бота арендатора {tenant.key}: {e}")
+
 def main():
     """Главная функция"""
-    bot = TelegramBot()
+    if Config.MULTI_TENANT:
+        try:
+            asyncio.run(run_tenants())
+        except Exception as e:
+            logger.error(f"Bots crashed: {e}")
+            sys.exit(1)
+        return
+    
+    bot = TelegramBot(default_tenant)
     
     try:
         bot.run_with_retry()
@@ -0,0 +1,339 @@
+"""
+Рассылка администратора по пользователям.
+
+Получатели читаются страницами по users.id (keyset, без OFFSET и без
+загрузки всей таблицы). Страница отправляется параллельно через общий
+ограничитель скорости (token bucket); RetryAfter от Telegram приостанавливает
+на указанное время рассылки бота, получившего его (лимиты Telegram действуют
+на токен, остальные боты продолжают), Forbidden отмечает пользователя как
+заблокировавшего бота. После каждой страницы курсор и счетчики сохраняются
+через очередь записи, поэтому после перезапуска рассылка продолжается с
+места остановки (повторно могут уйти не более одной страницы сообщений).
+"""
+
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+
+from telegram.error import BadRequest, Forbidden, RetryAfter, TimedOut, NetworkError
+
+from database import Broadcast, User, keyset_page, save_broadcast_progress
+
+logger = logging.getLogger(__name__)
+
+ALL = 'all'
+ACTIVE = 'active'
+EXPIRED = 'expired'
+TARIFF_PREFIX = 'tariff:'
+AUDIENCES = (ALL, ACTIVE, EXPIRED)
+
+RUNNING = 'running'
+PAUSED = 'paused'
+DONE = 'done'
+CANCELLED = 'cancelled'
+
+SEND_ATTEMPTS = 3
+
+
+def audience_filter(audience, now):
+    """Условия выборки получателей; now - время создания рассылки"""
+    conditions = [User.is_blocked.isnot(True)]
+    if audience == ACTIVE:
+        conditions.append(User.subscription_end > now)
+    elif audience == EXPIRED:
+        conditions.append(User.subscription_end <= now)
+    elif audience.startswith(TARIFF_PREFIX):
+        conditions.append(User.tariff == audience[len(TARIFF_PREFIX):])
+        conditions.append(User.subscription_end > now)
+    elif audience != ALL:
+        raise ValueError(f"Неизвестная аудитория: {audience}")
+    return conditions
+
+
+def count_audience(session, audience, now=None):
+    now = now or datetime.utcnow()
+    return session.query(User).filter(*audience_filter(audience, now)).count()
+
+
+def create_broadcast(session, audience, content, media_type=None, media_file_id=None):
+    """Новая рассылка с зафиксированной аудиторией (без коммита)"""
+    now = datetime.utcnow()
+    broadcast = Broadcast(
+        audience=audience,
+        content=content,
+        media_type=media_type,
+        media_file_id=media_file_id,
+        status=RUNNING,
+        max_user_id=session.query(User.id).order_by(User.id.desc()).limit(1).scalar() or 0,
+        total=count_audience(session, audience, now),
+        created_at=now
+    )
+    session.add(broadcast)
+    return broadcast
+
+
+def _retry_seconds(error):
+    retry_after = error.retry_after
+    if isinstance(retry_after, timedelta):
+        return retry_after.total_seconds()
+    return float(retry_after)
+
+
+class TokenBucket:
+    """
+    Ограничитель скорости: rate токенов в секунду, запас до burst.
+    Скорость общая, а пауза после флуд-лимита - своя у каждого ключа (бота)
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._paused_until = {}  # ключ -> time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds, key=None):
+        """Флуд-лимит Telegram действует на токен бота - стоят все рассылки этого бота"""
+        until = time.monotonic() + seconds
+        self._paused_until[key] = max(self._paused_until.get(key, 0), until)
+
+    def _paused_for(self, key):
+        return self._paused_until.get(key, 0) - time.monotonic()
+
+    async def acquire(self, key=None):
+        while True:
+            # Приостановленный бот ждет вне блокировки и не задерживает остальных
+            paused = self._paused_for(key)
+            if paused > 0:
+                await asyncio.sleep(paused)
+                continue
+            async with self._lock:
+                if self._paused_for(key) > 0:
+                    continue
+                while True:
+                    now = time.monotonic()
+                    self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class BroadcastRun:
+    """Состояние выполняющейся рассылки без ссылок на сессию"""
+
+    def __init__(self, broadcast):
+        self.broadcast_id = broadcast.id
+        self.tenant_id = broadcast.tenant_id
+        self.audience = broadcast.audience
+        self.content = broadcast.content
+        self.media_type = broadcast.media_type
+        self.media_file_id = broadcast.media_file_id
+        self.created_at = broadcast.created_at
+        self.max_user_id = broadcast.max_user_id
+        self.cursor = broadcast.cursor_user_id
+        self.total = broadcast.total
+        self.sent = broadcast.sent
+        self.failed = broadcast.failed
+        self.blocked = broadcast.blocked
+        self.progress_chat_id = broadcast.progress_chat_id
+        self.progress_message_id = broadcast.progress_message_id
+        self.status = RUNNING
+        self.requested_status = None
+        self.halted = False  # бот арендатора остановлен, рассылка продолжится при запуске
+        # Скорость считается по текущему запуску
+        self.started = time.monotonic()
+        self.processed_at_start = self.processed
+
+    @property
+    def processed(self):
+        return self.sent + self.failed + self.blocked
+
+    @property
+    def throughput(self):
+        elapsed = time.monotonic() - self.started
+        done = self.processed - self.processed_at_start
+        return done / elapsed if elapsed > 0 else 0.0
+
+    @property
+    def eta(self):
+        """Оставшееся время в секундах или None, пока скорость неизвестна"""
+        rate = self.throughput
+        if not rate:
+            return None
+        return max(self.total - self.processed, 0) / rate
+
+    def progress_values(self):
+        values = {
+            Broadcast.cursor_user_id: self.cursor,
+            Broadcast.sent: self.sent,
+            Broadcast.failed: self.failed,
+            Broadcast.blocked: self.blocked,
+        }
+        if self.status != RUNNING:
+            values[Broadcast.status] = self.status
+            if self.status in (DONE, CANCELLED):
+                values[Broadcast.finished_at] = datetime.utcnow()
+        return values
+
+
+class BroadcastEngine:
+    def __init__(self, session, write_queue, lifecycle, rate, concurrency, page_size, report_interval):
+        self.session = session
+        self.write_queue = write_queue
+        self.lifecycle = lifecycle
+        self.bucket = TokenBucket(rate)
+        self.concurrency = concurrency
+        self.page_size = page_size
+        self.report_interval = report_interval
+        self.accepting = True
+        self._runs = {}   # broadcast_id -> BroadcastRun
+        self._tasks = {}  # broadcast_id -> asyncio.Task
+
+    def get_run(self, broadcast_id):
+        return self._runs.get(broadcast_id)
+
+    def start(self, broadcast, send, report):
+        """
+        Запускает (или продолжает) рассылку.
+        send: coroutine(chat_id, run) - отправка одному получателю;
+        report: coroutine(run) - обновление сообщения с прогрессом.
+        """
+        if broadcast.id in self._tasks:
+            return self._runs[broadcast.id]
+        self.accepting = True
+        run = BroadcastRun(broadcast)
+        self._runs[run.broadcast_id] = run
+        self._tasks[run.broadcast_id] = asyncio.create_task(self._run(run, send, report))
+        return run
+
+    def resume_all(self, send, report):
+        """Продолжает рассылки, прерванные перезапуском"""
+        pending = self.session.query(Broadcast).filter_by(status=RUNNING).all()
+        for broadcast in pending:
+            logger.info(f"Продолжение рассылки {broadcast.id} с пользователя {broadcast.cursor_user_id}")
+            self.start(broadcast, send, report)
+        return len(pending)
+
+    def request(self, broadcast_id, status):
+        """Пауза или отмена выполняющейся рассылки; False, если она не выполняется"""
+        run = self._runs.get(broadcast_id)
+        if run is None:
+            return False
+        run.requested_status = status
+        return True
+
+    def stop(self):
+        """Остановка процесса: страницы дописываются, статус остается running"""
+        self.accepting = False
+
+    async def detach(self, tenant_id, timeout):
+        """
+        Остановка бота одного арендатора при работающих остальных: его
+        рассылки дописывают текущую страницу и выходят со статусом running
+        """
+        tasks = []
+        for broadcast_id, run in self._runs.items():
+            if run.tenant_id == tenant_id:
+                run.halted = True
+                tasks.append(self._tasks[broadcast_id])
+        if tasks:
+            await asyncio.wait(tasks, timeout=timeout)
+
+    def _next_page(self, run):
+        query = self.session.query(User.id, User.telegram_id).filter(
+            *audience_filter(run.audience, run.created_at),
+            User.id <= run.max_user_id
+        )
+        rows, _, has_next = keyset_page(query, [User.id], self.page_size, after=(run.cursor,))
+        return rows, has_next
+
+    async def _send_one(self, run, telegram_id, send, semaphore):
+        """'sent', 'blocked' или 'failed'"""
+        async with semaphore:
+            for attempt in range(SEND_ATTEMPTS):
+                await self.bucket.acquire(run.tenant_id)
+                try:
+                    await send(telegram_id, run)
+                    return 'sent'
+                except RetryAfter as e:
+                    seconds = _retry_seconds(e)
+                    logger.warning(f"Рассылка {run.broadcast_id}: флуд-лимит, пауза {seconds:.0f} с")
+                    self.bucket.pause(seconds, run.tenant_id)
+                except Forbidden:
+                    return 'blocked'
+                except BadRequest as e:
+                    # Чат не найден, пользователь удален и т.п. - повтор не поможет
+                    logger.warning(f"Рассылка {run.broadcast_id}: не доставлено {telegram_id}: {e}")
+                    return 'failed'
+                except (TimedOut, NetworkError) as e:
+                    if attempt == SEND_ATTEMPTS - 1:
+                        logger.warning(f"Рассылка {run.broadcast_id}: не доставлено {telegram_id}: {e}")
+                except Exception as e:
+                    logger.warning(f"Рассылка {run.broadcast_id}: не доставлено {telegram_id}: {e}")
+                    return 'failed'
+            return 'failed'
+
+    async def _run(self, run, send, report):
+        semaphore = asyncio.Semaphore(self.concurrency)
+        last_report = 0
+        try:
+            while True:
+                if not self.accepting or run.halted:
+                    return
+                if run.requested_status:
+                    run.status = run.requested_status
+                    await self.write_queue.run(save_broadcast_progress, run.broadcast_id, run.progress_values())
+                    break
+
+                try:
+                    rows, has_next = self._next_page(run)
+                except Exception as e:
+                    self.session.rollback()
+                    logger.error(f"Рассылка {run.broadcast_id}: ошибка выборки получателей: {e}")
+                    await asyncio.sleep(self.report_interval)
+                    continue
+
+                # Остановка процесса дождется отправки и чекпоинта текущей страницы
+                async with self.lifecycle.track('broadcast'):
+                    results = await asyncio.gather(*[
+                        self._send_one(run, telegram_id, send, semaphore) for _, telegram_id in rows
+                    ])
+
+                    blocked_ids = []
+                    for (user_id, _), result in zip(rows, results):
+                        if result == 'sent':
+                            run.sent += 1
+                        elif result == 'blocked':
+                            run.blocked += 1
+                            blocked_ids.append(user_id)
+                        else:
+                            run.failed += 1
+                    if rows:
+                        run.cursor = rows[-1][0]
+                    if not has_next:
+                        run.status = DONE
+
+                    await self.write_queue.run(
+                        save_broadcast_progress, run.broadcast_id, run.progress_values(), blocked_ids
+                    )
+
+                if run.status == DONE:
+                    break
+                if time.monotonic() - last_report >= self.report_interval:
+                    last_report = time.monotonic()
+                    await report(run)
+
+            logger.info(
+                f"Рассылка {run.broadcast_id}: {run.status}, отправлено {run.sent}, "
+                f"ошибок {run.failed}, заблокировали {run.blocked}"
+            )
+            await report(run)
+        except Exception as e:
+            logger.error(f"Рассылка {run.broadcast_id} прервана: {e}")
+        finally:
+            self._runs.pop(run.broadcast_id, None)
+            self._tasks.pop(run.broadcast_id, None)
@@ -0,0 +1,171 @@
+"""
+Проверка прав бота в каналах пользователей.
+
+Результаты get_chat / get_chat_member кэшируются на CHANNEL_RIGHTS_TTL
+секунд и обновляются фоновой задачей пачками, поэтому публикация в канал,
+где бот потерял права, отсекается до вызова send_* без лишних запросов.
+Права у разных ботов в одном канале разные, поэтому ключ кэша включает ID бота.
+"""
+
+import asyncio
+import logging
+import time
+
+from telegram.constants import ChatMemberStatus, ChatType
+from telegram.error import BadRequest, Forbidden, TelegramError
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+def _rights_of(chat, member):
+    """(ok, причина) по типу чата и статусу бота в нем"""
+    if member.status == ChatMemberStatus.OWNER:
+        return True, None
+
+    if chat.type == ChatType.CHANNEL:
+        if member.status != ChatMemberStatus.ADMINISTRATOR:
+            return False, "бот не администратор канала"
+        if not member.can_post_messages:
+            return False, "у бота нет права публикации сообщений"
+        return True, None
+
+    if member.status in (ChatMemberStatus.LEFT, ChatMemberStatus.BANNED):
+        return False, "бот не состоит в чате"
+    if member.status == ChatMemberStatus.RESTRICTED and not member.can_send_messages:
+        return False, "боту запрещено отправлять сообщения"
+    return True, None
+
+
+def _user_rights(chat, member):
+    """(ok, причина): может ли пользователь сам публиковать в чат, который подключает"""
+    if member.status == ChatMemberStatus.OWNER:
+        return True, None
+    if member.status != ChatMemberStatus.ADMINISTRATOR:
+        return False, "вы не администратор этого канала"
+    if chat.type == ChatType.CHANNEL and not member.can_post_messages:
+        return False, "у вас нет права публикации сообщений в этом канале"
+    return True, None
+
+
+async def check_user_rights(bot, chat, user_id):
+    """
+    Подключить канал может только его владелец или администратор с правом
+    публикации - иначе любой подписчик мог бы публиковать в чужой канал,
+    где бот уже администратор. Без кэша: проверка нужна один раз.
+    """
+    try:
+        member = await bot.get_chat_member(chat.id, user_id)
+    except (BadRequest, Forbidden) as e:
+        return False, f"не удалось проверить ваши права в канале ({e.message})"
+    except TelegramError as e:
+        logger.warning(f"Не удалось проверить права пользователя {user_id} в {chat.id}: {e}")
+        return False, "не удалось проверить ваши права в канале, попробуйте позже"
+    return _user_rights(chat, member)
+
+
+class ChannelRightsCache:
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._entries = {}
+
+    @staticmethod
+    def _key(bot, chat_id):
+        return f"{bot.id}:{chat_id}"
+
+    def get(self, bot, chat_id):
+        """Свежий результат проверки или None"""
+        entry = self._entries.get(self._key(bot, chat_id))
+        if entry and time.monotonic() - entry['checked_at'] < self.ttl:
+            return entry
+        return None
+
+    def invalidate(self, bot, chat_id):
+        self._entries.pop(self._key(bot, chat_id), None)
+
+    def _store(self, bot, chat_ids, entry):
+        for chat_id in chat_ids:
+            self._entries[self._key(bot, chat_id)] = entry
+        return entry
+
+    async def check(self, bot, chat_id, force=False):
+        """
+        Проверяет, может ли бот публиковать в чат. chat_id - числовой ID
+        или @username. Возвращает словарь с ok, reason и chat.
+        """
+        if not force:
+            cached = self.get(bot, chat_id)
+            if cached:
+                return cached
+
+        try:
+            chat = await bot.get_chat(chat_id)
+            member = await bot.get_chat_member(chat.id, bot.id)
+        except (BadRequest, Forbidden) as e:
+            return self._store(bot, [chat_id], {
+                'ok': False,
+                'reason': f"канал недоступен боту ({e.message})",
+                'chat': None,
+                'checked_at': time.monotonic()
+            })
+        except TelegramError as e:
+            # Сетевые ошибки и флуд-контроль не означают потерю прав
+            logger.warning(f"Не удалось проверить права в {chat_id}: {e}")
+            return {'ok': True, 'reason': None, 'chat': None, 'checked_at': time.monotonic()}
+
+        ok, reason = _rights_of(chat, member)
+        keys = {chat_id, chat.id}
+        if chat.username:
+            keys.add(f"@{chat.username}")
+        return self._store(bot, keys, {
+            'ok': ok,
+            'reason': reason,
+            'chat': chat,
+            'checked_at': time.monotonic()
+        })
+
+    def stale(self, bot, chat_ids):
+        """ID, которые пора перепроверить (истекает меньше чем через 20% TTL)"""
+        now = time.monotonic()
+        result = []
+        for chat_id in chat_ids:
+            entry = self._entries.get(self._key(bot, chat_id))
+            if not entry or now - entry['checked_at'] > self.ttl * 0.8:
+                result.append(chat_id)
+        return result
+
+    async def refresh(self, bot, chat_ids):
+        """Фоновое обновление пачками, чтобы не упираться в лимиты API"""
+        chat_ids = self.stale(bot, chat_ids)
+        batch_size = Config.CHANNEL_RIGHTS_BATCH
+
+        for i in range(0, len(chat_ids), batch_size):
+            batch = chat_ids[i:i + batch_size]
+            await asyncio.gather(*(self.check(bot, chat_id, force=True) for chat_id in batch))
+            if i + batch_size < len(chat_ids):
+                await asyncio.sleep(1)
+
+        if chat_ids:
+            lost = [c for c in chat_ids if not (self.get(bot, c) or {'ok': True})['ok']]
+            logger.info(f"Права в каналах обновлены: {len(chat_ids)}, без прав: {len(lost)}")
+
+
+def parse_channel_reference(message):
+    """ID или @username канала из пересланного поста, ссылки или текста"""
+    if message.forward_from_chat:
+        return message.forward_from_chat.id
+
+    text = (message.text or "").strip()
+    for prefix in ("https://t.me/", "http://t.me/", "t.me/"):
+        if text.startswith(prefix):
+            text = "@" + text[len(prefix):].split('/')[0]
+
+    if text.lstrip('-').isdigit():
+        return int(text)
+    if text.startswith('@') and len(text) > 1:
+        return text
+    return None
+
+
+channel_rights = ChannelRightsCache(Config.CHANNEL_RIGHTS_TTL)
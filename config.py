@@ -16,7 +16,8 @@ class Config:
         # Railway использует postgres://, а SQLAlchemy требует postgresql://
         DATABASE_URL = DATABASE_URL.replace('postgres://', 'postgresql://', 1)
     
-    # Настройки тарифов (в звездах)
+    # Начальные тарифы (в звездах). Переносятся в таблицу tariffs при первом
+    # запуске, дальше редактируются из админ панели
     TARIFFS = {
         'basic': {
             'name': 'Базовый',
@@ -40,3 +41,57 @@ class Config:
     
     # Время в часах до кика
     KICK_AFTER_EXPIRY = 2
+    
+    # За сколько часов до окончания подписки отправлять напоминание
+    EXPIRY_REMINDER_HOURS = int(os.environ.get('EXPIRY_REMINDER_HOURS', 24))
+    
+    # Как часто (в секундах) процесс сверяет версию каталога тарифов с БД
+    TARIFF_CACHE_REFRESH_SECONDS = int(os.environ.get('TARIFF_CACHE_REFRESH_SECONDS', 30))
+    
+    # Архивация: опубликованные посты и платежи старше N дней уходят в архив
+    ARCHIVE_AFTER_DAYS = int(os.environ.get('ARCHIVE_AFTER_DAYS', 30))
+    ARCHIVE_BATCH_SIZE = int(os.environ.get('ARCHIVE_BATCH_SIZE', 1000))
+    ARCHIVE_HOUR = int(os.environ.get('ARCHIVE_HOUR', 3))  # UTC
+    # Каталог для архивных файлов (только SQLite)
+    ARCHIVE_DIR = os.environ.get('ARCHIVE_DIR', 'archive')
+    
+    # Кэш прав бота в каналах пользователей
+    CHANNEL_RIGHTS_TTL = int(os.environ.get('CHANNEL_RIGHTS_TTL', 600))  # секунд
+    CHANNEL_RIGHTS_BATCH = int(os.environ.get('CHANNEL_RIGHTS_BATCH', 20))
+    
+    # Сколько секунд при остановке ждать завершения начатых публикаций
+    SHUTDOWN_TIMEOUT = int(os.environ.get('SHUTDOWN_TIMEOUT', 20))
+    
+    # Профилирование из админ панели
+    PROFILE_SLOW_SQL_MS = int(os.environ.get('PROFILE_SLOW_SQL_MS', 100))
+    PROFILE_SAMPLE_INTERVAL_MS = int(os.environ.get('PROFILE_SAMPLE_INTERVAL_MS', 10))
+    PROFILE_MAX_SECONDS = int(os.environ.get('PROFILE_MAX_SECONDS', 600))
+    
+    # Размер страницы в списках "Мои посты" и "Мои каналы"
+    PAGE_SIZE = int(os.environ.get('PAGE_SIZE', 5))
+    
+    # Очередь записи: записи за окно объединяются в один коммит
+    WRITE_BATCH_SIZE = int(os.environ.get('WRITE_BATCH_SIZE', 200))
+    WRITE_BATCH_WINDOW_MS = int(os.environ.get('WRITE_BATCH_WINDOW_MS', 5))
+    
+    # Профиль SQLite (когда DATABASE_URL не задан)
+    SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000))
+    SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))
+    SQLITE_CACHE_SIZE_KB = int(os.environ.get('SQLITE_CACHE_SIZE_KB', 64 * 1024))
+    SQLITE_CHECKPOINT_MINUTES = max(1, int(os.environ.get('SQLITE_CHECKPOINT_MINUTES', 15)))
+    
+    # Публикация: заранее выбираем посты на ближайшие N секунд
+    PUBLISH_LOOKAHEAD_SECONDS = int(os.environ.get('PUBLISH_LOOKAHEAD_SECONDS', 120))
+    PUBLISH_TICK_SECONDS = int(os.environ.get('PUBLISH_TICK_SECONDS', 60))
+    PUBLISH_CONCURRENCY = int(os.environ.get('PUBLISH_CONCURRENCY', 20))
+    
+    # Рассылка по пользователям: скорость (сообщений в секунду), параллельность
+    # и размер страницы получателей (прогресс сохраняется после каждой страницы)
+    BROADCAST_RATE = int(os.environ.get('BROADCAST_RATE', 25))
+    BROADCAST_CONCURRENCY = int(os.environ.get('BROADCAST_CONCURRENCY', 10))
+    BROADCAST_PAGE_SIZE = int(os.environ.get('BROADCAST_PAGE_SIZE', 100))
+    BROADCAST_REPORT_SECONDS = int(os.environ.get('BROADCAST_REPORT_SECONDS', 5))
+    
+    # Несколько ботов в одном процессе: запускаются все активные арендаторы
+    # из таблицы tenants (см. tenancy.py), иначе только бот из BOT_TOKEN
+    MULTI_TENANT = os.environ.get('MULTI_TENANT', '0') == '1'
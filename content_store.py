@@ -0,0 +1,87 @@
+"""
+Контентно-адресуемое хранилище тел постов и медиа.
+
+Текст и медиа поста хэшируются (sha256), тело сохраняется один раз и
+переиспользуется всеми постами с тем же содержимым - кросспостинг одного
+промо в несколько каналов или ежедневные повторы больше не дублируют текст.
+
+Медиа адресуется по file_unique_id (не меняется между загрузками), а
+последний успешно отправленный file_id кэшируется в media_files, чтобы
+публикация всегда шла по проверенному file_id без повторной загрузки.
+"""
+
+import hashlib
+import logging
+from datetime import datetime
+
+from sqlalchemy.exc import IntegrityError
+
+from database import MediaFile, PostContent, begin_savepoint
+
+logger = logging.getLogger(__name__)
+
+
+def content_hash(text, media_type=None, file_unique_id=None):
+    digest = hashlib.sha256()
+    for part in (media_type or '', file_unique_id or '', text or ''):
+        digest.update(part.encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def _get_or_insert(session, model, lookup, **fields):
+    """SELECT, а при отсутствии INSERT в savepoint (на случай гонки вставок)"""
+    instance = session.query(model).filter_by(**lookup).first()
+    if instance:
+        return instance
+
+    try:
+        with begin_savepoint(session):
+            instance = model(**lookup, **fields)
+            session.add(instance)
+    except IntegrityError:
+        instance = session.query(model).filter_by(**lookup).one()
+    return instance
+
+
+def get_or_create_media(session, media_type, file_unique_id, file_id):
+    return _get_or_insert(
+        session, MediaFile,
+        {'file_unique_id': file_unique_id},
+        media_type=media_type,
+        file_id=file_id
+    )
+
+
+def get_or_create_content(session, text, media_type=None, file_unique_id=None, file_id=None):
+    """Возвращает PostContent для текста и медиа (без коммита)"""
+    media = None
+    if media_type and file_unique_id:
+        media = get_or_create_media(session, media_type, file_unique_id, file_id)
+
+    return _get_or_insert(
+        session, PostContent,
+        {'content_hash': content_hash(text, media_type, file_unique_id)},
+        content=text,
+        media_type=media_type,
+        media_id=media.id if media else None
+    )
+
+
+def sent_file_id(message, media_type):
+    """file_id медиа из отправленного сообщения"""
+    if media_type == 'photo' and message.photo:
+        return message.photo[-1].file_id
+    if media_type == 'video' and message.video:
+        return message.video.file_id
+    if media_type == 'document' and message.document:
+        return message.document.file_id
+    return None
+
+
+def remember_sent_media(session, media_id, file_id):
+    """Запоминает file_id, с которым медиа только что успешно отправлено (без коммита)"""
+    values = {MediaFile.validated_at: datetime.utcnow()}
+    if file_id:
+        values[MediaFile.file_id] = file_id
+    session.query(MediaFile).filter_by(id=media_id).update(values, synchronize_session=False)
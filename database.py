@@ -1,30 +1,62 @@
-from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime, Boolean, Float, ForeignKey, BigInteger
-from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy import create_engine, event, inspect, text, and_, or_, Column, Integer, String, Text, DateTime, Boolean, Float, ForeignKey, BigInteger, Index
+from sqlalchemy.ext.declarative import declarative_base, declared_attr
 from sqlalchemy.orm import sessionmaker, relationship
 from datetime import datetime, timedelta
+import logging
 import pytz
 
 Base = declarative_base()
 
-class User(Base):
+logger = logging.getLogger(__name__)
+
+class Tenant(Base):
+    """Бот арендатора: свой токен, администратор и приватный канал"""
+    __tablename__ = 'tenants'
+    
+    id = Column(Integer, primary_key=True)
+    key = Column(String(50), unique=True, nullable=False)
+    name = Column(String(100))
+    bot_token = Column(String(200), unique=True, nullable=False)
+    admin_id = Column(BigInteger, nullable=False)
+    private_channel_id = Column(String(100))
+    private_channel_link = Column(String(500))
+    is_active = Column(Boolean, default=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class TenantScoped:
+    """
+    Данные арендатора. Запросы к таким моделям автоматически ограничиваются
+    текущим арендатором, новые строки получают его tenant_id (см. tenancy.py)
+    """
+    @declared_attr
+    def tenant_id(cls):
+        return Column(Integer, ForeignKey('tenants.id'), index=True)
+
+class User(TenantScoped, Base):
     __tablename__ = 'users'
     
     id = Column(Integer, primary_key=True)
-    telegram_id = Column(BigInteger, unique=True, nullable=False)  # ИЗМЕНИЛИ Integer на BigInteger
+    telegram_id = Column(BigInteger, nullable=False)  # ИЗМЕНИЛИ Integer на BigInteger
     username = Column(String(100))
     first_name = Column(String(100))
     last_name = Column(String(100))
     balance = Column(Integer, default=0)  # Звёзды
     tariff = Column(String(50))
-    subscription_end = Column(DateTime)
+    subscription_end = Column(DateTime, index=True)
     joined_channel = Column(Boolean, default=False)
+    is_blocked = Column(Boolean, default=False)  # пользователь заблокировал бота
     created_at = Column(DateTime, default=datetime.utcnow)
     
     channels = relationship("UserChannel", back_populates="user")
     posts = relationship("ScheduledPost", back_populates="user")
     payments = relationship("Payment", back_populates="user")
+    
+    __table_args__ = (
+        # Один и тот же человек может быть пользователем нескольких ботов
+        Index('ux_users_tenant_telegram', 'tenant_id', 'telegram_id', unique=True),
+    )
 
-class UserChannel(Base):
+class UserChannel(TenantScoped, Base):
     __tablename__ = 'user_channels'
     
     id = Column(Integer, primary_key=True)
@@ -37,24 +69,85 @@ class UserChannel(Base):
     
     user = relationship("User", back_populates="channels")
     posts = relationship("ScheduledPost", back_populates="channel")
+    
+    __table_args__ = (
+        # Постраничный вывод "Мои каналы"; обычный составной индекс, строки
+        # страницы дочитываются из таблицы
+        Index('ix_user_channels_user_page', 'user_id', 'is_active', 'id'),
+    )
 
-class ScheduledPost(Base):
+class MediaFile(TenantScoped, Base):
+    """Медиа, адресуемое по file_unique_id, с последним рабочим file_id"""
+    __tablename__ = 'media_files'
+    
+    id = Column(Integer, primary_key=True)
+    file_unique_id = Column(String(100), nullable=False)
+    media_type = Column(String(20), nullable=False)
+    file_id = Column(String(500), nullable=False)
+    validated_at = Column(DateTime)  # когда file_id последний раз успешно отправлен
+    created_at = Column(DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        # file_id действует только для бота, который его получил
+        Index('ux_media_files_tenant_unique', 'tenant_id', 'file_unique_id', unique=True),
+    )
+
+class PostContent(TenantScoped, Base):
+    """Тело поста, хранится один раз на уникальный хэш текста и медиа"""
+    __tablename__ = 'post_contents'
+    
+    id = Column(Integer, primary_key=True)
+    content_hash = Column(String(64), nullable=False)
+    content = Column(Text)
+    media_type = Column(String(20))
+    media_id = Column(Integer, ForeignKey('media_files.id'))
+    created_at = Column(DateTime, default=datetime.utcnow)
+    
+    media = relationship("MediaFile")
+    
+    __table_args__ = (
+        Index('ux_post_contents_tenant_hash', 'tenant_id', 'content_hash', unique=True),
+    )
+
+class ScheduledPost(TenantScoped, Base):
     __tablename__ = 'scheduled_posts'
     
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey('users.id'))
     channel_id = Column(Integer, ForeignKey('user_channels.id'))
+    content_id = Column(Integer, ForeignKey('post_contents.id'))
+    # Устаревшие колонки: заполнены только у постов, созданных до post_contents
     content = Column(Text)
     media_type = Column(String(20))  # photo, video, document, etc
     media_file_id = Column(String(500))
     schedule_time = Column(DateTime, nullable=False)
     is_published = Column(Boolean, default=False)
+    publish_started_at = Column(DateTime)  # захват публикации, см. claim_post
+    message_id = Column(BigInteger)  # ID сообщения в канале после отправки
+    publish_error = Column(String(500))  # причина последней неудачной публикации
     created_at = Column(DateTime, default=datetime.utcnow)
     
     user = relationship("User", back_populates="posts")
     channel = relationship("UserChannel", back_populates="posts")
+    body = relationship("PostContent")
+    
+    def resolved_content(self):
+        """(текст, тип медиа, file_id) с учетом устаревших колонок"""
+        if self.body:
+            media = self.body.media
+            return self.body.content, self.body.media_type, media.file_id if media else None
+        return self.content, self.media_type, self.media_file_id
+    
+    __table_args__ = (
+        Index('ix_scheduled_posts_published_time', 'is_published', 'schedule_time'),
+        # Постраничный вывод "Мои посты" и подсчет лимитов по пользователю.
+        # Обычный составной индекс, не покрывающий: он задает порядок и
+        # границу страницы, а текст и канал дочитываются из таблицы только
+        # для PAGE_SIZE + 1 строк страницы
+        Index('ix_scheduled_posts_user_page', 'user_id', 'is_published', 'schedule_time', 'id'),
+    )
 
-class Payment(Base):
+class Payment(TenantScoped, Base):
     __tablename__ = 'payments'
     
     id = Column(Integer, primary_key=True)
@@ -66,6 +159,74 @@ class Payment(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     
     user = relationship("User", back_populates="payments")
+    
+    __table_args__ = (
+        # Telegram может доставить successful_payment повторно - дубли отсекаются индексом
+        Index('ux_payments_telegram_payment_id', 'telegram_payment_id', unique=True),
+    )
+
+class Tariff(TenantScoped, Base):
+    __tablename__ = 'tariffs'
+    
+    id = Column(Integer, primary_key=True)
+    key = Column(String(50), nullable=False)
+    name = Column(String(100), nullable=False)
+    stars = Column(Integer, nullable=False)
+    channels_limit = Column(Integer, nullable=False)
+    posts_per_day = Column(Integer, nullable=False)
+    duration_days = Column(Integer, nullable=False)
+    is_active = Column(Boolean, default=True)
+    sort_order = Column(Integer, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    __table_args__ = (
+        Index('ux_tariffs_tenant_key', 'tenant_id', 'key', unique=True),
+    )
+
+class CacheVersion(Base):
+    """
+    Версии кэшируемых данных: каждый процесс сравнивает свою версию с этой.
+    Общая для всех арендаторов - это согласование кэшей процессов, а не данные
+    """
+    __tablename__ = 'cache_versions'
+    
+    name = Column(String(50), primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class StatsRollup(TenantScoped, Base):
+    """Накопленные итоги по строкам, перенесенным в архив"""
+    __tablename__ = 'stats_rollups'
+    
+    tenant_id = Column(Integer, ForeignKey('tenants.id'), primary_key=True)
+    name = Column(String(50), primary_key=True)
+    value = Column(BigInteger, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class Broadcast(TenantScoped, Base):
+    """Рассылка администратора с курсором для продолжения после перезапуска"""
+    __tablename__ = 'broadcasts'
+    
+    id = Column(Integer, primary_key=True)
+    audience = Column(String(60), nullable=False)  # all, active, expired, tariff:<key>
+    content = Column(Text)
+    media_type = Column(String(20))
+    media_file_id = Column(String(500))
+    status = Column(String(20), nullable=False, default='running')  # running, paused, done, cancelled
+    max_user_id = Column(Integer, nullable=False)  # получатели - пользователи на момент запуска
+    cursor_user_id = Column(Integer, nullable=False, default=0)  # последний обработанный users.id
+    total = Column(Integer, nullable=False, default=0)
+    sent = Column(Integer, nullable=False, default=0)
+    failed = Column(Integer, nullable=False, default=0)
+    blocked = Column(Integer, nullable=False, default=0)
+    progress_chat_id = Column(BigInteger)
+    progress_message_id = Column(BigInteger)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    finished_at = Column(DateTime)
+    
+    __table_args__ = (
+        Index('ix_broadcasts_status', 'status'),
+    )
 
 # Инициализация базы данных
 def init_db():
@@ -75,11 +236,115 @@ def init_db():
         engine = create_engine(Config.DATABASE_URL)
     else:
         engine = create_engine(Config.DATABASE_URL, connect_args={'check_same_thread': False})
+        configure_sqlite(engine)
     
     Base.metadata.create_all(engine)
+    ensure_columns(engine)
+    ensure_indexes(engine)
     Session = sessionmaker(bind=engine)
     return Session()
 
+def configure_sqlite(engine):
+    """
+    Рабочий профиль SQLite: WAL (читатели не блокируют писателя),
+    synchronous=NORMAL (fsync только на чекпоинтах), ожидание блокировки
+    вместо мгновенной ошибки "database is locked", mmap и кэш страниц.
+    """
+    from config import Config
+    
+    @event.listens_for(engine, "connect")
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute(f"PRAGMA busy_timeout={Config.SQLITE_BUSY_TIMEOUT_MS}")
+        cursor.execute(f"PRAGMA mmap_size={Config.SQLITE_MMAP_SIZE}")
+        cursor.execute(f"PRAGMA cache_size=-{Config.SQLITE_CACHE_SIZE_KB}")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.close()
+
+def begin_savepoint(session):
+    """
+    session.begin_nested(), который работает и на pysqlite: драйвер не
+    открывает транзакцию перед SAVEPOINT, и RELEASE внешнего savepoint
+    закоммитил бы его содержимое отдельно от остальной транзакции сессии
+    """
+    if session.get_bind().dialect.name == 'sqlite':
+        if not session.connection().connection.dbapi_connection.in_transaction:
+            session.execute(text("BEGIN"))
+    return session.begin_nested()
+
+def sqlite_maintenance(session, optimize=False):
+    """Чекпоинт WAL (и при необходимости PRAGMA optimize)"""
+    if session.get_bind().dialect.name != 'sqlite':
+        return None
+    busy, log_pages, checkpointed = session.execute(text("PRAGMA wal_checkpoint(PASSIVE)")).one()
+    if optimize:
+        session.execute(text("PRAGMA optimize"))
+    return busy, log_pages, checkpointed
+
+def ensure_columns(engine):
+    """create_all не добавляет новые колонки в уже существующие таблицы"""
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            existing = {c['name'] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                column_type = column.type.compile(dialect=engine.dialect)
+                conn.execute(text(f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column_type}'))
+
+def ensure_indexes(engine):
+    """create_all не добавляет новые индексы в уже существующие таблицы"""
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
+
+# Ключи, которые до появления арендаторов были уникальны на всю таблицу
+LEGACY_KEYS = {
+    'users': ['telegram_id'],
+    'media_files': ['file_unique_id'],
+    'post_contents': ['content_hash'],
+    'tariffs': ['key'],
+}
+
+def ensure_tenant_keys(engine, default_tenant_id):
+    """
+    Переводит базу, созданную до арендаторов: строки без tenant_id отходят
+    арендатору по умолчанию, глобальные уникальные ключи заменяются ключами
+    в пределах арендатора. SQLite не умеет удалять ограничения, поэтому там
+    старые ключи остаются (один бот работает как раньше, для нескольких
+    нужна новая база).
+    """
+    tables = [model.__table__ for model in TenantScoped.__subclasses__()]
+    with engine.begin() as conn:
+        for table in tables:
+            conn.execute(
+                table.update().where(table.c.tenant_id.is_(None)).values(tenant_id=default_tenant_id)
+            )
+    
+    inspector = inspect(engine)
+    postgres = engine.dialect.name == 'postgresql'
+    with engine.begin() as conn:
+        shared = conn.execute(text("SELECT COUNT(*) FROM tenants")).scalar() > 1
+        for table_name, columns in LEGACY_KEYS.items():
+            for constraint in inspector.get_unique_constraints(table_name):
+                if constraint['column_names'] != columns:
+                    continue
+                if postgres:
+                    conn.execute(text(f'ALTER TABLE "{table_name}" DROP CONSTRAINT "{constraint["name"]}"'))
+                elif shared:
+                    logger.warning(f"Таблица {table_name}: ключ {columns} уникален для всех арендаторов")
+        
+        pk = inspector.get_pk_constraint('stats_rollups')
+        if pk['constrained_columns'] == ['name']:
+            if postgres:
+                conn.execute(text(f'ALTER TABLE stats_rollups DROP CONSTRAINT "{pk["name"]}"'))
+                conn.execute(text('ALTER TABLE stats_rollups ADD PRIMARY KEY (tenant_id, name)'))
+            elif shared:
+                logger.warning("Таблица stats_rollups: итоги архива общие для всех арендаторов")
+
 # Функции для работы с пользователями
 def get_or_create_user(session, telegram_id, username, first_name, last_name):
     user = session.query(User).filter_by(telegram_id=telegram_id).first()
@@ -110,7 +375,102 @@ def get_user_subscription_info(session, user_id):
         'tariff': user.tariff,
         'subscription_end': user.subscription_end,
         'is_active': is_active,
-        'channels_count': len([c for c in user.channels if c.is_active]),
-        'posts_today': len([p for p in user.posts 
-                          if p.created_at.date() == now.date() and not p.is_published])
+        'channels_count': session.query(UserChannel).filter_by(user_id=user.id, is_active=True).count(),
+        'posts_today': session.query(ScheduledPost).filter(
+            ScheduledPost.user_id == user.id,
+            ScheduledPost.is_published == False,
+            ScheduledPost.created_at >= datetime(now.year, now.month, now.day)
+        ).count()
     }
+
+def get_cache_version(session, name):
+    return session.query(CacheVersion.version).filter_by(name=name).scalar() or 0
+
+def bump_cache_version(session, name):
+    """Атомарно увеличивает версию кэша (без коммита)"""
+    updated = session.query(CacheVersion).filter_by(name=name).update(
+        {CacheVersion.version: CacheVersion.version + 1, CacheVersion.updated_at: datetime.utcnow()},
+        synchronize_session=False
+    )
+    if not updated:
+        session.add(CacheVersion(name=name, version=1))
+
+def get_rollups(session):
+    return dict(session.query(StatsRollup.name, StatsRollup.value).all())
+
+def add_to_rollup(session, tenant_id, name, delta):
+    """Атомарно прибавляет delta к итогу арендатора (без коммита)"""
+    updated = session.query(StatsRollup).filter_by(tenant_id=tenant_id, name=name).update(
+        {StatsRollup.value: StatsRollup.value + delta, StatsRollup.updated_at: datetime.utcnow()},
+        synchronize_session=False
+    )
+    if not updated:
+        session.add(StatsRollup(tenant_id=tenant_id, name=name, value=delta))
+
+def claim_post(session, post_id):
+    """
+    Атомарно отмечает начало публикации. True - пост захвачен этим процессом,
+    False - он уже опубликован или публикуется другим процессом.
+    """
+    claimed = session.query(ScheduledPost).filter(
+        ScheduledPost.id == post_id,
+        ScheduledPost.is_published == False,
+        ScheduledPost.publish_started_at.is_(None)
+    ).update({ScheduledPost.publish_started_at: datetime.utcnow()}, synchronize_session=False)
+    return bool(claimed)
+
+def mark_post_failed(session, post_id, error):
+    """
+    Снимает захват после неудачной отправки и сохраняет причину. Такие посты
+    не выбираются для публикации, пока пользователь их не перенесет.
+    """
+    session.query(ScheduledPost).filter_by(id=post_id).update(
+        {ScheduledPost.publish_started_at: None, ScheduledPost.publish_error: error[:500]},
+        synchronize_session=False
+    )
+
+def mark_post_published(session, post_id, message_id):
+    session.query(ScheduledPost).filter_by(id=post_id).update(
+        {ScheduledPost.is_published: True, ScheduledPost.message_id: message_id},
+        synchronize_session=False
+    )
+
+def _keyset_condition(keys, values, reverse):
+    """Лексикографическое (k1, k2, ...) > (v1, v2, ...) без row values"""
+    clauses = []
+    for i, (column, value) in enumerate(zip(keys, values)):
+        compare = column < value if reverse else column > value
+        clauses.append(and_(*[k == v for k, v in zip(keys[:i], values[:i])], compare))
+    return or_(*clauses)
+
+def keyset_page(query, keys, limit, after=None, before=None, descending=False):
+    """
+    Страница выборки по ключу вместо OFFSET.
+
+    keys - колонки сортировки (последняя уникальна, обычно id), after/before -
+    значения ключей последней/первой строки соседней страницы.
+    Возвращает (rows, has_prev, has_next).
+    """
+    backwards = before is not None
+    reverse = descending != backwards
+    cursor = before if backwards else after
+
+    if cursor is not None:
+        query = query.filter(_keyset_condition(keys, cursor, reverse))
+    order = [k.desc() if reverse else k.asc() for k in keys]
+    rows = query.order_by(*order).limit(limit + 1).all()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if backwards:
+        rows.reverse()
+        return rows, has_more, True
+    return rows, after is not None, has_more
+
+def save_broadcast_progress(session, broadcast_id, values, blocked_user_ids=()):
+    """Чекпоинт рассылки и отметка заблокировавших бота (без коммита)"""
+    session.query(Broadcast).filter_by(id=broadcast_id).update(values, synchronize_session=False)
+    if blocked_user_ids:
+        session.query(User).filter(User.id.in_(blocked_user_ids)).update(
+            {User.is_blocked: True}, synchronize_session=False
+        )
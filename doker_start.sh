@@ -29,7 +29,7 @@ from config import Config
 engine = create_engine(Config.DATABASE_URL)
 inspector = inspect(engine)
 
-tables = ['users', 'user_channels', 'scheduled_posts', 'payments']
+tables = ['tenants', 'users', 'user_channels', 'scheduled_posts', 'payments', 'tariffs', 'cache_versions', 'stats_rollups', 'broadcasts']
 for table in tables:
     if inspector.has_table(table):
         print(f'✅ Таблица {table} существует')
@@ -0,0 +1,137 @@
+"""
+Таймлайн окончания подписок.
+
+Вместо периодического опроса таблицы users события (напоминание до
+окончания и кик после KICK_AFTER_EXPIRY) хранятся в min-heap в памяти.
+Куча строится из БД при старте, пополняется при оплате, а в планировщике
+всегда стоит ровно одна задача - на время ближайшего события. События
+арендаторов, чей бот еще не запущен или уже остановлен, откладываются до
+его запуска (resume), а не теряются.
+"""
+
+import heapq
+import itertools
+import logging
+from datetime import datetime, timedelta
+
+from apscheduler.triggers.date import DateTrigger
+
+from config import Config
+from database import User
+from tenancy import unscoped
+
+logger = logging.getLogger(__name__)
+
+JOB_ID = "expiry_timeline"
+
+REMIND = 'remind'
+KICK = 'kick'
+
+
+class ExpiryTimeline:
+    def __init__(self, scheduler):
+        self.scheduler = scheduler
+        self._heap = []
+        self._seq = itertools.count()
+        self._session = None
+        self._actions = {}
+        self._hosted = None
+        self._parked = {}  # tenant_id -> отложенные события
+        self._armed_at = None
+
+    def start(self, session, actions, hosted=None):
+        """
+        actions: {REMIND: coroutine(user), KICK: coroutine(user)}
+        hosted: функция без аргументов - tenant_id запущенных ботов
+        Перестраивает кучу из БД и ставит задачу на ближайшее событие.
+        """
+        self._session = session
+        self._actions = actions
+        self._hosted = hosted
+        self._parked = {}
+        self.rebuild()
+
+    def resume(self, tenant_id):
+        """Бот арендатора запущен: отложенные события возвращаются в кучу"""
+        for event in self._parked.pop(tenant_id, []):
+            heapq.heappush(self._heap, event)
+        self._arm()
+
+    def rebuild(self):
+        now = datetime.utcnow()
+        kick_after = timedelta(hours=Config.KICK_AFTER_EXPIRY)
+
+        # Индекс по subscription_end: берем только еще не отработанные подписки
+        rows = self._session.query(User.id, User.subscription_end).filter(
+            User.subscription_end.isnot(None),
+            (User.subscription_end > now - kick_after) | (User.joined_channel == True)
+        ).all()
+
+        self._heap = []
+        for user_id, subscription_end in rows:
+            self._heap.extend(self._events(user_id, subscription_end, now))
+        heapq.heapify(self._heap)
+
+        logger.info(f"Таймлайн подписок построен: {len(self._heap)} событий")
+        self._arm()
+
+    def _events(self, user_id, subscription_end, now):
+        events = []
+        remind_at = subscription_end - timedelta(hours=Config.EXPIRY_REMINDER_HOURS)
+        if remind_at > now:
+            events.append((remind_at, next(self._seq), user_id, REMIND, subscription_end))
+        kick_at = subscription_end + timedelta(hours=Config.KICK_AFTER_EXPIRY)
+        events.append((kick_at, next(self._seq), user_id, KICK, subscription_end))
+        return events
+
+    def push(self, user_id, subscription_end):
+        """Добавляет события для новой даты окончания (после оплаты)"""
+        for event in self._events(user_id, subscription_end, datetime.utcnow()):
+            heapq.heappush(self._heap, event)
+        self._arm()
+
+    def next_event_at(self):
+        return self._heap[0][0] if self._heap else None
+
+    def _arm(self):
+        when = self.next_event_at()
+        if when is None:
+            if self.scheduler.get_job(JOB_ID):
+                self.scheduler.remove_job(JOB_ID)
+            self._armed_at = None
+            return
+        if when == self._armed_at and self.scheduler.get_job(JOB_ID):
+            return
+
+        # Таймлайн общий для всех арендаторов
+        self.scheduler.add_job(
+            unscoped(self._fire),
+            DateTrigger(run_date=max(when, datetime.utcnow())),
+            id=JOB_ID,
+            replace_existing=True
+        )
+        self._armed_at = when
+
+    async def _fire(self):
+        self._armed_at = None
+        now = datetime.utcnow()
+
+        hosted = self._hosted() if self._hosted else None
+        while self._heap and self._heap[0][0] <= now:
+            event = heapq.heappop(self._heap)
+            _, _, user_id, action, subscription_end = event
+
+            user = self._session.query(User).get(user_id)
+            # Подписку продлили - у новой даты свои события в куче
+            if not user or user.subscription_end != subscription_end:
+                continue
+            if hosted is not None and user.tenant_id not in hosted:
+                self._parked.setdefault(user.tenant_id, []).append(event)
+                continue
+
+            try:
+                await self._actions[action](user)
+            except Exception as e:
+                logger.error(f"Ошибка события {action} для пользователя {user.telegram_id}: {e}")
+
+        self._arm()
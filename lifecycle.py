@@ -0,0 +1,55 @@
+"""
+Жизненный цикл процесса: учет работ в процессе и корректная остановка.
+
+При SIGTERM (деплой) бот перестает брать новые обновления и задачи
+планировщика, ждет завершения начатых публикаций и фоновых задач не дольше
+SHUTDOWN_TIMEOUT секунд, после чего сбрасывает незакоммиченные изменения и
+закрывает пул соединений.
+"""
+
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+
+logger = logging.getLogger(__name__)
+
+
+class Lifecycle:
+    def __init__(self):
+        self.accepting = True
+        self._in_flight = {}
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    @property
+    def in_flight(self):
+        return sum(self._in_flight.values())
+
+    @asynccontextmanager
+    async def track(self, kind):
+        """Отмечает работу, которую нужно дождаться при остановке"""
+        self._in_flight[kind] = self._in_flight.get(kind, 0) + 1
+        self._idle.clear()
+        try:
+            yield
+        finally:
+            self._in_flight[kind] -= 1
+            if not self.in_flight:
+                self._idle.set()
+
+    def stop_intake(self):
+        self.accepting = False
+
+    async def drain(self, timeout):
+        """Ждет завершения начатых работ; False, если не уложились в timeout"""
+        started = time.monotonic()
+        if self.in_flight:
+            logger.info(f"Ожидание завершения работ: {self._in_flight}")
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Не дождались завершения работ за {timeout} с: {self._in_flight}")
+            return False
+        logger.info(f"Работы завершены за {time.monotonic() - started:.1f} с")
+        return True
@@ -0,0 +1,115 @@
+"""
+Оплата тарифов через Telegram Stars.
+
+send_invoice -> pre_checkout_query -> successful_payment.
+Ответ на pre_checkout_query строится только по payload счета и кэшу тарифов,
+без обращений к БД. Зачисление идемпотентно: платеж с тем же
+telegram_payment_id отсекается уникальным индексом.
+"""
+
+import logging
+from datetime import datetime, timedelta
+
+from sqlalchemy.exc import IntegrityError
+
+from database import User, Payment
+from tariffs import tariff_cache
+
+logger = logging.getLogger(__name__)
+
+CURRENCY = 'XTR'
+PAYLOAD_PREFIX = 'tariff'
+
+
+def make_invoice_payload(tariff_key, telegram_id, stars):
+    """Payload счета: всё, что нужно для проверки без запросов к БД"""
+    return f"{PAYLOAD_PREFIX}:{tariff_key}:{telegram_id}:{stars}"
+
+
+def parse_invoice_payload(payload):
+    """Возвращает (tariff_key, telegram_id, stars) или None"""
+    try:
+        prefix, tariff_key, telegram_id, stars = payload.split(':')
+        if prefix != PAYLOAD_PREFIX:
+            return None
+        return tariff_key, int(telegram_id), int(stars)
+    except (AttributeError, ValueError):
+        return None
+
+
+def check_pre_checkout(pre_checkout_query):
+    """Проверка перед списанием звёзд: (ok, текст ошибки)"""
+    parsed = parse_invoice_payload(pre_checkout_query.invoice_payload)
+    if not parsed:
+        return False, "Неверный счет. Создайте новый в разделе тарифов."
+
+    tariff_key, telegram_id, stars = parsed
+    tariff = tariff_cache.get(tariff_key)
+
+    if pre_checkout_query.from_user.id != telegram_id:
+        return False, "Этот счет выставлен другому пользователю."
+    if not tariff or not tariff['is_active']:
+        return False, "Тариф больше не доступен."
+    if pre_checkout_query.currency != CURRENCY or pre_checkout_query.total_amount != stars:
+        return False, "Сумма счета не совпадает с тарифом."
+    if tariff['stars'] != stars:
+        return False, "Цена тарифа изменилась. Создайте новый счет."
+
+    return True, None
+
+
+def apply_successful_payment(session, telegram_id, successful_payment):
+    """
+    Зачисляет платеж и продлевает подписку одной транзакцией.
+
+    Строка пользователя блокируется (SELECT ... FOR UPDATE), поэтому
+    параллельные платежи продлевают подписку последовательно, а повторная
+    доставка того же платежа упирается в уникальный индекс.
+    Возвращает (user, tariff) или (None, None) для дубля и для платежа,
+    который нельзя зачислить (чужой payload, неизвестный тариф).
+    """
+    charge_id = successful_payment.telegram_payment_charge_id
+    parsed = parse_invoice_payload(successful_payment.invoice_payload)
+    if not parsed:
+        logger.error(
+            f"Платеж {charge_id} от {telegram_id}: неизвестный payload "
+            f"{successful_payment.invoice_payload!r} - не зачислен"
+        )
+        return None, None
+
+    tariff_key, _, _ = parsed
+    tariff = tariff_cache.get(tariff_key)
+    if not tariff:
+        logger.error(f"Платеж {charge_id} от {telegram_id}: тариф {tariff_key} не найден - не зачислен")
+        return None, None
+
+    try:
+        user = session.query(User).filter_by(telegram_id=telegram_id).with_for_update().first()
+        if not user:
+            raise ValueError(f"Пользователь {telegram_id} не найден")
+
+        session.add(Payment(
+            user_id=user.id,
+            amount=successful_payment.total_amount,
+            tariff=tariff_key,
+            is_completed=True,
+            telegram_payment_id=charge_id
+        ))
+        session.flush()
+
+        now = datetime.utcnow()
+        base = user.subscription_end if user.subscription_end and user.subscription_end > now else now
+        user.tariff = tariff_key
+        user.subscription_end = base + timedelta(days=tariff['duration_days'])
+        session.commit()
+
+    except IntegrityError:
+        session.rollback()
+        logger.info(f"Повторная доставка платежа {charge_id} - пропущено")
+        return None, None
+    except Exception:
+        session.rollback()
+        raise
+
+    logger.info(f"Платеж {charge_id}: {telegram_id} -> {tariff_key} до {user.subscription_end}")
+    return user, tariff
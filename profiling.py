@@ -0,0 +1,185 @@
+"""
+Профилирование по запросу из админ панели.
+
+Два режима захвата на N секунд:
+- cprofile: cProfile для всего, что выполняется в event loop (обработчики
+  и асинхронные задачи планировщика), результат - файл .pstats;
+- sample: поток-сэмплер снимает стек главного потока каждые
+  PROFILE_SAMPLE_INTERVAL_MS, результат - collapsed stacks для flamegraph.
+
+Во время захвата через события SQLAlchemy записываются SQL запросы
+дольше PROFILE_SLOW_SQL_MS.
+"""
+
+import cProfile
+import io
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+from sqlalchemy import event
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+CPROFILE = 'cprofile'
+SAMPLE = 'sample'
+MODES = (CPROFILE, SAMPLE)
+
+
+class SlowQueryRecorder:
+    def __init__(self, engine, threshold_ms):
+        self.engine = engine
+        self.threshold = threshold_ms / 1000
+        self.queries = []
+        self.total = 0
+
+    def _before(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('profile_started', []).append(time.perf_counter())
+
+    def _after(self, conn, cursor, statement, parameters, context, executemany):
+        started_stack = conn.info.get('profile_started')
+        if not started_stack:
+            # Запрос начался до установки обработчиков
+            return
+        started = started_stack.pop()
+        elapsed = time.perf_counter() - started
+        self.total += 1
+        if elapsed >= self.threshold:
+            self.queries.append((elapsed, statement, repr(parameters)[:500]))
+
+    def install(self):
+        event.listen(self.engine, 'before_cursor_execute', self._before)
+        event.listen(self.engine, 'after_cursor_execute', self._after)
+
+    def remove(self):
+        event.remove(self.engine, 'before_cursor_execute', self._before)
+        event.remove(self.engine, 'after_cursor_execute', self._after)
+
+    def report(self):
+        lines = [
+            f"Запросов всего: {self.total}, медленных (>= {self.threshold * 1000:.0f} мс): {len(self.queries)}",
+            ""
+        ]
+        for elapsed, statement, parameters in sorted(self.queries, key=lambda q: q[0], reverse=True):
+            lines.append(f"-- {elapsed * 1000:.1f} мс")
+            lines.append(statement.strip())
+            lines.append(f"-- params: {parameters}")
+            lines.append("")
+        return "\n".join(lines)
+
+
+class StackSampler:
+    """Сэмплер стека одного потока (по умолчанию - потока event loop)"""
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def collapsed(self):
+        return "\n".join(f"{stack} {count}" for stack, count in self.stacks.most_common())
+
+
+class Profiler:
+    def __init__(self, engine):
+        self.engine = engine
+        self.mode = None
+        self.started_at = None
+        self._profile = None
+        self._sampler = None
+        self._queries = None
+
+    @property
+    def running(self):
+        return self.mode is not None
+
+    def start(self, mode):
+        """Начинает захват в текущем (главном) потоке"""
+        if self.running:
+            raise RuntimeError("Профилирование уже запущено")
+        if mode not in MODES:
+            raise ValueError(f"Неизвестный режим: {mode}")
+
+        self._queries = SlowQueryRecorder(self.engine, Config.PROFILE_SLOW_SQL_MS)
+        self._queries.install()
+
+        if mode == CPROFILE:
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        else:
+            self._sampler = StackSampler(
+                threading.get_ident(),
+                Config.PROFILE_SAMPLE_INTERVAL_MS / 1000
+            )
+            self._sampler.start()
+
+        self.mode = mode
+        self.started_at = time.monotonic()
+        logger.info(f"Профилирование запущено ({mode})")
+
+    def stop(self):
+        """Завершает захват и возвращает список файлов [(имя, bytes)]"""
+        if not self.running:
+            return []
+
+        duration = time.monotonic() - self.started_at
+        stamp = datetime.utcnow().strftime('%Y%m%d_%H%M%S')
+        files = []
+
+        if self._profile:
+            self._profile.disable()
+            # pstats умеет сохранять только в файл
+            with tempfile.TemporaryDirectory() as tmp:
+                path = os.path.join(tmp, 'profile.pstats')
+                self._profile.dump_stats(path)
+                with open(path, 'rb') as f:
+                    files.append((f"profile_{stamp}.pstats", f.read()))
+            self._profile = None
+
+        if self._sampler:
+            self._sampler.stop()
+            files.append((f"profile_{stamp}.collapsed.txt", self._sampler.collapsed().encode()))
+            self._sampler = None
+
+        self._queries.remove()
+        files.append((f"slow_sql_{stamp}.txt", self._queries.report().encode()))
+        self._queries = None
+
+        logger.info(f"Профилирование остановлено ({self.mode}, {duration:.1f} с)")
+        self.mode = None
+        self.started_at = None
+        return files
+
+
+def as_document(name, data):
+    """Файл в памяти для send_document"""
+    document = io.BytesIO(data)
+    document.name = name
+    return document
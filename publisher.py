@@ -0,0 +1,206 @@
+"""
+Диспетчер публикаций с упреждающей выборкой.
+
+Раз в PUBLISH_TICK_SECONDS одним запросом (с жадной загрузкой канала,
+пользователя и тела поста) выбираются посты, которые должны выйти в
+ближайшие PUBLISH_LOOKAHEAD_SECONDS. Они заранее превращаются в готовые
+к отправке StagedPost без обращений к ORM и раскладываются по очередям
+каналов. Воркер канала отпускает посты точно в срок и строго по порядку
+(schedule_time, id), поэтому в пиковые минуты в момент публикации не
+выполняется ни одного запроса на чтение.
+"""
+
+import asyncio
+import heapq
+import logging
+from datetime import datetime, timedelta
+
+from sqlalchemy.orm import joinedload
+
+from database import ScheduledPost, PostContent
+
+logger = logging.getLogger(__name__)
+
+
+class StagedPost:
+    """Всё, что нужно для отправки поста, без ссылок на сессию"""
+
+    __slots__ = (
+        'post_id', 'tenant_id', 'due', 'channel_key', 'chat_id', 'channel_name',
+        'user_telegram_id', 'content', 'media_type', 'file_id', 'media_id'
+    )
+
+    def __init__(self, post):
+        content, media_type, file_id = post.resolved_content()
+        self.post_id = post.id
+        self.tenant_id = post.tenant_id
+        self.due = post.schedule_time
+        self.channel_key = post.channel_id
+        self.chat_id = post.channel.channel_id
+        self.channel_name = post.channel.channel_name
+        self.user_telegram_id = post.user.telegram_id
+        self.content = content
+        self.media_type = media_type
+        self.file_id = file_id
+        self.media_id = post.body.media_id if post.body else None
+
+
+class Publisher:
+    def __init__(self, session, lookahead, concurrency):
+        self.session = session
+        self.lookahead = timedelta(seconds=lookahead)
+        self.concurrency = concurrency
+        self.accepting = False
+        self._deliver = None
+        self._tenant_ids = None
+        self._semaphore = None
+        self._staged = {}    # post_id -> StagedPost
+        self._lanes = {}     # канал -> куча (due, post_id)
+        self._wakeups = {}   # канал -> asyncio.Event
+        self._workers = {}   # канал -> asyncio.Task
+
+    @property
+    def staged_count(self):
+        return len(self._staged)
+
+    def start(self, deliver, tenant_ids=None):
+        """
+        deliver: coroutine(StagedPost) - отправка одного поста;
+        tenant_ids: арендаторы, чьи боты запущены в этом процессе
+        """
+        self._deliver = deliver
+        self._tenant_ids = tenant_ids
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self.accepting = True
+        self.tick()
+
+    def serve(self, tenant_ids):
+        """Бот подключился или отключился: меняется набор арендаторов, чьи посты публикуются"""
+        self._tenant_ids = tenant_ids
+        self.tick()
+
+    def stop(self):
+        """Перестает отпускать посты; неотправленные останутся в БД до запуска"""
+        self.accepting = False
+        for wake in self._wakeups.values():
+            wake.set()
+
+    def _pending_query(self):
+        query = self.session.query(ScheduledPost).options(
+            joinedload(ScheduledPost.channel),
+            joinedload(ScheduledPost.user),
+            joinedload(ScheduledPost.body).joinedload(PostContent.media)
+        ).filter(
+            ScheduledPost.is_published == False,
+            ScheduledPost.publish_started_at.is_(None),
+            ScheduledPost.publish_error.is_(None)
+        )
+        if self._tenant_ids is not None:
+            query = query.filter(ScheduledPost.tenant_id.in_(self._tenant_ids))
+        return query
+
+    def tick(self, post_ids=None):
+        """Выборка постов на ближайшее окно (или только указанных)"""
+        if not self.accepting:
+            return 0
+
+        horizon = datetime.utcnow() + self.lookahead
+        query = self._pending_query().filter(ScheduledPost.schedule_time <= horizon)
+        if post_ids is not None:
+            query = query.filter(ScheduledPost.id.in_(post_ids))
+        elif self._staged:
+            query = query.filter(ScheduledPost.id.notin_(list(self._staged)))
+
+        try:
+            posts = query.all()
+        except Exception as e:
+            self.session.rollback()
+            logger.error(f"Ошибка выборки постов для публикации: {e}")
+            return 0
+
+        for post in posts:
+            self._stage(StagedPost(post))
+
+        if posts:
+            logger.info(f"Подготовлено к публикации: {len(posts)} (в очереди: {len(self._staged)})")
+        return len(posts)
+
+    async def run_tick(self):
+        """
+        Задача планировщика. Обычную функцию AsyncIOScheduler выполнил бы в
+        пуле потоков - без event loop для воркеров каналов и параллельно с
+        обработчиками, использующими ту же сессию
+        """
+        self.tick()
+
+    def schedule(self, post_id):
+        """Новый или перенесенный пост: сразу в очередь, если он попадает в окно"""
+        self.unstage(post_id)
+        self.tick([post_id])
+
+    def unstage(self, post_id):
+        """Снимает пост с публикации (отмена или перенос)"""
+        staged = self._staged.pop(post_id, None)
+        if staged and staged.channel_key in self._wakeups:
+            self._wakeups[staged.channel_key].set()
+
+    def _stage(self, staged):
+        if staged.post_id in self._staged:
+            return
+
+        key = staged.channel_key
+        if key not in self._workers:
+            # Пост считается выбранным только когда у канала есть воркер,
+            # иначе следующие выборки пропускали бы его, а отправлять было бы
+            # некому (вне event loop get_running_loop падает до всех изменений)
+            loop = asyncio.get_running_loop()
+            self._workers[key] = loop.create_task(self._lane_worker(key))
+            self._lanes[key] = []
+            self._wakeups[key] = asyncio.Event()
+        else:
+            # Новый пост может оказаться раньше того, которого ждет воркер
+            self._wakeups[key].set()
+
+        self._staged[staged.post_id] = staged
+        heapq.heappush(self._lanes[key], (staged.due, staged.post_id))
+
+    async def _lane_worker(self, key):
+        """Публикует посты одного канала по порядку и в срок"""
+        lane = self._lanes[key]
+        wake = self._wakeups[key]
+
+        while lane and self.accepting:
+            due, post_id = lane[0]
+            staged = self._staged.get(post_id)
+            if staged is None or staged.due != due:
+                # Снят с публикации или перенесен
+                heapq.heappop(lane)
+                continue
+
+            delay = (due - datetime.utcnow()).total_seconds()
+            if delay > 0:
+                wake.clear()
+                try:
+                    await asyncio.wait_for(wake.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            heapq.heappop(lane)
+            try:
+                async with self._semaphore:
+                    lag = (datetime.utcnow() - due).total_seconds()
+                    if lag > 5:
+                        logger.warning(f"Пост {post_id} публикуется с опозданием {lag:.1f} с")
+                    await self._deliver(staged)
+            except Exception as e:
+                logger.error(f"Ошибка публикации поста {post_id}: {e}")
+            finally:
+                self._staged.pop(post_id, None)
+
+        # Остановка: неотправленные посты этого канала снимаются из памяти
+        for _, post_id in lane:
+            self._staged.pop(post_id, None)
+        del self._lanes[key]
+        del self._wakeups[key]
+        del self._workers[key]
@@ -23,6 +23,10 @@ def reset_database():
         if os.path.exists('bot.db'):
             os.remove('bot.db')
             print("SQLite база данных удалена")
+        # Файлы журнала WAL
+        for suffix in ('-wal', '-shm'):
+            if os.path.exists('bot.db' + suffix):
+                os.remove('bot.db' + suffix)
     else:
         # Для PostgreSQL используем SQLAlchemy-utils
         try:
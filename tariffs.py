@@ -0,0 +1,182 @@
+"""
+Каталог тарифов: хранится в таблице tariffs, читается из кэша в памяти.
+
+Каждый процесс держит копию каталога и периодически сверяет номер версии
+в cache_versions. Если версия изменилась (тариф отредактирован в админке
+любого процесса), каталог перечитывается целиком. Обращения из обработчиков
+- это чтение словаря без запросов к БД.
+
+У каждого арендатора свой каталог; методы чтения возвращают каталог
+текущего арендатора (tenancy.get_tenant_id).
+"""
+
+import logging
+import re
+
+from config import Config
+from database import Tariff, Tenant, get_cache_version, bump_cache_version
+from tenancy import get_tenant_id, tenant_scope
+
+logger = logging.getLogger(__name__)
+
+CACHE_NAME = 'tariffs'
+
+# Поля, которые можно менять из админ панели
+EDITABLE_FIELDS = {
+    'name': str,
+    'stars': int,
+    'channels_limit': int,
+    'posts_per_day': int,
+    'duration_days': int,
+    'sort_order': int,
+}
+
+# Бесплатный, бессрочный или тариф без каналов не имеет смысла
+POSITIVE_FIELDS = {'stars', 'channels_limit', 'duration_days'}
+
+# Ключ тарифа попадает в callback_data вида buy_<key>, поэтому без "_"
+KEY_RE = re.compile(r'^[a-z0-9]{1,30}$')
+
+
+def _to_dict(row):
+    return {
+        'key': row.key,
+        'name': row.name,
+        'stars': row.stars,
+        'channels_limit': row.channels_limit,
+        'posts_per_day': row.posts_per_day,
+        'duration_days': row.duration_days,
+        'is_active': bool(row.is_active),
+        'sort_order': row.sort_order or 0,
+    }
+
+
+class TariffCache:
+    def __init__(self):
+        self._catalogs = {}  # tenant_id -> {key: тариф}
+        self._version = None
+
+    @property
+    def version(self):
+        return self._version
+
+    @property
+    def _tariffs(self):
+        return self._catalogs.get(get_tenant_id(), {})
+
+    def seed(self, session):
+        """Заполняет каталоги арендаторов без тарифов тарифами из Config.TARIFFS"""
+        with tenant_scope(None):
+            seeded = {row.tenant_id for row in session.query(Tariff.tenant_id).distinct()}
+            tenant_ids = [row.id for row in session.query(Tenant.id) if row.id not in seeded]
+        if not tenant_ids:
+            return
+
+        for tenant_id in tenant_ids:
+            for order, (key, tariff) in enumerate(Config.TARIFFS.items()):
+                session.add(Tariff(
+                    tenant_id=tenant_id,
+                    key=key,
+                    name=tariff['name'],
+                    stars=tariff['stars'],
+                    channels_limit=tariff['channels_limit'],
+                    posts_per_day=tariff['posts_per_day'],
+                    duration_days=tariff['duration_days'],
+                    sort_order=order
+                ))
+        bump_cache_version(session, CACHE_NAME)
+        try:
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            raise e
+        logger.info(f"Тарифы перенесены из конфигурации в БД (арендаторов: {len(tenant_ids)})")
+
+    def load(self, session):
+        """Полная перезагрузка каталогов всех арендаторов из БД"""
+        with tenant_scope(None):
+            version = get_cache_version(session, CACHE_NAME)
+            rows = session.query(Tariff).order_by(Tariff.sort_order, Tariff.id).all()
+
+        # Собираем новые словари и подменяем ссылку целиком,
+        # чтобы читатели никогда не видели частично заполненный каталог
+        catalogs = {}
+        for row in rows:
+            catalogs.setdefault(row.tenant_id, {})[row.key] = _to_dict(row)
+        self._catalogs = catalogs
+        self._version = version
+        logger.info(f"Каталог тарифов загружен (версия {version}, тарифов: {len(rows)})")
+
+    def refresh_if_stale(self, session):
+        """Перечитывает каталог, только если версия в БД изменилась"""
+        try:
+            version = get_cache_version(session, CACHE_NAME)
+            if version != self._version:
+                self.load(session)
+        except Exception as e:
+            session.rollback()
+            logger.error(f"Ошибка обновления кэша тарифов: {e}")
+
+    def get(self, key) -> dict:
+        """Тариф по ключу, включая отключенные (для действующих подписок)"""
+        return self._tariffs.get(key)
+
+    def active(self):
+        """Тарифы, доступные для покупки: список пар (key, tariff)"""
+        return [(key, t) for key, t in self._tariffs.items() if t['is_active']]
+
+    def all(self):
+        return list(self._tariffs.items())
+
+    def update(self, session, key, **fields):
+        """Изменяет тариф, увеличивает версию и сразу перечитывает каталог"""
+        tariff = session.query(Tariff).filter_by(key=key).first()
+        if not tariff:
+            return False
+
+        for field, value in fields.items():
+            setattr(tariff, field, value)
+        bump_cache_version(session, CACHE_NAME)
+        try:
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            raise e
+
+        self.load(session)
+        return True
+
+    def create(self, session, key, name, stars, channels_limit, posts_per_day, duration_days):
+        session.add(Tariff(
+            key=key,
+            name=name,
+            stars=stars,
+            channels_limit=channels_limit,
+            posts_per_day=posts_per_day,
+            duration_days=duration_days,
+            sort_order=len(self._tariffs)
+        ))
+        bump_cache_version(session, CACHE_NAME)
+        try:
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            raise e
+
+        self.load(session)
+
+
+def parse_field_value(field, raw):
+    """Приводит введенное админом значение к типу поля; ValueError при ошибке"""
+    caster = EDITABLE_FIELDS[field]
+    value = caster(raw.strip())
+    if field in POSITIVE_FIELDS and value < 1:
+        raise ValueError("Значение должно быть не меньше 1")
+    if caster is int and value < 0:
+        raise ValueError("Значение не может быть отрицательным")
+    if caster is str and not value:
+        raise ValueError("Пустое значение")
+    return value
+
+
+tariff_cache = TariffCache()
@@ -0,0 +1,219 @@
+"""
+Несколько ботов (арендаторов) в одном процессе.
+
+Каждый арендатор - строка в tenants со своим токеном, администратором и
+приватным каналом; все данные арендатора помечены tenant_id. Текущий
+арендатор хранится в contextvar: обработчики бота выполняются в задачах,
+созданных в контексте его Application, поэтому все ORM запросы из них
+автоматически получают условие tenant_id = текущий (with_loader_criteria в
+do_orm_execute), а новые строки - его tenant_id при добавлении в сессию.
+
+Общие службы (публикация, таймлайн подписок, архивация, обслуживание БД)
+работают без арендатора - по всем данным сразу - и находят нужный бот через
+registry по tenant_id строки.
+
+Управление арендаторами:
+    python tenancy.py list
+    python tenancy.py add <ключ> <токен> <ID администратора> [ID приватного канала] [ссылка]
+    python tenancy.py disable <ключ>
+"""
+
+import asyncio
+import functools
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session, with_loader_criteria
+
+from config import Config
+from database import Tenant, TenantScoped, ensure_tenant_keys
+
+DEFAULT_TENANT_KEY = 'default'
+
+current_tenant = ContextVar('current_tenant', default=None)
+
+_default_tenant_id = None
+
+
+def get_tenant_id():
+    """Текущий арендатор, а вне его контекста - арендатор по умолчанию"""
+    tenant_id = current_tenant.get()
+    return tenant_id if tenant_id is not None else _default_tenant_id
+
+
+@contextmanager
+def tenant_scope(tenant_id):
+    """Выполняет блок от имени арендатора (None - по всем арендаторам)"""
+    token = current_tenant.set(tenant_id)
+    try:
+        yield
+    finally:
+        current_tenant.reset(token)
+
+
+def unscoped(fn):
+    """
+    Задача общих служб. Планировщик запускает задачи в контексте того, кто
+    последним поставил задачу, поэтому арендатор явно сбрасывается.
+    Только корутины: обычную функцию AsyncIOScheduler выполнил бы в пуле
+    потоков - вне event loop и параллельно с обработчиками на общей сессии.
+    """
+    if not asyncio.iscoroutinefunction(fn):
+        raise TypeError(f"unscoped: {fn.__qualname__} должна быть корутиной")
+
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        with tenant_scope(None):
+            return await fn(*args, **kwargs)
+    return wrapper
+
+
+def _limit_to_tenant(state):
+    tenant_id = current_tenant.get()
+    if tenant_id is None or state.is_column_load or state.is_relationship_load:
+        return
+    if state.is_select or state.is_update or state.is_delete:
+        state.statement = state.statement.options(with_loader_criteria(
+            TenantScoped,
+            lambda cls: cls.tenant_id == tenant_id,
+            include_aliases=True
+        ))
+
+
+def _assign_tenant(session, instance):
+    # В момент session.add, а не при flush: сессия общая, и flush может
+    # случиться в обработчике другого арендатора
+    if isinstance(instance, TenantScoped) and instance.tenant_id is None:
+        instance.tenant_id = get_tenant_id()
+
+
+def install_tenant_filter():
+    """Подключает ограничение по арендатору ко всем сессиям процесса"""
+    if not event.contains(Session, 'do_orm_execute', _limit_to_tenant):
+        event.listen(Session, 'do_orm_execute', _limit_to_tenant)
+        event.listen(Session, 'transient_to_pending', _assign_tenant)
+
+
+def seed_default_tenant(session):
+    """
+    Арендатор по умолчанию из Config (BOT_TOKEN, ADMIN_ID, приватный канал).
+    Создается при первом запуске и синхронизируется с конфигурацией при
+    каждом; строки, созданные до арендаторов, переходят к нему.
+    """
+    global _default_tenant_id
+
+    tenant = session.query(Tenant).filter_by(key=DEFAULT_TENANT_KEY).first()
+    if not tenant:
+        tenant = Tenant(key=DEFAULT_TENANT_KEY, name=DEFAULT_TENANT_KEY)
+        session.add(tenant)
+    tenant.bot_token = Config.BOT_TOKEN
+    tenant.admin_id = Config.ADMIN_ID
+    tenant.private_channel_id = Config.PRIVATE_CHANNEL_ID
+    tenant.private_channel_link = Config.PRIVATE_CHANNEL_LINK
+    try:
+        session.commit()
+    except Exception as e:
+        session.rollback()
+        raise e
+
+    _default_tenant_id = tenant.id
+    ensure_tenant_keys(session.get_bind(), tenant.id)
+    return tenant
+
+
+def active_tenants(session):
+    return session.query(Tenant).filter_by(is_active=True).order_by(Tenant.id).all()
+
+
+class TenantConfig:
+    """Config, в котором токен, администратор и приватный канал - арендатора"""
+
+    def __init__(self, tenant):
+        self.TENANT_ID = tenant.id
+        self.BOT_TOKEN = tenant.bot_token
+        self.ADMIN_ID = tenant.admin_id
+        self.PRIVATE_CHANNEL_ID = tenant.private_channel_id or ''
+        self.PRIVATE_CHANNEL_LINK = tenant.private_channel_link or ''
+
+    def __getattr__(self, name):
+        return getattr(Config, name)
+
+
+class TenantRegistry:
+    """
+    Запущенные боты по tenant_id: (TelegramBot, Application). Бот виден общим
+    службам от post_init до post_stop, а общие службы живут, пока не завершен
+    (post_shutdown) последний бот процесса.
+    """
+
+    def __init__(self):
+        self._hosted = {}
+        self._attached = set()
+
+    def register(self, tenant_id, bot, application):
+        self._hosted[tenant_id] = (bot, application)
+        self._attached.add(tenant_id)
+
+    def unregister(self, tenant_id):
+        """Бот остановлен; возвращает, сколько ботов еще работает"""
+        self._hosted.pop(tenant_id, None)
+        return len(self._hosted)
+
+    def release(self, tenant_id):
+        """Бот завершен; возвращает, сколько ботов еще не завершено"""
+        self._hosted.pop(tenant_id, None)
+        self._attached.discard(tenant_id)
+        return len(self._attached)
+
+    def get(self, tenant_id):
+        return self._hosted.get(tenant_id)
+
+    def tenant_ids(self):
+        return set(self._hosted)
+
+    def items(self):
+        return list(self._hosted.items())
+
+    def __len__(self):
+        return len(self._hosted)
+
+
+registry = TenantRegistry()
+
+
+if __name__ == '__main__':
+    import sys
+
+    from database import init_db
+
+    from tariffs import tariff_cache
+
+    session = init_db()
+    seed_default_tenant(session)
+    command, args = (sys.argv[1], sys.argv[2:]) if len(sys.argv) > 1 else ('list', [])
+
+    if command == 'list':
+        for tenant in session.query(Tenant).order_by(Tenant.id):
+            status = "активен" if tenant.is_active else "отключен"
+            print(f"{tenant.id}\t{tenant.key}\tадмин {tenant.admin_id}\t{status}")
+    elif command == 'add' and 3 <= len(args) <= 5:
+        key, token, admin_id, *channel = args
+        session.add(Tenant(
+            key=key,
+            name=key,
+            bot_token=token,
+            admin_id=int(admin_id),
+            private_channel_id=channel[0] if channel else None,
+            private_channel_link=channel[1] if len(channel) > 1 else None
+        ))
+        session.commit()
+        tariff_cache.seed(session)
+        print(f"✅ Арендатор {key} добавлен с тарифами из конфигурации. Бот запустится при перезапуске (MULTI_TENANT=1)")
+    elif command == 'disable' and len(args) == 1:
+        updated = session.query(Tenant).filter_by(key=args[0]).update({Tenant.is_active: False})
+        session.commit()
+        print("✅ Арендатор отключен" if updated else "❌ Арендатор не найден")
+    else:
+        print(__doc__)
+        sys.exit(1)
@@ -0,0 +1,36 @@
+import os
+import sys
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import Base, Tenant, configure_sqlite
+
+
+@pytest.fixture
+def engine(tmp_path):
+    """Файловая SQLite с рабочим профилем, как в init_db"""
+    engine = create_engine(f"sqlite:///{tmp_path / 'bot.db'}", connect_args={'check_same_thread': False})
+    configure_sqlite(engine)
+    Base.metadata.create_all(engine)
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def Session(engine):
+    return sessionmaker(bind=engine)
+
+
+@pytest.fixture
+def tenant_id(Session):
+    session = Session()
+    tenant = Tenant(key='default', name='default', bot_token='token', admin_id=1)
+    session.add(tenant)
+    session.commit()
+    tenant_id = tenant.id
+    session.close()
+    return tenant_id
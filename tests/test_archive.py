@@ -0,0 +1,101 @@
+import gzip
+import json
+from datetime import datetime, timedelta
+
+from archive import Archiver
+from config import Config
+from database import MediaFile, Payment, PostContent, ScheduledPost, StatsRollup, User, UserChannel
+
+
+def _read_archive(directory, table):
+    rows = []
+    for path in sorted((directory / table).glob('*.ndjson.gz')):
+        with gzip.open(path, 'rt') as f:
+            rows.extend(json.loads(line) for line in f)
+    return rows
+
+
+def test_archive_moves_old_published_posts_and_completed_payments(Session, tenant_id, tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, 'ARCHIVE_DIR', str(tmp_path / 'archive'))
+    monkeypatch.setattr(Config, 'ARCHIVE_BATCH_SIZE', 2)
+    old = datetime.utcnow() - timedelta(days=Config.ARCHIVE_AFTER_DAYS + 5)
+    recent = datetime.utcnow() - timedelta(days=1)
+
+    session = Session()
+    user = User(tenant_id=tenant_id, telegram_id=1)
+    channel = UserChannel(tenant_id=tenant_id, user=user, channel_id='@c')
+    session.add_all([user, channel])
+    session.add_all([
+        ScheduledPost(tenant_id=tenant_id, user=user, channel=channel, content=f'старый {i}', schedule_time=old,
+                      is_published=True)
+        for i in range(3)
+    ] + [
+        ScheduledPost(tenant_id=tenant_id, user=user, channel=channel, content='свежий', schedule_time=recent,
+                      is_published=True),
+        ScheduledPost(tenant_id=tenant_id, user=user, channel=channel, content='не опубликован', schedule_time=old),
+        Payment(tenant_id=tenant_id, user=user, amount=100, tariff='basic', is_completed=True, created_at=old),
+        Payment(tenant_id=tenant_id, user=user, amount=500, tariff='pro', created_at=old),
+    ])
+    session.commit()
+    session.close()
+
+    archiver = Archiver(Session.kw['bind'])
+    assert archiver.run() == {'scheduled_posts': 3, 'payments': 1}
+    # Повторный запуск ничего не переносит и не меняет итоги
+    assert archiver.run() == {'scheduled_posts': 0, 'payments': 0}
+
+    session = Session()
+    assert {p.content for p in session.query(ScheduledPost)} == {'свежий', 'не опубликован'}
+    assert [p.amount for p in session.query(Payment)] == [500]
+    rollups = session.query(StatsRollup.name, StatsRollup.value).filter_by(tenant_id=tenant_id)
+    assert dict(rollups.all()) == {'published_posts': 3, 'completed_payments': 1, 'revenue': 100}
+    session.close()
+
+    archived = _read_archive(tmp_path / 'archive', 'scheduled_posts')
+    assert sorted(row['content'] for row in archived) == ['старый 0', 'старый 1', 'старый 2']
+    assert [row['amount'] for row in _read_archive(tmp_path / 'archive', 'payments')] == [100]
+
+
+def test_archive_sweeps_orphaned_contents_and_media(Session, tenant_id, tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, 'ARCHIVE_DIR', str(tmp_path / 'archive'))
+    old = datetime.utcnow() - timedelta(days=Config.ARCHIVE_AFTER_DAYS + 5)
+
+    session = Session()
+    user = User(tenant_id=tenant_id, telegram_id=1)
+    channel = UserChannel(tenant_id=tenant_id, user=user, channel_id='@c')
+    photo = MediaFile(tenant_id=tenant_id, file_unique_id='u1', media_type='photo', file_id='f1', created_at=old)
+    archived_only = PostContent(tenant_id=tenant_id, content_hash='a', content='старый', media_type='photo',
+                                media=photo, created_at=old)
+    shared = PostContent(tenant_id=tenant_id, content_hash='b', content='общий', created_at=old)
+    fresh = PostContent(tenant_id=tenant_id, content_hash='c', content='без поста')
+    session.add_all([user, channel, photo, archived_only, shared, fresh])
+    session.flush()
+
+    def post(body, published, when):
+        return ScheduledPost(tenant_id=tenant_id, user=user, channel=channel, content_id=body.id,
+                             schedule_time=when, is_published=published)
+
+    session.add_all([
+        post(archived_only, True, old),
+        post(shared, True, old),
+        post(shared, False, datetime.utcnow() + timedelta(days=1)),
+    ])
+    session.commit()
+    archived_only_id, shared_id, fresh_id, photo_id = archived_only.id, shared.id, fresh.id, photo.id
+    session.close()
+
+    moved = Archiver(Session.kw['bind']).run()
+    assert moved['scheduled_posts'] == 2
+
+    session = Session()
+    contents = {c.id for c in session.query(PostContent)}
+    # Тело только архивного поста удалено, тело живого поста и свежее - нет
+    assert contents == {shared_id, fresh_id}
+    assert session.query(MediaFile).filter_by(id=photo_id).count() == 0
+    session.close()
+
+    # Архивная строка сохранила текст и медиа удаленного тела
+    archived = {row['content_id']: row for row in _read_archive(tmp_path / 'archive', 'scheduled_posts')}
+    assert archived[archived_only_id]['content'] == 'старый'
+    assert archived[archived_only_id]['media_type'] == 'photo'
+    assert archived[archived_only_id]['media_file_id'] == 'f1'
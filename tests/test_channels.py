@@ -0,0 +1,53 @@
+import asyncio
+from types import SimpleNamespace
+
+from telegram.constants import ChatMemberStatus, ChatType
+from telegram.error import BadRequest
+
+from channels import check_user_rights
+
+CHANNEL = SimpleNamespace(id=-100, type=ChatType.CHANNEL)
+GROUP = SimpleNamespace(id=-200, type=ChatType.SUPERGROUP)
+
+
+class FakeBot:
+    def __init__(self, member=None, error=None):
+        self.member = member
+        self.error = error
+        self.calls = []
+
+    async def get_chat_member(self, chat_id, user_id):
+        self.calls.append((chat_id, user_id))
+        if self.error:
+            raise self.error
+        return self.member
+
+
+def _check(bot, chat=CHANNEL, user_id=7):
+    return asyncio.run(check_user_rights(bot, chat, user_id))
+
+
+def test_owner_and_posting_admin_may_add_channel():
+    owner = FakeBot(SimpleNamespace(status=ChatMemberStatus.OWNER))
+    assert _check(owner) == (True, None)
+    assert owner.calls == [(CHANNEL.id, 7)]
+
+    admin = FakeBot(SimpleNamespace(status=ChatMemberStatus.ADMINISTRATOR, can_post_messages=True))
+    assert _check(admin) == (True, None)
+
+    group_admin = FakeBot(SimpleNamespace(status=ChatMemberStatus.ADMINISTRATOR, can_post_messages=None))
+    assert _check(group_admin, chat=GROUP) == (True, None)
+
+
+def test_subscriber_or_admin_without_posting_is_rejected():
+    subscriber = FakeBot(SimpleNamespace(status=ChatMemberStatus.MEMBER))
+    ok, reason = _check(subscriber)
+    assert not ok and "не администратор" in reason
+
+    admin = FakeBot(SimpleNamespace(status=ChatMemberStatus.ADMINISTRATOR, can_post_messages=False))
+    ok, reason = _check(admin)
+    assert not ok and "права публикации" in reason
+
+    unknown = FakeBot(error=BadRequest("User not found"))
+    ok, reason = _check(unknown)
+    assert not ok and "User not found" in reason
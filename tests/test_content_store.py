@@ -0,0 +1,100 @@
+from datetime import datetime
+
+from sqlalchemy import event
+
+from content_store import content_hash, get_or_create_content, remember_sent_media
+from database import MediaFile, PostContent, ScheduledPost
+from tenancy import install_tenant_filter, tenant_scope
+
+
+def test_same_body_is_stored_once(Session):
+    session = Session()
+    promo = get_or_create_content(session, 'промо')
+    assert get_or_create_content(session, 'промо') is promo
+
+    photo = get_or_create_content(session, 'промо', 'photo', 'u1', 'f1')
+    video = get_or_create_content(session, 'промо', 'video', 'u2', 'f2')
+    same_photo = get_or_create_content(session, 'другая подпись', 'photo', 'u1', 'f1-new')
+    session.commit()
+
+    assert len({promo.id, photo.id, video.id, same_photo.id}) == 4
+    # Одно медиа на file_unique_id, file_id первой загрузки
+    assert photo.media is same_photo.media
+    assert session.query(MediaFile).filter_by(file_unique_id='u1').one().file_id == 'f1'
+    assert session.query(PostContent).count() == 4
+    session.close()
+
+
+def test_post_resolves_body_and_legacy_columns(Session):
+    session = Session()
+    body = get_or_create_content(session, 'подпись', 'photo', 'u1', 'f1')
+    new = ScheduledPost(content_id=body.id, schedule_time=datetime.utcnow())
+    legacy = ScheduledPost(content='старый', media_type='video', media_file_id='v1',
+                           schedule_time=datetime.utcnow())
+    session.add_all([new, legacy])
+    session.commit()
+
+    assert new.resolved_content() == ('подпись', 'photo', 'f1')
+    assert legacy.resolved_content() == ('старый', 'video', 'v1')
+    session.close()
+
+
+def test_sent_file_id_is_remembered(Session):
+    session = Session()
+    body = get_or_create_content(session, 'подпись', 'photo', 'u1', 'f1')
+    session.commit()
+    remember_sent_media(session, body.media_id, 'f2')
+    session.commit()
+
+    media = session.query(MediaFile).one()
+    session.refresh(media)
+    assert media.file_id == 'f2' and media.validated_at
+    session.close()
+
+
+def test_savepoint_insert_stays_in_session_transaction(Session, tenant_id):
+    install_tenant_filter()
+    session = Session()
+    with tenant_scope(tenant_id):
+        body = get_or_create_content(session, 'текст')
+        assert body.id
+        session.rollback()
+
+    # На pysqlite RELEASE без BEGIN закоммитил бы тело отдельно от поста
+    other = Session()
+    assert other.query(PostContent).count() == 0
+    other.close()
+    session.close()
+
+
+def test_concurrent_insert_returns_existing_row(Session, tenant_id):
+    install_tenant_filter()
+    session = Session()
+    rival = Session()
+    raced = []
+
+    @event.listens_for(session, 'do_orm_execute')
+    def insert_between_select_and_insert(state):
+        # Первый SELECT ничего не находит, после него другой процесс успевает
+        # вставить то же тело
+        if raced or not state.is_select:
+            return None
+        raced.append(True)
+        result = state.invoke_statement().freeze()
+        with tenant_scope(tenant_id):
+            rival.add(PostContent(content_hash=content_hash('промо'), content='промо'))
+            rival.commit()
+        return result()
+
+    with tenant_scope(tenant_id):
+        body = get_or_create_content(session, 'промо')
+        existing_id = rival.query(PostContent.id).scalar()
+        assert raced and body.id == existing_id
+
+        # Транзакция сессии пережила IntegrityError и пригодна для записи
+        session.add(PostContent(content_hash=content_hash('еще'), content='еще'))
+        session.commit()
+        assert session.query(PostContent).count() == 2
+
+    rival.close()
+    session.close()
@@ -0,0 +1,41 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+
+from database import Tenant, User
+from expiry import KICK, REMIND, ExpiryTimeline
+
+
+def test_events_of_unhosted_tenant_wait_for_its_bot(Session, tenant_id):
+    session = Session()
+    other = Tenant(key='other', name='other', bot_token='other', admin_id=2)
+    session.add(other)
+    session.flush()
+    expired = datetime.utcnow() - timedelta(hours=3)
+    session.add_all([
+        User(tenant_id=tenant_id, telegram_id=1, subscription_end=expired, joined_channel=True),
+        User(tenant_id=other.id, telegram_id=2, subscription_end=expired, joined_channel=True),
+    ])
+    session.commit()
+
+    hosted = {tenant_id}
+    kicked = []
+
+    async def kick(user):
+        kicked.append(user.telegram_id)
+
+    async def main():
+        timeline = ExpiryTimeline(AsyncIOScheduler(timezone="UTC"))
+        timeline.start(session, {REMIND: kick, KICK: kick}, hosted=lambda: set(hosted))
+        await timeline._fire()
+        # Бот второго арендатора еще не запущен - его событие отложено, а не потеряно
+        assert kicked == [1]
+
+        hosted.add(other.id)
+        timeline.resume(other.id)
+        await timeline._fire()
+        assert kicked == [1, 2]
+
+    asyncio.run(main())
+    session.close()
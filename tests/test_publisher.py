@@ -0,0 +1,115 @@
+import asyncio
+import threading
+from datetime import datetime, timedelta
+
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+
+from database import ScheduledPost, User, UserChannel
+from publisher import Publisher
+
+
+def test_lanes_publish_due_posts_in_order(Session):
+    now = datetime.utcnow()
+    session = Session()
+    user = User(telegram_id=1)
+    first = UserChannel(user=user, channel_id='@a', channel_name='a')
+    second = UserChannel(user=user, channel_id='@b', channel_name='b')
+
+    def post(channel, due, **fields):
+        post = ScheduledPost(user=user, channel=channel, content='пост', schedule_time=due, **fields)
+        session.add(post)
+        return post
+
+    late = post(first, now + timedelta(seconds=0.4))
+    early = post(first, now - timedelta(seconds=1))
+    other = post(second, now + timedelta(seconds=0.2))
+    cancelled = post(second, now + timedelta(seconds=0.3))
+    beyond = post(first, now + timedelta(seconds=30))
+    failed = post(first, now, publish_error='нет прав')
+    session.commit()
+
+    publisher = Publisher(session, lookahead=5, concurrency=5)
+    delivered = []
+
+    async def deliver(staged):
+        delivered.append((staged.chat_id, staged.post_id, datetime.utcnow() >= staged.due))
+
+    async def main():
+        publisher.start(deliver)
+        assert publisher.staged_count == 4
+        publisher.unstage(cancelled.id)
+        for _ in range(30):
+            if not publisher.staged_count:
+                break
+            await asyncio.sleep(0.1)
+        publisher.stop()
+
+    asyncio.run(main())
+
+    # Внутри канала - по порядку schedule_time и не раньше срока
+    assert [d for d in delivered if d[0] == '@a'] == [('@a', early.id, True), ('@a', late.id, True)]
+    assert [d for d in delivered if d[0] == '@b'] == [('@b', other.id, True)]
+    assert beyond.id not in {d[1] for d in delivered} and failed.id not in {d[1] for d in delivered}
+    session.close()
+
+
+def _add_post(session, tenant_id, due):
+    user = User(tenant_id=tenant_id, telegram_id=1)
+    channel = UserChannel(tenant_id=tenant_id, user=user, channel_id='@c', channel_name='c')
+    post = ScheduledPost(tenant_id=tenant_id, user=user, channel=channel, content='пост', schedule_time=due)
+    session.add(post)
+    session.commit()
+    return post.id
+
+
+def test_interval_job_publishes_post_scheduled_beyond_lookahead(Session, tenant_id):
+    session = Session()
+    post_id = _add_post(session, tenant_id, datetime.utcnow() + timedelta(seconds=1.5))
+    publisher = Publisher(session, lookahead=1, concurrency=5)
+    delivered = []
+
+    async def deliver(staged):
+        delivered.append(staged.post_id)
+
+    async def main():
+        scheduler = AsyncIOScheduler(timezone="UTC")
+        publisher.start(deliver)
+        # При запуске пост еще вне окна - его должна выбрать периодическая задача
+        assert publisher.staged_count == 0
+        scheduler.add_job(publisher.run_tick, 'interval', seconds=1)
+        scheduler.start()
+        try:
+            for _ in range(50):
+                if delivered:
+                    break
+                await asyncio.sleep(0.1)
+        finally:
+            scheduler.shutdown(wait=False)
+            publisher.stop()
+
+    asyncio.run(main())
+    session.close()
+    assert delivered == [post_id]
+
+
+def test_tick_outside_event_loop_does_not_stage(Session, tenant_id):
+    session = Session()
+    _add_post(session, tenant_id, datetime.utcnow())
+    publisher = Publisher(session, lookahead=60, concurrency=5)
+    publisher.accepting = True
+    errors = []
+
+    def tick():
+        try:
+            publisher.tick()
+        except RuntimeError as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=tick)
+    thread.start()
+    thread.join()
+    session.close()
+
+    # Без воркера пост не помечается выбранным и достанется следующей выборке
+    assert errors
+    assert publisher.staged_count == 0
@@ -0,0 +1,20 @@
+import pytest
+
+from tariffs import parse_field_value
+
+
+@pytest.mark.parametrize('field', ['stars', 'channels_limit', 'duration_days'])
+def test_paid_fields_must_be_positive(field):
+    assert parse_field_value(field, ' 1 ') == 1
+    for raw in ('0', '-5'):
+        with pytest.raises(ValueError):
+            parse_field_value(field, raw)
+
+
+def test_other_fields_allow_zero():
+    assert parse_field_value('posts_per_day', '0') == 0
+    assert parse_field_value('sort_order', '0') == 0
+    with pytest.raises(ValueError):
+        parse_field_value('posts_per_day', '-1')
+    with pytest.raises(ValueError):
+        parse_field_value('name', '  ')
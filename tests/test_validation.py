@@ -0,0 +1,81 @@
+from datetime import datetime, timezone
+
+import pytest
+from telegram import Animation, Chat, Document, Message, PhotoSize, Sticker, Voice
+
+from bot import TelegramBot
+from validation import (
+    CAPTION_LIMIT, FIX_CLOSED, FIX_ESCAPED, TEXT_LIMIT, utf16_length, validate_post,
+)
+
+EMOJI = '😀'
+
+
+def test_utf16_length_counts_surrogate_pairs():
+    assert utf16_length('abc') == 3
+    assert utf16_length('тест') == 4
+    assert utf16_length(EMOJI) == 2
+    assert utf16_length(f'a{EMOJI}b') == 4
+
+
+def test_text_limit():
+    assert validate_post('x' * TEXT_LIMIT) == ('x' * TEXT_LIMIT, [])
+    with pytest.raises(ValueError, match='слишком длинный'):
+        validate_post('x' * (TEXT_LIMIT + 1))
+
+
+def test_caption_limit():
+    for media_type in ('photo', 'video', 'document'):
+        validate_post('x' * CAPTION_LIMIT, media_type)
+        with pytest.raises(ValueError, match='слишком длинная'):
+            validate_post('x' * (CAPTION_LIMIT + 1), media_type)
+
+
+def test_emoji_counts_twice_against_limit():
+    validate_post(EMOJI * (CAPTION_LIMIT // 2), 'photo')
+    with pytest.raises(ValueError):
+        validate_post(EMOJI * (CAPTION_LIMIT // 2) + 'x', 'photo')
+
+
+def test_markup_does_not_count_against_limit():
+    validate_post('<b>' + 'x' * TEXT_LIMIT + '</b>')
+
+
+def test_unbalanced_tags_are_closed():
+    assert validate_post('<b>жирный <i>курсив') == ('<b>жирный <i>курсив</i></b>', [FIX_CLOSED])
+    assert validate_post('<i>x</i><b>y') == ('<i>x</i><b>y</b>', [FIX_CLOSED])
+
+
+def test_stray_markup_is_escaped():
+    assert validate_post('a < b & c') == ('a &lt; b &amp; c', [FIX_ESCAPED])
+
+
+def test_empty_text():
+    with pytest.raises(ValueError, match='Пустой'):
+        validate_post('')
+    # Медиа без подписи допустимо
+    assert validate_post(None, 'photo') == ('', [])
+
+
+def test_unsupported_media_type():
+    with pytest.raises(ValueError, match='Неподдерживаемый тип медиа: voice'):
+        validate_post('подпись', 'voice')
+
+
+def _message(**attachment):
+    return Message(1, datetime.now(timezone.utc), Chat(1, Chat.PRIVATE), **attachment)
+
+
+def test_message_media_reports_unsupported_attachments():
+    media_of = lambda message: TelegramBot.message_media(None, message)[1]
+
+    assert media_of(_message(text='текст')) is None
+    assert media_of(_message(photo=[PhotoSize('s', 's', 90, 90), PhotoSize('m', 'm', 320, 320)])) == 'photo'
+    assert media_of(_message(document=Document('d', 'd'))) == 'document'
+    assert media_of(_message(voice=Voice('v', 'v', 3))) == 'voice'
+    assert media_of(_message(sticker=Sticker('s', 's', 512, 512, False, False, 'regular'))) == 'sticker'
+    # GIF приходит и как animation, и как document
+    gif = _message(animation=Animation('a', 'a', 1, 1, 1), document=Document('a', 'a'))
+    assert media_of(gif) == 'animation'
+    with pytest.raises(ValueError, match='Неподдерживаемый'):
+        validate_post(None, media_of(gif))
@@ -0,0 +1,235 @@
+"""
+Проверка поста до планирования.
+
+Посты публикуются с parse_mode=HTML, и ошибка в разметке или превышение
+лимита длины раньше всплывали только в момент публикации. Здесь текст
+разбирается тем же подмножеством HTML, что понимает Telegram: неизвестные
+теги и одиночные <, >, & экранируются, незакрытые теги закрываются, а
+длина считается по видимому тексту в UTF-16 единицах, как на сервере
+Telegram. Текст, который не помещается в лимит, отклоняется (ValueError).
+
+Разбор - один проход регулярным выражением без построения дерева.
+Замер на больших подписях: python validation.py
+"""
+
+import html
+import re
+
+TEXT_LIMIT = 4096
+CAPTION_LIMIT = 1024
+MEDIA_TYPES = ('photo', 'video', 'document')
+
+# Теги без атрибутов
+SIMPLE_TAGS = {'b', 'strong', 'i', 'em', 'u', 'ins', 's', 'strike', 'del', 'tg-spoiler', 'pre'}
+# Теги с атрибутами разбираются отдельно
+ATTRIBUTE_TAGS = {'a', 'span', 'code', 'blockquote', 'tg-emoji'}
+# Внутри них разметка не допускается (кроме <code> сразу внутри <pre>)
+LITERAL_TAGS = {'code', 'pre'}
+NAMED_ENTITIES = {'lt': '<', 'gt': '>', 'amp': '&', 'quot': '"'}
+
+TOKEN_RE = re.compile(
+    r'<(/?)([a-zA-Z][a-zA-Z0-9-]*)([^<>]*)>'
+    r'|&(?:#([0-9]{1,7})|#[xX]([0-9a-fA-F]{1,6})|([a-zA-Z][a-zA-Z0-9]*));'
+    r'|[<>&]'
+)
+ATTR_RE = re.compile(r'''([a-zA-Z][\w-]*)(?:\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s"'>]+)))?''')
+
+FIX_ESCAPED = "неподдерживаемая разметка показана как текст"
+FIX_CLOSED = "незакрытые теги закрыты"
+FIX_ATTRIBUTES = "лишние атрибуты тегов удалены"
+
+_ESCAPES = {'<': '&lt;', '>': '&gt;', '&': '&amp;'}
+
+
+def utf16_length(text):
+    """Длина строки в UTF-16 единицах (эмодзи и редкие символы - по две)"""
+    return len(text.encode('utf-16-le')) // 2
+
+
+def _parse_attributes(raw):
+    attributes = {}
+    for match in ATTR_RE.finditer(raw):
+        name, double, single, bare = match.groups()
+        value = double if double is not None else single if single is not None else bare
+        attributes[name.lower()] = html.unescape(value) if value is not None else ''
+    return attributes
+
+
+def _open_tag(name, raw_attributes, stack):
+    """
+    Нормализованный открывающий тег или None, если тег не поддерживается
+    в этом месте. Второй элемент - были ли отброшены атрибуты.
+    """
+    if stack and stack[-1] in LITERAL_TAGS:
+        if not (name == 'code' and stack[-1] == 'pre'):
+            return None, False
+    if name == 'a' and 'a' in stack:
+        return None, False
+
+    if name in SIMPLE_TAGS:
+        return f"<{name}>", bool(raw_attributes.strip())
+
+    attributes = _parse_attributes(raw_attributes)
+    if name == 'a':
+        href = attributes.pop('href', '').strip()
+        if not href:
+            return None, False
+        return f'<a href="{html.escape(href)}">', bool(attributes)
+    if name == 'span':
+        if attributes.pop('class', None) != 'tg-spoiler':
+            return None, False
+        return '<span class="tg-spoiler">', bool(attributes)
+    if name == 'tg-emoji':
+        emoji_id = attributes.pop('emoji-id', '')
+        if not emoji_id.isdigit():
+            return None, False
+        return f'<tg-emoji emoji-id="{emoji_id}">', bool(attributes)
+    if name == 'code':
+        language = attributes.pop('class', '')
+        if language.startswith('language-') and stack and stack[-1] == 'pre':
+            return f'<code class="{html.escape(language)}">', bool(attributes)
+        return '<code>', bool(attributes) or bool(language)
+    if name == 'blockquote':
+        expandable = attributes.pop('expandable', None) is not None
+        return ('<blockquote expandable>' if expandable else '<blockquote>'), bool(attributes)
+    return None, False
+
+
+def normalize_html(text):
+    """
+    Приводит текст к HTML, который примет Telegram.
+    Возвращает (html, видимый текст, список исправлений).
+    """
+    out = []
+    plain = []
+    stack = []
+    fixes = set()
+    position = 0
+
+    for match in TOKEN_RE.finditer(text):
+        start = match.start()
+        if start > position:
+            chunk = text[position:start]
+            out.append(chunk)
+            plain.append(chunk)
+        position = match.end()
+
+        token = match.group(0)
+        if len(token) == 1:
+            # Одиночный <, > или & вне тега и сущности
+            out.append(_ESCAPES[token])
+            plain.append(token)
+            if token != '>':
+                fixes.add(FIX_ESCAPED)
+            continue
+
+        if token[0] == '&':
+            decimal, hexadecimal, named = match.group(4, 5, 6)
+            if named is not None:
+                char = NAMED_ENTITIES.get(named)
+            else:
+                code = int(decimal) if decimal is not None else int(hexadecimal, 16)
+                char = chr(code) if 0 < code <= 0x10FFFF and not 0xD800 <= code <= 0xDFFF else None
+            if char is None:
+                out.append('&amp;' + token[1:])
+                plain.append(token)
+                fixes.add(FIX_ESCAPED)
+            else:
+                out.append(token)
+                plain.append(char)
+            continue
+
+        closing, name, raw_attributes = match.group(1, 2, 3)
+        name = name.lower()
+
+        if closing:
+            if name not in stack or (name not in LITERAL_TAGS and stack[-1] in LITERAL_TAGS and stack[-1] != name):
+                out.append(html.escape(token, quote=False))
+                plain.append(token)
+                fixes.add(FIX_ESCAPED)
+                continue
+            # Теги должны быть правильно вложены: закрываем всё до парного
+            while stack[-1] != name:
+                out.append(f"</{stack.pop()}>")
+                fixes.add(FIX_CLOSED)
+            stack.pop()
+            out.append(f"</{name}>")
+            continue
+
+        if name in SIMPLE_TAGS or name in ATTRIBUTE_TAGS:
+            if raw_attributes.endswith('/'):
+                tag, dropped = None, False
+            else:
+                tag, dropped = _open_tag(name, raw_attributes, stack)
+        else:
+            tag, dropped = None, False
+
+        if tag is None:
+            out.append(html.escape(token, quote=False))
+            plain.append(token)
+            fixes.add(FIX_ESCAPED)
+            continue
+        if dropped:
+            fixes.add(FIX_ATTRIBUTES)
+        out.append(tag)
+        stack.append(name)
+
+    if position < len(text):
+        chunk = text[position:]
+        out.append(chunk)
+        plain.append(chunk)
+
+    if stack:
+        fixes.add(FIX_CLOSED)
+        while stack:
+            out.append(f"</{stack.pop()}>")
+
+    return ''.join(out), ''.join(plain), sorted(fixes)
+
+
+def validate_post(text, media_type=None):
+    """
+    Проверяет пост перед планированием.
+    Возвращает (нормализованный html, список исправлений); ValueError, если
+    пост не может быть опубликован.
+    """
+    if media_type is not None and media_type not in MEDIA_TYPES:
+        raise ValueError(f"Неподдерживаемый тип медиа: {media_type}")
+
+    normalized, plain, fixes = normalize_html(text or '')
+
+    limit = CAPTION_LIMIT if media_type else TEXT_LIMIT
+    length = utf16_length(plain)
+    if length > limit:
+        message = "Подпись к медиа слишком длинная" if media_type else "Текст поста слишком длинный"
+        raise ValueError(f"{message}: {length} из {limit} символов")
+    if not media_type and not plain.strip():
+        raise ValueError("Пустой текст поста")
+
+    return normalized, fixes
+
+
+if __name__ == '__main__':
+    import time
+
+    def bench(label, text, rounds):
+        started = time.perf_counter()
+        for _ in range(rounds):
+            normalized, plain, fixes = normalize_html(text)
+        elapsed = (time.perf_counter() - started) / rounds
+        print(
+            f"{label:<28} {len(text):>7} симв. {utf16_length(plain):>7} UTF-16  "
+            f"{elapsed * 1e6:>9.1f} мкс  {len(text) / elapsed / 1e6:>6.1f} Мсимв/с  {fixes}"
+        )
+
+    fragment = (
+        '<b>Скидка 50%</b> на <i>всё</i> &amp; <a href="https://t.me/x?a=1&amp;b=2">ссылка</a> '
+        '<tg-spoiler>сюрприз</tg-spoiler> 🔥🎉 <code>x &lt; y</code>\n'
+    )
+    broken = 'Цена < 100 & скидка > 10 <br> <b>жирный <i>курсив</b> &nbsp; <span style="x">s</span>\n'
+
+    bench("подпись 1024", (fragment * 20)[:1024], 2000)
+    bench("текст 4096", (fragment * 40)[:4096], 1000)
+    bench("текст 4096 с ошибками", (broken * 60)[:4096], 1000)
+    bench("без разметки 4096", ("Обычный текст без разметки. " * 150)[:4096], 2000)
+    bench("100 КБ", fragment * 800, 20)
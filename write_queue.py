@@ -0,0 +1,125 @@
+"""
+Очередь записи в БД с одним потоком-писателем.
+
+Короткие записи из горячих путей (захват и завершение публикации, чекпоинты
+фоновых задач) выполняются в отдельном потоке своей сессией. Записи,
+пришедшие в течение WRITE_BATCH_WINDOW_MS, объединяются в одну транзакцию -
+один коммит (и один fsync на SQLite) на пачку вместо коммита на каждую.
+Каждая запись выполняется в своем savepoint, поэтому ошибка одной не
+откатывает остальные. Запись выполняется в контексте (contextvars) того,
+кто ее поставил, - в том числе от имени того же арендатора.
+"""
+
+import asyncio
+import contextvars
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from sqlalchemy.orm import sessionmaker
+
+from database import begin_savepoint
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class WriteQueue:
+    def __init__(self, engine, batch_size, window_ms):
+        self.Session = sessionmaker(bind=engine)
+        self.batch_size = batch_size
+        self.window = window_ms / 1000
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.writes = 0
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+                self._thread.start()
+
+    def submit(self, fn, *args):
+        """
+        Ставит запись в очередь. fn(session, *args) выполняется в потоке
+        писателя и не должна коммитить сама. Возвращает Future с результатом fn
+        после коммита пачки.
+        """
+        future = Future()
+        self._ensure_started()
+        self._queue.put((fn, args, future, contextvars.copy_context()))
+        return future
+
+    async def run(self, fn, *args):
+        """То же, что submit, но с ожиданием результата из event loop"""
+        return await asyncio.wrap_future(self.submit(fn, *args))
+
+    def stop(self, timeout=None):
+        """Дописывает всё, что уже в очереди, и останавливает поток"""
+        if self._thread is None or not self._thread.is_alive():
+            return
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+
+    def _collect(self):
+        """Первая запись + всё, что успело прийти за окно пачки"""
+        item = self._queue.get()
+        if item is _STOP:
+            return [], True
+
+        batch = [item]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _run(self):
+        session = self.Session()
+        try:
+            while True:
+                batch, stop = self._collect()
+                if batch:
+                    self._execute(session, batch)
+                if stop:
+                    break
+        finally:
+            session.close()
+
+    def _write(self, session, fn, args):
+        with begin_savepoint(session):
+            return fn(session, *args)
+
+    def _execute(self, session, batch):
+        done = []
+        for fn, args, future, context in batch:
+            try:
+                result = context.run(self._write, session, fn, args)
+                done.append((future, result))
+            except Exception as e:
+                future.set_exception(e)
+
+        try:
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            logger.error(f"Ошибка коммита пачки записей ({len(done)}): {e}")
+            for future, _ in done:
+                future.set_exception(e)
+            return
+
+        self.batches += 1
+        self.writes += len(done)
+        for future, result in done:
+            future.set_result(result)